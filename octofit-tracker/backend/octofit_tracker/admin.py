@@ -1,5 +1,34 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import Team, User, Workout, Activity, Leaderboard
+from . import mongo, search
+from .models import Team, TeamStanding, User, Workout, Activity, Leaderboard, Job
+
+
+class IndexedSearchMixin:
+    """Answer admin searches from the ``search`` prefix index instead of regex scans, and keep it current."""
+    search_kind = None
+
+    def search_ids(self, search_term):
+        return search.find(self.search_kind, search_term, settings.OCTOFIT_SEARCH_ADMIN_LIMIT)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(pk__in=self.search_ids(search_term)), False
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        search.index(self.search_kind, [obj], new=not change)
+
+    def delete_model(self, request, obj):
+        pk = obj.pk
+        super().delete_model(request, obj)
+        search.remove(self.search_kind, [pk])
+
+    def delete_queryset(self, request, queryset):
+        pks = list(queryset.values_list('pk', flat=True))
+        super().delete_queryset(request, queryset)
+        search.remove(self.search_kind, pks)
 
 
 @admin.register(Team)
@@ -9,27 +38,46 @@ class TeamAdmin(admin.ModelAdmin):
     list_filter = ['created_at']
 
 
+@admin.register(TeamStanding)
+class TeamStandingAdmin(admin.ModelAdmin):
+    list_display = ['team_id', 'member_count', 'active_members', 'total_calories', 'total_workouts', 'total_minutes', 'total_distance_km']
+    ordering = ['-total_calories']
+
+
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ['id', 'alias', 'name', 'email', 'team_id', 'power', 'fitness_level', 'joined_at']
     search_fields = ['name', 'alias', 'email']
+    search_kind = 'user'
     list_filter = ['team_id', 'power', 'joined_at']
 
 
 @admin.register(Workout)
-class WorkoutAdmin(admin.ModelAdmin):
+class WorkoutAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ['id', 'name', 'difficulty', 'duration_minutes', 'calories_per_session', 'created_at']
     search_fields = ['name']
+    search_kind = 'workout'
     list_filter = ['difficulty', 'created_at']
 
 
 @admin.register(Activity)
-class ActivityAdmin(admin.ModelAdmin):
+class ActivityAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ['id', 'workout_name', 'user_id', 'duration_minutes', 'calories_burned', 'distance_km', 'activity_date']
-    search_fields = ['workout_name', 'user_id']
+    search_fields = ['workout_name', 'user_id', 'notes']
+    search_kind = 'activity'
     list_filter = ['workout_name', 'activity_date']
     date_hierarchy = 'activity_date'
 
+    def search_ids(self, search_term):
+        """Match notes through the index, workout names through the workout index and user ids exactly."""
+        limit = settings.OCTOFIT_SEARCH_ADMIN_LIMIT
+        workouts = [str(pk) for pk in search.find('workout', search_term, limit)]
+        query = {'workout_id': {'$in': workouts}}
+        if search_term.strip().isdigit():
+            query = {'$or': [query, {'user_id': search_term.strip()}]}
+        matches = mongo.collection(Activity).find(query, {'_id': 0, 'id': 1}).limit(limit)
+        return super().search_ids(search_term) + [activity['id'] for activity in matches]
+
 
 @admin.register(Leaderboard)
 class LeaderboardAdmin(admin.ModelAdmin):
@@ -37,3 +85,11 @@ class LeaderboardAdmin(admin.ModelAdmin):
     search_fields = ['user_name', 'user_alias']
     list_filter = ['team_id', 'last_updated']
     ordering = ['rank']
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'status', 'attempts', 'created_at', 'started_at', 'finished_at', 'worker']
+    search_fields = ['name']
+    list_filter = ['status', 'name']
+    ordering = ['-id']
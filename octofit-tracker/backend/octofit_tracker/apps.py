@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+
+    def ready(self):
+        from pymongo import monitoring
+        from .instrumentation import CommandTimer
+
+        # Listeners only apply to clients created afterwards, so register before any connection opens.
+        monitoring.register(CommandTimer())
+
+        # Import the modules defining tasks so workers know every task name.
+        from . import denormalized, maintenance  # noqa: F401
@@ -0,0 +1,116 @@
+"""
+Hot/cold tiering of activities.
+
+``archive_activities`` moves activities dated more than
+``OCTOFIT_ARCHIVE_AFTER_DAYS`` ago out of the ``activities`` collection
+into ``activities_archive``, so the hot collection and its indexes only
+hold recent history.  The archive is created with the
+``OCTOFIT_ARCHIVE_COMPRESSOR`` block compressor.
+
+Moving an activity changes none of the totals derived from it: leaderboard
+entries, standings, rollups and windows keep their values, and the full
+rebuilds read every collection returned by ``sources``.  Archived
+activities are read-only and leave the search index.  The activity list
+endpoints only see the hot collection; ``history`` and the activity export
+fall through to the archive when the requested range starts before the
+archive watermark.
+"""
+import heapq
+from datetime import timedelta
+
+from django.conf import settings
+from pymongo.errors import BulkWriteError, CollectionInvalid
+
+from . import events, mongo, search
+from .models import Activity
+
+ARCHIVE = 'activities_archive'
+STATE = 'activities_archive_state'
+
+DUPLICATE_KEY = 11000
+
+
+def sources():
+    """Return the hot and archive activity collections, for reads that need every activity."""
+    return [mongo.collection(Activity), mongo.get_db()[ARCHIVE]]
+
+
+def watermark():
+    """Return the date before which activities may have been archived, or None."""
+    state = mongo.get_db()[STATE].find_one({'_id': 'watermark'})
+    return state['before'] if state else None
+
+
+def reaches_archive(start):
+    """Return True if activities from ``start`` on (None for no bound) may include archived ones."""
+    before = watermark()
+    return before is not None and (start is None or start < before)
+
+
+def ensure_collection():
+    """Create the archive collection, with block compression if configured, unless it exists."""
+    db = mongo.get_db()
+    if ARCHIVE in db.list_collection_names():
+        return
+    compressor, options = settings.OCTOFIT_ARCHIVE_COMPRESSOR, {}
+    if compressor:
+        options['storageEngine'] = {'wiredTiger': {'configString': f'block_compressor={compressor}'}}
+    try:
+        db.create_collection(ARCHIVE, **options)
+    except CollectionInvalid:
+        # Created by a concurrent run.
+        pass
+
+
+def archive_activities(before=None, batch_size=None):
+    """
+    Move activities dated before ``before`` into the archive and return how many moved.
+
+    ``before`` defaults to ``OCTOFIT_ARCHIVE_AFTER_DAYS`` ago.  Each batch
+    is copied before it is deleted and copies keep their ``_id``, so an
+    interrupted run is finished by running it again.  The watermark is
+    raised first, so reads fall through to the archive while rows move.
+    """
+    before = before or mongo.now() - timedelta(days=settings.OCTOFIT_ARCHIVE_AFTER_DAYS)
+    batch_size = batch_size or settings.OCTOFIT_ARCHIVE_BATCH_SIZE
+    ensure_collection()
+    db = mongo.get_db()
+    hot, archive = mongo.collection(Activity), db[ARCHIVE]
+    db[STATE].update_one({'_id': 'watermark'}, {'$max': {'before': before}}, upsert=True)
+    moved = 0
+    while True:
+        batch = list(hot.find({'activity_date': {'$lt': before}}).sort([('activity_date', 1), ('id', 1)])
+                     .limit(batch_size))
+        if not batch:
+            return moved
+        # A rebuild reading both collections must not see a batch in both.
+        with events.writing():
+            try:
+                archive.insert_many(batch, ordered=False)
+            except BulkWriteError as error:
+                if any(row['code'] != DUPLICATE_KEY for row in error.details['writeErrors']):
+                    raise
+            hot.delete_many({'_id': {'$in': [document['_id'] for document in batch]}})
+        search.remove('activity', [document['id'] for document in batch])
+        moved += len(batch)
+
+
+def find(query, projection, descending=False, batch_size=None):
+    """
+    Return activities matching ``query`` from the hot collection and, if needed, the archive.
+
+    Results are ordered by ``activity_date`` then ``id``.  The archive is
+    only queried when the ``activity_date`` lower bound in ``query`` falls
+    before the watermark; both cursors are merged lazily.
+    """
+    direction = -1 if descending else 1
+    sort = [('activity_date', direction), ('id', direction)]
+    options = {'batch_size': batch_size} if batch_size else {}
+    start = query.get('activity_date', {}).get('$gte')
+    collections = sources() if reaches_archive(start) else sources()[:1]
+    cursors = [collection.find(query, {**projection, 'activity_date': 1, 'id': 1}, sort=sort, **options)
+               for collection in collections]
+    if len(cursors) == 1:
+        return cursors[0]
+    return heapq.merge(*cursors, key=lambda document: (document['activity_date'], document['id']),
+                       reverse=descending)
@@ -2,6 +2,12 @@
 ASGI config for octofit_tracker project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Requests served through it resolve against ``OCTOFIT_ASGI_URLCONF``, which
+sends the hot read endpoints to the async views in ``async_views``; run it
+with an ASGI server such as ``uvicorn octofit_tracker.asgi:application``.
+Streaming responses, the exports and the live update stream at
+``/api/live/``, are sent by ``streaming.StreamingASGIHandler`` without
+blocking the event loop.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
@@ -9,8 +15,12 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+
+from octofit_tracker.streaming import StreamingASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+application = StreamingASGIHandler()
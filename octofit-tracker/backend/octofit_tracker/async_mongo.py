@@ -0,0 +1,66 @@
+"""
+Non-blocking Mongo access for the async views.
+
+Motor is used when it is installed; a client is created per event loop,
+since Motor binds to the loop it first runs on.  Without Motor, each
+pymongo call runs on a worker thread through ``asyncio.to_thread`` so the
+event loop is never blocked either way.  ``asyncio.to_thread`` carries the
+request's context to the thread, so the command listener sees those
+queries; Motor's threads do not, so its calls are counted here.
+"""
+import asyncio
+import weakref
+
+from django.conf import settings
+from django.db import connections
+
+from . import instrumentation, mongo
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:
+    AsyncIOMotorClient = None
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def uses_motor():
+    """Return True if queries go through Motor rather than pymongo on threads."""
+    return AsyncIOMotorClient is not None
+
+
+def _table(model):
+    # Collections without a model, like the sync counter, are passed by name.
+    return model if isinstance(model, str) else model._meta.db_table
+
+
+def _motor_collection(model):
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncIOMotorClient(**settings.DATABASES['default'].get('CLIENT', {}))
+    return client[connections['default'].settings_dict['NAME']][_table(model)]
+
+
+async def find(model, query, projection=None, sort=None, limit=0):
+    """Return the documents of ``model``, a model or collection name, matching ``query`` as a list."""
+    if not uses_motor():
+        def run():
+            cursor = mongo.get_db()[_table(model)].find(query, projection)
+            if sort:
+                cursor = cursor.sort(sort)
+            return list(cursor.limit(limit))
+        return await asyncio.to_thread(run)
+    cursor = _motor_collection(model).find(query, projection)
+    if sort:
+        cursor = cursor.sort(sort)
+    with instrumentation.command('find', _table(model)):
+        return await cursor.limit(limit).to_list(length=None)
+
+
+async def find_one(model, query, projection=None):
+    """Return the first document of ``model``, a model or collection name, matching ``query``, or None."""
+    if not uses_motor():
+        return await asyncio.to_thread(mongo.get_db()[_table(model)].find_one, query, projection)
+    with instrumentation.command('find', _table(model)):
+        return await _motor_collection(model).find_one(query, projection)
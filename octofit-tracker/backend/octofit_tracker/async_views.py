@@ -0,0 +1,103 @@
+"""
+Async versions of the hottest read endpoints.
+
+When the app is served over ASGI, ``AsgiUrlconfMiddleware`` routes
+``/api/leaderboard/top/``, ``/api/activities/recent/`` and
+``/api/teams/<pk>/members/`` here instead of to the DRF actions.  These
+views await Mongo through ``async_mongo``, so a slow client or query ties
+up a coroutine rather than a worker thread.  Responses match the DRF
+actions: the same fast readers, ``?fields=`` and ``?limit=`` handling,
+response cache and ETags.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseBase
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+
+from . import async_mongo, caching
+from .fieldsets import requested_fields
+from .models import Activity, Leaderboard, Team, User
+from .repositories import projection
+from .serializers import (ActivitySerializer, LeaderboardSerializer, UserSerializer, activity_reader,
+                          leaderboard_reader, user_reader)
+
+
+def json_response(data, status_code=status.HTTP_200_OK, headers=None):
+    """Render data the way DRF's JSONRenderer does."""
+    response = HttpResponse(JSONRenderer().render(data), status=status_code, content_type='application/json')
+    for name, value in (headers or {}).items():
+        response[name] = value
+    return response
+
+
+def async_api_view(view):
+    """Allow only GET and HEAD, turn validation errors into 400s and render returned data as JSON."""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return json_response({'detail': f'Method "{request.method}" not allowed.'},
+                                 status.HTTP_405_METHOD_NOT_ALLOWED, {'Allow': 'GET, HEAD'})
+        try:
+            result = await view(request, *args, **kwargs)
+        except ValidationError as error:
+            return json_response(error.detail, status.HTTP_400_BAD_REQUEST)
+        return result if isinstance(result, HttpResponseBase) else json_response(result)
+    return wrapper
+
+
+def async_cached_response(*scopes):
+    """Async counterpart of ``caching.cached_response`` for views returning plain data."""
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            # Cache backends are synchronous; run them off the event loop.
+            key = await sync_to_async(caching.response_key, thread_sensitive=False)(request, scopes)
+            entry = await sync_to_async(caching.get_entry, thread_sensitive=False)(key)
+            if entry is None:
+                result = await view(request, *args, **kwargs)
+                if isinstance(result, HttpResponse):
+                    return result
+                entry = await sync_to_async(caching.set_entry, thread_sensitive=False)(key, result)
+            tag, data = entry
+            if tag in caching.if_none_match(request):
+                response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+                response['ETag'] = tag
+                return response
+            return json_response(data, headers={'ETag': tag})
+        return wrapper
+    return decorator
+
+
+@async_api_view
+@async_cached_response('leaderboard')
+async def leaderboard_top(request):
+    """Get top n entries from leaderboard."""
+    limit = int(request.GET.get('limit', 10))
+    fields = requested_fields(request, LeaderboardSerializer)
+    entries = await async_mongo.find(Leaderboard, {}, projection(LeaderboardSerializer, fields),
+                                     sort=[('rank', 1), ('id', 1)], limit=limit)
+    return leaderboard_reader.many(entries, fields)
+
+
+@async_api_view
+async def activities_recent(request):
+    """Get most recent activities."""
+    limit = int(request.GET.get('limit', 10))
+    fields = requested_fields(request, ActivitySerializer)
+    activities = await async_mongo.find(Activity, {}, projection(ActivitySerializer, fields),
+                                        sort=[('activity_date', -1), ('id', -1)], limit=limit)
+    return activity_reader.many(activities, fields)
+
+
+@async_api_view
+@async_cached_response('teams')
+async def team_members(request, pk):
+    """Get all members of a team."""
+    fields = requested_fields(request, UserSerializer)
+    if await async_mongo.find_one(Team, {'_id': pk}, {'_id': 1}) is None:
+        return json_response({'detail': 'Not found.'}, status.HTTP_404_NOT_FOUND)
+    users = await async_mongo.find(User, {'team_id': pk}, projection(UserSerializer, fields), sort=[('id', 1)])
+    return user_reader.many(users, fields)
@@ -0,0 +1,360 @@
+"""
+Benchmarks for the REST API and the data layer.
+
+Every read route registered on the API router is requested through the
+full Django stack, each ``ModelSerializer`` is timed on a page of rows, and
+the leaderboard, standings and rollup rebuilds are timed on the whole
+dataset.  ``bench_columnar`` times the vectorized recompute on synthetic
+columns far larger than a seeded database.  The endpoints with async views are also driven concurrently
+through the WSGI and ASGI handlers to compare their throughput.  Results
+are plain dicts keyed by stable labels so the JSON written by the
+``benchmark`` management command can be diffed across commits with
+``compare``.
+"""
+import asyncio
+import inspect
+import math
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import caches
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.urls import reverse
+from rest_framework import serializers as drf_serializers
+
+from . import columnar, leaderboard, mongo, rollups, serializers, standings
+from .caching import RESPONSE_CACHE
+from .models import Activity, Leaderboard, Team, User, Workout
+from .urls import router
+
+# Query parameters sent to routes that filter on a value, keyed by route name.
+QUERY_PARAMS = {
+    'user-by-team': lambda fixtures: {'team_id': fixtures['team']},
+    'user-search': lambda fixtures: {'q': 'bench'},
+    'workout-search': lambda fixtures: {'q': 'bench'},
+    'activity-search': lambda fixtures: {'q': 'bench'},
+    'workout-by-difficulty': lambda fixtures: {'difficulty': 'Hard'},
+    'workout-calorie-distribution': lambda fixtures: {'workout_id': fixtures['workout']},
+    'activity-by-user': lambda fixtures: {'user_id': fixtures['user']},
+    'leaderboard-by-team': lambda fixtures: {'team_id': fixtures['team']},
+    'leaderboard-rank': lambda fixtures: {'user_id': fixtures['user'], 'by': 'minutes'},
+    'leaderboard-window': lambda fixtures: {'period': 'month'},
+}
+
+
+def use_mongomock():
+    """Point the ORM and the native client at a shared in-memory mongomock server."""
+    try:
+        import mongomock
+    except ImportError:
+        raise ImportError('mongomock is not installed; run `pip install mongomock` or use a local mongod.')
+    import djongo.database
+
+    client = mongomock.MongoClient()
+    for connection in connections.all():
+        connection.close()
+    djongo.database.clients.clear()
+    djongo.database.MongoClient = lambda *args, **kwargs: client
+    mongo._client = client
+    return client
+
+
+def use_database(name):
+    """Switch the default connection to another database name."""
+    connection = connections['default']
+    connection.close()
+    connection.settings_dict['NAME'] = name
+
+
+def percentile(samples, pct):
+    """Return the nearest-rank percentile of already sorted samples."""
+    rank = math.ceil(pct / 100 * len(samples))
+    return samples[min(max(rank, 1), len(samples)) - 1]
+
+
+def summarize(samples):
+    """Return latency percentiles in milliseconds and throughput per second."""
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.mean(ordered) * 1000, 3),
+        'p50_ms': round(percentile(ordered, 50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 99) * 1000, 3),
+        'min_ms': round(ordered[0] * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+        'throughput_per_s': round(len(ordered) / total, 2) if total else None,
+    }
+
+
+def measure(func, iterations, warmup=0):
+    """Call ``func`` repeatedly and return the duration of each timed call."""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def fixtures():
+    """Return the ids used to fill in detail routes and query parameters."""
+    def first(model):
+        column = model._meta.pk.column
+        document = mongo.collection(model).find_one({}, {column: 1}, sort=[(column, 1)])
+        return str(document[column]) if document else None
+
+    return {
+        'team': first(Team), 'user': first(User), 'workout': first(Workout),
+        'activity': first(Activity), 'leaderboard': first(Leaderboard),
+    }
+
+
+def route_cases(fixture_ids):
+    """
+    Return ``(label, url, params)`` for every GET route on the API router.
+
+    Detail routes use the first row of their model; the label keeps the
+    ``{pk}`` placeholder so results stay comparable between datasets.
+    Routes that accept no GET are returned separately as skipped labels.
+    """
+    cases, skipped = [], []
+    for prefix, viewset, basename in router.registry:
+        pk = fixture_ids.get(basename)
+        for route in router.get_routes(viewset):
+            name = route.name.format(basename=basename)
+            detail = '{lookup}' in route.url
+            kwargs = {'pk': pk} if detail else {}
+            label_path = reverse(name, kwargs={'pk': 'PK'} if detail else {}).replace('/PK/', '/{pk}/')
+            methods = [method.upper() for method in route.mapping]
+            if 'get' not in route.mapping:
+                skipped.extend(f'{method} {label_path}' for method in methods)
+                continue
+            skipped.extend(f'{method} {label_path}' for method in methods if method != 'GET')
+            if detail and pk is None:
+                skipped.append(f'GET {label_path}')
+                continue
+            params = QUERY_PARAMS.get(name, lambda ids: {})(fixture_ids)
+            cases.append((f'GET {label_path}', reverse(name, kwargs=kwargs), params))
+    return cases, sorted(set(skipped))
+
+
+def bench_routes(iterations, warmup=1, cold_cache=False):
+    """Time every GET route, optionally clearing the response cache before each request."""
+    client = Client()
+    fixture_ids = fixtures()
+    cases, skipped = route_cases(fixture_ids)
+    results = {}
+    for label, url, params in cases:
+        def request(label=label, url=url, params=params):
+            if cold_cache:
+                caches[RESPONSE_CACHE].clear()
+            response = client.get(url, params)
+            if response.status_code != 200:
+                raise AssertionError(f'{label} returned {response.status_code}')
+            if response.streaming:
+                # Exports do their work as the body is read; draining it also closes the response.
+                for _ in response.streaming_content:
+                    pass
+        results[label] = summarize(measure(request, iterations, warmup))
+
+    results.update(bench_activity_writes(client, fixture_ids, iterations))
+    skipped = [label for label in skipped if label not in results]
+    return results, skipped
+
+
+def bench_activity_writes(client, fixture_ids, iterations):
+    """
+    Time creating, updating and deleting activities.
+
+    Each created activity is deleted again through the API, so the
+    dataset and everything derived from it end up where they started.
+    """
+    if not fixture_ids['user'] or not fixture_ids['workout']:
+        return {}
+    payload = {
+        'user_id': fixture_ids['user'], 'workout_id': fixture_ids['workout'], 'workout_name': 'Benchmark',
+        'duration_minutes': 30, 'calories_burned': 250, 'distance_km': 0.0,
+        'activity_date': '2024-01-01T10:00:00Z', 'notes': 'benchmark',
+    }
+    created, timings = [], {'POST': [], 'PATCH': [], 'DELETE': []}
+
+    def timed(method, *args, **kwargs):
+        started = time.perf_counter()
+        response = getattr(client, method.lower())(*args, **kwargs)
+        timings[method].append(time.perf_counter() - started)
+        return response
+
+    for _ in range(iterations):
+        response = timed('POST', reverse('activity-list'), payload, content_type='application/json')
+        created.append(response.json()['id'])
+    for pk in created:
+        timed('PATCH', reverse('activity-detail', args=[pk]), {'calories_burned': 300},
+              content_type='application/json')
+    for pk in created:
+        timed('DELETE', reverse('activity-detail', args=[pk]))
+
+    return {
+        'POST /api/activities/': summarize(timings['POST']),
+        'PATCH /api/activities/{pk}/': summarize(timings['PATCH']),
+        'DELETE /api/activities/{pk}/': summarize(timings['DELETE']),
+    }
+
+
+def async_cases(fixture_ids):
+    """Return ``(label, url)`` for every endpoint that has an async view under ASGI."""
+    cases = [('/api/leaderboard/top/', reverse('leaderboard-top')),
+             ('/api/activities/recent/', reverse('activity-recent'))]
+    if fixture_ids['team']:
+        cases.append(('/api/teams/{pk}/members/', reverse('team-members', args=[fixture_ids['team']])))
+    return cases
+
+
+def bench_concurrency(requests, concurrency, cold_cache=False):
+    """
+    Compare WSGI and ASGI throughput on the endpoints with async views.
+
+    ``requests`` calls per endpoint are made with ``concurrency`` in
+    flight: WSGI requests on a thread pool, the way a threaded server runs
+    them, and ASGI requests as coroutines on one event loop.  Each entry
+    adds the wall-clock ``requests_per_s`` to the latency summary.
+    """
+    local = threading.local()
+
+    def wsgi_get(url):
+        if cold_cache:
+            caches[RESPONSE_CACHE].clear()
+        if not hasattr(local, 'client'):
+            local.client = Client()
+        started = time.perf_counter()
+        response = local.client.get(url)
+        elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise AssertionError(f'WSGI {url} returned {response.status_code}')
+        return elapsed
+
+    async def asgi_run(url):
+        client, gate = AsyncClient(), asyncio.Semaphore(concurrency)
+
+        async def get():
+            async with gate:
+                if cold_cache:
+                    caches[RESPONSE_CACHE].clear()
+                started = time.perf_counter()
+                response = await client.get(url)
+                elapsed = time.perf_counter() - started
+            if response.status_code != 200 or not response.resolver_match.url_name.startswith('async-'):
+                raise AssertionError(f'ASGI {url} returned {response.status_code}')
+            return elapsed
+
+        return await asyncio.gather(*(get() for _ in range(requests)))
+
+    def timed(run):
+        started = time.perf_counter()
+        samples = run()
+        summary = summarize(samples)
+        summary['requests_per_s'] = round(len(samples) / (time.perf_counter() - started), 2)
+        return summary
+
+    results = {}
+    for label, url in async_cases(fixtures()):
+        with ThreadPoolExecutor(concurrency) as pool:
+            results[f'WSGI GET {label}'] = timed(lambda: list(pool.map(wsgi_get, [url] * requests)))
+        results[f'ASGI GET {label}'] = timed(lambda: asyncio.run(asgi_run(url)))
+    return results
+
+
+def bench_serializers(iterations, rows=100):
+    """Time rendering ``rows`` instances with each ModelSerializer and fast reader, per object."""
+    renderers = {}
+    for name, value in inspect.getmembers(serializers):
+        if inspect.isclass(value) and issubclass(value, drf_serializers.ModelSerializer) and \
+                value.__module__ == serializers.__name__:
+            renderers[name] = (value.Meta.model, lambda instances, cls=value: cls(instances, many=True).data)
+        elif isinstance(value, serializers.FastReadSerializer):
+            renderers[name] = (value.serializer_class.Meta.model, value.many)
+
+    results = {}
+    for name, (model, render) in sorted(renderers.items()):
+        instances = list(model.objects.all()[:rows])
+        if not instances:
+            continue
+        samples = measure(lambda: render(instances), iterations, warmup=1)
+        summary = summarize(samples)
+        summary['rows'] = len(instances)
+        summary['per_object_us'] = round(statistics.median(samples) / len(instances) * 1e6, 2)
+        results[name] = summary
+    return results
+
+
+def bench_rebuilds(iterations):
+    """Time the full recomputation of every derived collection."""
+    results = {
+        'leaderboard.rebuild': summarize(measure(leaderboard.rebuild, iterations)),
+        'standings.rebuild': summarize(measure(standings.rebuild, iterations)),
+        'rollups.rebuild': summarize(measure(rollups.rebuild, iterations)),
+    }
+    if columnar.available():
+        results['columnar.rebuild'] = summarize(measure(columnar.rebuild, iterations))
+    return results
+
+
+def synthetic_columns(activities, users, teams=10, seed=42):
+    """Return random ``columnar.Columns`` and team ids for ``activities`` rows over ``users`` users."""
+    np = columnar.np
+    rng = np.random.default_rng(seed)
+    columns = columnar.Columns(
+        user_ids=np.arange(1, users + 1).astype(str),
+        user=rng.integers(0, users, activities),
+        calories=rng.integers(50, 1000, activities),
+        minutes=rng.integers(10, 120, activities),
+        distance=np.round(rng.random(activities) * 20, 2),
+    )
+    return columns, (np.arange(users) % teams).astype(str)
+
+
+def bench_columnar(sizes, users, iterations=3):
+    """
+    Time ``columnar.compute`` on synthetic columns of each size in ``sizes``.
+
+    This isolates the vectorized totals, ranks and team sums from Mongo
+    reads and writes, so sizes of millions of activities need no seeded
+    database.  Each entry adds the activities processed per second.
+    """
+    results = {}
+    for size in sizes:
+        columns, teams = synthetic_columns(size, users)
+        summary = summarize(measure(lambda: columnar.compute(columns, teams), iterations, warmup=1))
+        summary['activities_per_s'] = round(size / (summary['p50_ms'] / 1000))
+        results[f'compute {size} activities / {users} users'] = summary
+    return results
+
+
+def compare(baseline, current, threshold=0.2, metric='p95_ms'):
+    """
+    Compare two benchmark results and return the regressions.
+
+    Each entry present in both runs whose ``metric`` grew by more than
+    ``threshold`` (a fraction) is returned as a dict with the section,
+    label and both values, slowest change first.
+    """
+    regressions = []
+    for section in ('routes', 'concurrency', 'serializers', 'rebuilds', 'columnar'):
+        before, after = baseline.get(section, {}), current.get(section, {})
+        for label in sorted(set(before) & set(after)):
+            old, new = before[label].get(metric), after[label].get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if change > threshold:
+                regressions.append({
+                    'section': section, 'label': label,
+                    'baseline': old, 'current': new, 'change': round(change, 3),
+                })
+    return sorted(regressions, key=lambda row: row['change'], reverse=True)
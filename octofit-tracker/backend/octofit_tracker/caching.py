@@ -0,0 +1,135 @@
+"""
+Response caching for polled read endpoints.
+
+Responses are cached in the ``responses`` cache (see ``CACHES`` in
+settings) under a key built from the request URL and a generation token
+per scope.  Writes invalidate a scope by replacing its generation token, so
+every cached response for that scope stops matching at once.  Each cached
+response carries an ETag, and requests sending a matching If-None-Match
+get an empty 304.
+
+The default ``LocMemCache`` is private to each process, so with it the
+generation tokens are kept in the ``cache_generations`` collection
+instead: an invalidation made by ``run_worker`` or another web process
+then reaches every process at once, and only the cached bodies stay
+per process.  A shared backend (``OCTOFIT_CACHE_REDIS_URL``) keeps the
+tokens next to the bodies.
+"""
+import functools
+import hashlib
+import json
+import uuid
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from pymongo import ReturnDocument
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import mongo
+
+RESPONSE_CACHE = 'responses'
+GENERATIONS = 'cache_generations'
+
+
+def _cache():
+    return caches[RESPONSE_CACHE]
+
+
+def _process_local():
+    return isinstance(_cache(), LocMemCache)
+
+
+def _generations(scopes):
+    if not _process_local():
+        return [_cache().get_or_set(f'generation:{scope}', uuid.uuid4().hex, timeout=None) for scope in scopes]
+    collection = mongo.get_db()[GENERATIONS]
+    tokens = {row['_id']: row['token'] for row in collection.find({'_id': {'$in': list(scopes)}})}
+    for scope in scopes:
+        if scope not in tokens:
+            row = collection.find_one_and_update({'_id': scope}, {'$setOnInsert': {'token': uuid.uuid4().hex}},
+                                                 upsert=True, return_document=ReturnDocument.AFTER)
+            tokens[scope] = row['token']
+    return [tokens[scope] for scope in scopes]
+
+
+def invalidate(*scopes):
+    """Drop every cached response in the given scopes, in every process."""
+    for scope in scopes:
+        if _process_local():
+            mongo.get_db()[GENERATIONS].update_one({'_id': scope}, {'$set': {'token': uuid.uuid4().hex}}, upsert=True)
+        else:
+            _cache().set(f'generation:{scope}', uuid.uuid4().hex, timeout=None)
+
+
+def etag(data):
+    body = json.dumps(data, cls=JSONEncoder, sort_keys=True).encode()
+    return f'"{hashlib.md5(body).hexdigest()}"'
+
+
+def if_none_match(request):
+    header = request.headers.get('If-None-Match', '')
+    return {tag.strip() for tag in header.split(',') if tag.strip()}
+
+
+def response_key(request, scopes):
+    """Return the cache key of a request's response under the current scope generations."""
+    generations = ':'.join(_generations(scopes))
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'response:{generations}:{url}'
+
+
+def get_entry(key):
+    """Return the cached ``(etag, data)`` pair for a key, or None."""
+    return _cache().get(key)
+
+
+def set_entry(key, data):
+    """Cache response data under a key and return its ``(etag, data)`` pair."""
+    entry = (etag(data), data)
+    _cache().set(key, entry)
+    return entry
+
+
+def cached_response(*scopes):
+    """Cache a GET action's response data until one of ``scopes`` is invalidated."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            key = response_key(request, scopes)
+            entry = get_entry(key)
+            if entry is None:
+                response = method(view, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                entry = set_entry(key, response.data)
+            else:
+                response = Response(entry[1])
+            tag = entry[0]
+            if tag in if_none_match(request):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': tag})
+            response['ETag'] = tag
+            return response
+        return wrapper
+    return decorator
+
+
+class CacheInvalidationMixin:
+    """Invalidate ``cache_scopes`` after every write made through a viewset."""
+    cache_scopes = ()
+
+    def invalidate_cache(self):
+        invalidate(*self.cache_scopes)
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        self.invalidate_cache()
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        self.invalidate_cache()
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        self.invalidate_cache()
@@ -0,0 +1,170 @@
+"""
+Vectorized leaderboard and standings recompute.
+
+``load`` reads the hot and archived activities in batches into columnar NumPy
+arrays: a user index plus calories, minutes and distance per activity.  ``compute`` derives every user's totals with one ``bincount``
+per metric, ranks users by each metric with a ``lexsort`` and sums the
+totals per team by grouping on a team index, all in one pass over the
+columns.  ``rebuild`` writes the results back with bulk upserts through
+``leaderboard.replace_entries`` and ``standings.write``, doing the work of
+``leaderboard.rebuild`` and ``standings.rebuild`` without their
+aggregations.
+
+NumPy is optional.  Without it, or with ``OCTOFIT_COLUMNAR_REBUILD`` off,
+``enabled`` is False and callers keep using the aggregation rebuilds.
+"""
+from collections import namedtuple
+from itertools import islice
+
+from django.conf import settings
+
+from . import archive, events, leaderboard, mongo, standings
+from .models import User
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+TOTAL_FIELDS = leaderboard.TOTAL_FIELDS
+
+# One row per activity, except ``user_ids``: one row per user, indexed by ``user``.
+Columns = namedtuple('Columns', 'user_ids user calories minutes distance')
+
+# Per-user arrays aligned with ``user_ids`` and per-team arrays aligned with ``team_ids``.
+Result = namedtuple('Result', 'user_ids totals ranks team_ids team_totals')
+
+
+def available():
+    """Return True if NumPy is installed."""
+    return np is not None
+
+
+def enabled():
+    """Return True if rebuilds should go through ``rebuild`` here."""
+    return available() and settings.OCTOFIT_COLUMNAR_REBUILD
+
+
+def _batch_columns(batch, positions):
+    count = len(batch)
+    return (
+        np.fromiter((positions.setdefault(str(row['user_id']), len(positions)) for row in batch), np.int64, count),
+        np.fromiter((row.get('calories_burned') or 0 for row in batch), np.int64, count),
+        np.fromiter((row.get('duration_minutes') or 0 for row in batch), np.int64, count),
+        np.fromiter((row.get('distance_km') or 0.0 for row in batch), np.float64, count),
+    )
+
+
+def load(user_ids=(), batch_size=10000):
+    """
+    Read every hot and archived activity into ``Columns``.
+
+    The cursor is drained ``batch_size`` documents at a time and each batch
+    is turned into arrays before the next is read, so no more than one
+    batch of documents is held at once.  ``user_ids`` come first in the
+    user index, so users without activities get a row too.
+    """
+    positions = {user_id: position for position, user_id in enumerate(user_ids)}
+    chunks = []
+    for source in archive.sources():
+        cursor = source.find(
+            {}, {'_id': 0, 'user_id': 1, 'calories_burned': 1, 'duration_minutes': 1, 'distance_km': 1},
+            batch_size=batch_size,
+        )
+        while True:
+            batch = list(islice(cursor, batch_size))
+            if not batch:
+                break
+            chunks.append(_batch_columns(batch, positions))
+    if chunks:
+        arrays = [np.concatenate(parts) for parts in zip(*chunks)]
+    else:
+        arrays = [np.empty(0, dtype) for dtype in (np.int64, np.int64, np.int64, np.float64)]
+    return Columns(np.array(list(positions), dtype=str), *arrays)
+
+
+def _ranks(keys):
+    """Return the 1-based position of every row once sorted by ``keys``, last key most significant."""
+    ranks = np.empty(len(keys[0]), np.int64)
+    ranks[np.lexsort(keys)] = np.arange(1, len(ranks) + 1)
+    return ranks
+
+
+def compute(columns, teams):
+    """
+    Return every user's totals and ranks and every team's totals.
+
+    ``teams`` holds each user's team id, aligned with ``columns.user_ids``.
+    Users are ranked by each metric highest first and ties by user id, as
+    ``leaderboard.rebuild`` ranks calories; users without workouts come last,
+    in the order of ``columns.user_ids``.
+    Teams sum their members' totals, count members and count members with
+    at least one workout, as ``standings.rebuild`` does.
+    """
+    count = len(columns.user_ids)
+    user = columns.user
+    totals = {
+        'total_calories': np.bincount(user, columns.calories, count).astype(np.int64),
+        'total_workouts': np.bincount(user, minlength=count).astype(np.int64),
+        'total_minutes': np.bincount(user, columns.minutes, count).astype(np.int64),
+        'total_distance_km': np.round(np.bincount(user, columns.distance, count), 2),
+    }
+    inactive = totals['total_workouts'] == 0
+    tiebreak = np.where(inactive, np.arange(count), _ranks((columns.user_ids,)))
+    ranks = {field: _ranks((tiebreak, -values, inactive)) for field, values in totals.items()}
+
+    team_ids, team = np.unique(np.asarray(teams, dtype=str), return_inverse=True)
+    team = team.ravel()
+    team_totals = {
+        field: np.bincount(team, values, len(team_ids)).astype(values.dtype) for field, values in totals.items()
+    }
+    team_totals['total_distance_km'] = np.round(team_totals['total_distance_km'], 2)
+    team_totals['member_count'] = np.bincount(team, minlength=len(team_ids)).astype(np.int64)
+    team_totals['active_members'] = np.bincount(team, ~inactive, len(team_ids)).astype(np.int64)
+    return Result(columns.user_ids, totals, ranks, team_ids, team_totals)
+
+
+def rebuild(batch_size=10000):
+    """
+    Recompute the leaderboard and team standings from the activities.
+
+    Writes wait for the whole rebuild under ``events.rebuilding``.  Returns
+    ``(entries, teams)``, the number of leaderboard entries and standings
+    written.
+    """
+    with events.rebuilding():
+        return _rebuild(batch_size)
+
+
+def _rebuild(batch_size=10000):
+    users = {
+        str(user['id']): user
+        for user in mongo.collection(User).find({}, {'id': 1, 'name': 1, 'alias': 1, 'team_id': 1, '_id': 0})
+    }
+    columns = load(users, batch_size)
+    user_ids = columns.user_ids.tolist()
+    result = compute(columns, [users.get(user_id, {}).get('team_id') or '' for user_id in user_ids])
+
+    # Plain Python values for BSON; NumPy scalars cannot be encoded.
+    totals = {field: values.tolist() for field, values in result.totals.items()}
+    ranks = result.ranks['total_calories'].tolist()
+
+    def entries():
+        for position in np.argsort(result.ranks['total_calories']).tolist():
+            user = users.get(user_ids[position], {})
+            yield {
+                'user_id': user_ids[position],
+                'user_name': user.get('name', ''),
+                'user_alias': user.get('alias', ''),
+                'team_id': user.get('team_id', ''),
+                **{field: totals[field][position] for field in TOTAL_FIELDS},
+                'rank': ranks[position],
+            }
+
+    written = leaderboard.replace_entries(entries(), batch_size)
+    team_totals = {field: values.tolist() for field, values in result.team_totals.items()}
+    counts, sums = {}, {}
+    for position, team_id in enumerate(result.team_ids.tolist()):
+        counts[team_id] = team_totals['member_count'][position]
+        sums[team_id] = {field: team_totals[field][position] for field in TOTAL_FIELDS + ('active_members',)}
+    return written, standings.write(counts, sums)
@@ -0,0 +1,114 @@
+"""
+Propagation and verification of denormalized copies.
+
+Activities, archived activities, leaderboard and window entries carry copies of workout and user fields
+so the read path never joins.  ``COPIES`` declares each copy; when a user
+or workout changes, ``propagate`` is queued as a background task and
+rewrites the copies with ``update_many``.  ``verify`` compares every copy
+with its source and can repair drift; it backs the ``verify_denormalized``
+management command.
+
+``Leaderboard.team_id`` is kept in step synchronously by
+``events.user_updated`` because moving a user also moves team standings.
+It is declared here so verification covers it, and a repaired team
+drift triggers a standings rebuild.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from pymongo import UpdateMany
+
+from . import archive, caching, live, mongo, rollups, standings, sync, tasks, windows
+from .models import VERSIONED, Activity, Leaderboard, User, Workout
+
+Copy = namedtuple('Copy', 'source collection key fields match')
+
+COPIES = (
+    Copy(User, Leaderboard._meta.db_table, 'user_id',
+         {'user_name': 'name', 'user_alias': 'alias', 'team_id': 'team_id'}, {}),
+    Copy(User, windows.ENTRIES, 'user_id', {'user_name': 'name', 'user_alias': 'alias', 'team_id': 'team_id'}, {}),
+    Copy(Workout, Activity._meta.db_table, 'workout_id', {'workout_name': 'name'}, {}),
+    Copy(Workout, archive.ARCHIVE, 'workout_id', {'workout_name': 'name'}, {}),
+    Copy(Workout, rollups.DAILY, 'key', {'workout_name': 'name'}, {'scope': 'workout'}),
+    Copy(Workout, rollups.WEEKLY, 'key', {'workout_name': 'name'}, {'scope': 'workout'}),
+)
+
+# Copies in these collections are stamped for delta sync when rewritten.
+VERSIONED_TABLES = {model._meta.db_table for model in VERSIONED}
+
+
+def _update(copy, key, source):
+    values = {target: source.get(field) for target, field in copy.fields.items()}
+    stale = [{target: {'$ne': value}} for target, value in values.items()]
+    stamp = sync.stamp() if copy.collection in VERSIONED_TABLES else {}
+    return UpdateMany({copy.key: key, **copy.match, '$or': stale}, {'$set': {**values, **stamp}})
+
+
+def _write(copy, operations):
+    modified = 0
+    size = settings.OCTOFIT_BULK_BATCH_SIZE
+    for start in range(0, len(operations), size):
+        result = mongo.get_db()[copy.collection].bulk_write(operations[start:start + size], ordered=False)
+        modified += result.modified_count
+    return modified
+
+
+@tasks.task
+def propagate(label, pk):
+    """Rewrite every copy of one user's or workout's fields; returns the documents changed."""
+    model = {'user': User, 'workout': Workout}[label]
+    source = mongo.collection(model).find_one({'id': int(pk)})
+    if source is None:
+        return 0
+    modified = sum(_write(copy, [_update(copy, str(pk), source)]) for copy in COPIES if copy.source is model)
+    if modified:
+        caching.invalidate('leaderboard', 'teams')
+        live.hub.leaderboard_changed()
+    return modified
+
+
+def verify(repair=False):
+    """
+    Compare every copy with its source.
+
+    Returns one report per copy with the documents checked, the documents
+    and source rows that drifted, and the documents whose source no
+    longer exists.  With ``repair`` the drifted documents are rewritten.
+    """
+    db = mongo.get_db()
+    reports, teams_repaired = [], False
+    for copy in COPIES:
+        projection = dict.fromkeys(set(copy.fields.values()) | {'id'}, 1)
+        sources = {str(row['id']): row for row in mongo.collection(copy.source).find({}, projection)}
+        group = {'key': f'${copy.key}', **{target: f'${target}' for target in copy.fields}}
+        report = {
+            'source': copy.source._meta.db_table, 'collection': copy.collection, 'fields': sorted(copy.fields),
+            'checked': 0, 'drifted': 0, 'drifted_keys': 0, 'orphaned': 0, 'repaired': 0,
+        }
+        drifted, drifted_fields = set(), set()
+        for row in db[copy.collection].aggregate([
+            {'$match': copy.match},
+            {'$group': {'_id': group, 'count': {'$sum': 1}}},
+        ], allowDiskUse=True):
+            values, count = row['_id'], row['count']
+            report['checked'] += count
+            source = sources.get(str(values.get('key')))
+            if source is None:
+                report['orphaned'] += count
+                continue
+            stale = {target for target, field in copy.fields.items() if values.get(target) != source.get(field)}
+            if stale:
+                report['drifted'] += count
+                drifted.add(str(values['key']))
+                drifted_fields |= stale
+        report['drifted_keys'] = len(drifted)
+        if repair and drifted:
+            report['repaired'] = _write(copy, [_update(copy, key, sources[key]) for key in sorted(drifted)])
+            teams_repaired |= 'team_id' in drifted_fields
+        reports.append(report)
+
+    if teams_repaired:
+        standings.rebuild()
+    if repair and any(report['repaired'] for report in reports):
+        caching.invalidate('leaderboard', 'teams')
+    return reports
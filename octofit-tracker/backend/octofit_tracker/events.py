@@ -0,0 +1,99 @@
+"""
+Fan-out of Activity, User and Workout writes to the data derived from them.
+
+Viewsets and bulk ingestion call these functions after writing, so every
+write path keeps the leaderboard, rollups, team standings and search
+index in step.
+Copies of user and workout fields are refreshed in the background, and
+connected live clients are told about new activities and rank changes.
+
+Writers hold ``writing()`` from their write through its fan-out, and
+rebuilds of derived data hold ``rebuilding()``, which waits for those
+writers and keeps new ones out.  A rebuild therefore never reads a row
+whose delta is still to come, nor overwrites a delta applied meanwhile.
+"""
+from . import denormalized, leaderboard, live, mongo, rollups, search, standings, tasks, windows
+
+GATE = 'derived-data'
+
+
+def writing():
+    """Hold off rebuilds while a write and its fan-out run."""
+    return mongo.shared_lock(GATE)
+
+
+def rebuilding():
+    """Hold off writes while derived data is recomputed."""
+    return mongo.exclusive_lock(GATE)
+
+
+def activity_created(activity):
+    activities_created([activity])
+
+
+def activities_created(activities):
+    leaderboard.record_activities(activities)
+    rollups.record_activities(activities)
+    windows.record_activities(activities)
+    search.index('activity', activities, new=True)
+    live.hub.activities_created(activities)
+    live.hub.leaderboard_changed()
+
+
+def activity_updated(previous, activity):
+    leaderboard.replace_activity(previous, activity)
+    rollups.replace_activity(previous, activity)
+    windows.replace_activity(previous, activity)
+    if previous.notes != activity.notes:
+        search.index('activity', [activity])
+    live.hub.leaderboard_changed()
+
+
+def activity_deleted(activity_id, activity):
+    leaderboard.discard_activity(activity)
+    rollups.discard_activity(activity)
+    windows.discard_activity(activity)
+    search.remove('activity', [activity_id])
+    live.hub.leaderboard_changed()
+
+
+def user_created(user):
+    standings.member_joined(user.team_id)
+    search.index('user', [user], new=True)
+
+
+def user_updated(previous, user):
+    if previous.team_id != user.team_id:
+        entry = leaderboard.change_team(user.pk, user.team_id)
+        standings.member_left(previous.team_id, entry)
+        standings.member_joined(user.team_id, entry)
+        rollups.change_team(user.pk, previous.team_id, user.team_id)
+        windows.change_team(user.pk, user.team_id)
+        live.hub.leaderboard_changed()
+    # team_id moved synchronously above; only the display copies are refreshed in the background.
+    if previous.name != user.name or previous.alias != user.alias:
+        tasks.enqueue(denormalized.propagate.task_name, 'user', user.pk)
+    if (previous.name, previous.alias, previous.email) != (user.name, user.alias, user.email):
+        search.index('user', [user])
+
+
+def workout_created(workout):
+    search.index('workout', [workout], new=True)
+
+
+def workout_updated(previous, workout):
+    if previous.name != workout.name:
+        tasks.enqueue(denormalized.propagate.task_name, 'workout', workout.pk)
+        search.index('workout', [workout])
+
+
+def workout_deleted(workout_id):
+    search.remove('workout', [workout_id])
+
+
+def user_deleted(user_id, team_id):
+    entry = leaderboard.remove_user(user_id)
+    standings.member_left(team_id, entry)
+    windows.remove_user(user_id)
+    search.remove('user', [user_id])
+    live.hub.leaderboard_changed()
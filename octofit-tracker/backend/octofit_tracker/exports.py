@@ -0,0 +1,173 @@
+"""
+Streaming CSV and NDJSON exports of activities and the leaderboard.
+
+Rows are read from a server-side Mongo cursor ``OCTOFIT_EXPORT_BATCH_SIZE``
+documents at a time, rendered with the same fast readers as the list
+endpoints and encoded batch by batch, optionally through a gzip stream.
+Only one batch is ever held in memory, however many rows are exported,
+so both the export endpoints and ``export_data`` run in constant memory.
+Under ASGI, ``streaming.StreamingASGIHandler`` reads and sends the
+batches from worker threads.
+Activity exports include archived activities when their range reaches
+back past the archive watermark.
+"""
+import csv
+import io
+import json
+import zlib
+from itertools import islice
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+
+from . import archive, mongo
+from .models import Activity, Leaderboard, User
+from .repositories import projection
+from .fieldsets import requested_fields
+from .serializers import ActivitySerializer, LeaderboardSerializer, activity_reader, leaderboard_reader
+from .stats import parse_bound
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+COMPRESSIONS = ('gzip',)
+
+# Per dataset: model, serializer, reader and sort order; activities are ordered by ``archive.find``.
+DATASETS = {
+    'activities': (Activity, ActivitySerializer, activity_reader, [('activity_date', 1), ('id', 1)]),
+    'leaderboard': (Leaderboard, LeaderboardSerializer, leaderboard_reader, [('rank', 1), ('id', 1)]),
+}
+
+
+def parse_format(value):
+    """Validate an ``output`` parameter."""
+    output = value or 'csv'
+    if output not in FORMATS:
+        raise ValidationError({'output': f'Must be one of: {", ".join(FORMATS)}.'})
+    return output
+
+
+def parse_compression(value):
+    """Validate a ``compression`` parameter, returning None for uncompressed output."""
+    if not value:
+        return None
+    if value not in COMPRESSIONS:
+        raise ValidationError({'compression': f'Must be one of: {", ".join(COMPRESSIONS)}.'})
+    return value
+
+
+def build_query(dataset, params):
+    """
+    Return the Mongo filter for the ``user_id``, ``team_id``, ``start`` and ``end`` parameters.
+
+    ``start`` and ``end`` bound ``activity_date`` (end exclusive) and are
+    rejected for the leaderboard, which has no dates.  A team filter on
+    activities matches the team's current members.
+    """
+    query = {}
+    user_id, team_id = params.get('user_id'), params.get('team_id')
+    start, end = parse_bound(params.get('start'), 'start'), parse_bound(params.get('end'), 'end')
+    if dataset == 'leaderboard':
+        if start or end:
+            raise ValidationError({'start': 'The leaderboard export has no date filter.'})
+        if team_id:
+            query['team_id'] = team_id
+    else:
+        if start or end:
+            query['activity_date'] = {
+                **({'$gte': start} if start else {}), **({'$lt': end} if end else {}),
+            }
+        if team_id:
+            members = [str(user['id']) for user in mongo.collection(User).find({'team_id': team_id}, {'id': 1})]
+            query['user_id'] = {'$in': members}
+    if user_id:
+        # A user outside the requested team matches nothing.
+        query['user_id'] = user_id if user_id in query.get('user_id', {}).get('$in', [user_id]) else {'$in': []}
+    return query
+
+
+def rows(dataset, query, fields=None, batch_size=None):
+    """Yield lists of rendered rows, one list per cursor batch."""
+    model, serializer_class, reader, sort = DATASETS[dataset]
+    batch_size = batch_size or settings.OCTOFIT_EXPORT_BATCH_SIZE
+    if model is Activity:
+        cursor = archive.find(query, projection(serializer_class, fields), batch_size=batch_size)
+    else:
+        cursor = mongo.collection(model).find(query, projection(serializer_class, fields), sort=sort,
+                                              batch_size=batch_size)
+    try:
+        while True:
+            documents = list(islice(cursor, batch_size))
+            if not documents:
+                return
+            yield reader.many(documents, fields)
+    finally:
+        cursor.close()
+
+
+def encode_csv(batches, columns):
+    """Yield a CSV header and then one chunk of CSV lines per batch."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows([row[column] for column in columns] for row in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def encode_ndjson(batches, columns=None):
+    """Yield one chunk of newline-delimited JSON objects per batch."""
+    for batch in batches:
+        yield ''.join(json.dumps(row) + '\n' for row in batch).encode()
+
+
+def gzipped(chunks):
+    """Compress a stream of byte chunks into a single gzip member as they are produced."""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream(dataset, query, output='csv', compression=None, fields=None, batch_size=None):
+    """Return an iterator of encoded byte chunks for an export."""
+    columns = fields or list(DATASETS[dataset][1].Meta.fields)
+    encode = encode_csv if output == 'csv' else encode_ndjson
+    chunks = encode(rows(dataset, query, fields, batch_size), columns)
+    return gzipped(chunks) if compression == 'gzip' else chunks
+
+
+def filename(dataset, output, compression=None):
+    """Return the download file name of an export."""
+    return f'{dataset}.{output}' + ('.gz' if compression == 'gzip' else '')
+
+
+def parse(request, dataset):
+    """Validate an export request and return its ``(query, output, compression, fields)``."""
+    params = request.query_params
+    output = parse_format(params.get('output'))
+    compression = parse_compression(params.get('compression'))
+    return build_query(dataset, params), output, compression, requested_fields(request, DATASETS[dataset][1])
+
+
+def content_type(output, compression=None):
+    """Return the content type of an export."""
+    return 'application/gzip' if compression == 'gzip' else FORMATS[output]
+
+
+def response(request, dataset):
+    """Validate an export request and return a streaming download of the dataset."""
+    query, output, compression, fields = parse(request, dataset)
+    response = StreamingHttpResponse(stream(dataset, query, output, compression, fields),
+                                     content_type=content_type(output, compression))
+    response['Content-Disposition'] = f'attachment; filename="{filename(dataset, output, compression)}"'
+    return response
+
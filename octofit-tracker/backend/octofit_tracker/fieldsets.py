@@ -0,0 +1,87 @@
+"""
+Sparse fieldsets for API responses.
+
+``?fields=rank,user_alias,total_calories`` trims a response to the named
+serializer fields, and the same list is pushed down to the query so Mongo
+only returns those fields.  Fields the cursor paginator orders by are
+always fetched, since the next-page cursor is built from them, but they
+are only rendered when asked for.
+"""
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+FIELDS_PARAM = 'fields'
+
+
+def requested_fields(request, serializer_class):
+    """
+    Return the fields selected with ``?fields=``, in the serializer's order.
+
+    Returns None when the parameter is absent or empty, and raises a
+    ValidationError naming any field the serializer does not have.
+    """
+    if request is None:
+        return None
+    # DRF requests expose query_params; the async views receive plain Django requests.
+    raw = getattr(request, 'query_params', getattr(request, 'GET', {})).get(FIELDS_PARAM)
+    if not raw:
+        return None
+    names = [name.strip() for name in raw.split(',') if name.strip()]
+    available = list(serializer_class.Meta.fields)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValidationError({FIELDS_PARAM: [
+            f'Unknown field(s): {", ".join(unknown)}. Available fields: {", ".join(available)}.'
+        ]})
+    return [name for name in available if name in names]
+
+
+def fetch_fields(fields, ordering=()):
+    """Return ``fields`` plus the ordering fields a paginator needs, without duplicates."""
+    wanted = list(fields)
+    for field in ordering:
+        name = field.lstrip('-')
+        if name not in wanted:
+            wanted.append(name)
+    return wanted
+
+
+class SparseFieldsetMixin:
+    """
+    Viewset mixin applying ``?fields=`` to serializers and querysets.
+
+    Serializers and querysets are only narrowed for safe methods, so writes
+    still validate, save and return complete instances.  Actions that render another model list its
+    serializer in ``sparse_serializer_classes``.
+    """
+    sparse_serializer_classes = {}
+
+    def sparse_serializer_class(self):
+        return self.sparse_serializer_classes.get(self.action) or self.get_serializer_class()
+
+    def sparse_fields(self, serializer_class=None):
+        return requested_fields(self.request, serializer_class or self.sparse_serializer_class())
+
+    def ordering_fields(self):
+        ordering = getattr(self.paginator, 'ordering', None) or ()
+        return (ordering,) if isinstance(ordering, str) else tuple(ordering)
+
+    def fetch_fields(self, serializer_class=None, ordering=None):
+        """Return the fields to load for this request, or every serializer field."""
+        serializer_class = serializer_class or self.sparse_serializer_class()
+        fields = self.sparse_fields(serializer_class)
+        if fields is None:
+            return list(serializer_class.Meta.fields)
+        return fetch_fields(fields, self.ordering_fields() if ordering is None else ordering)
+
+    def get_serializer(self, *args, **kwargs):
+        if self.request is not None and self.request.method in SAFE_METHODS:
+            kwargs.setdefault('fields', self.sparse_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request is not None and self.request.method in SAFE_METHODS and \
+                self.action not in self.sparse_serializer_classes and self.sparse_fields():
+            queryset = queryset.only(*self.fetch_fields())
+        return queryset
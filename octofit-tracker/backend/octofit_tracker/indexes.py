@@ -0,0 +1,148 @@
+"""
+Mongo index declarations and query coverage checks.
+
+Indexes are declared next to each model as a ``mongo_indexes`` list of
+pymongo ``IndexModel`` objects.  djongo only creates indexes through
+migrations and mistranslates descending keys, so they are applied with
+the ``sync_indexes`` management command instead.
+"""
+from datetime import datetime
+
+from django.apps import apps
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from . import archive, rollups, search, sync, windows
+
+# Indexes on collections that are not backed by a model, keyed by collection name.
+EXTRA_INDEXES = {
+    archive.ARCHIVE: [
+        IndexModel([('user_id', ASCENDING), ('activity_date', DESCENDING), ('id', DESCENDING)],
+                   name='activity_user_date'),
+        IndexModel([('activity_date', DESCENDING), ('id', DESCENDING)], name='activity_date'),
+        IndexModel([('workout_id', ASCENDING)], name='activity_workout'),
+    ],
+    rollups.DAILY: [
+        IndexModel([('scope', ASCENDING), ('key', ASCENDING), ('start', ASCENDING)], name='rollup_scope_start'),
+    ],
+    rollups.WEEKLY: [
+        IndexModel([('scope', ASCENDING), ('key', ASCENDING), ('start', ASCENDING)], name='rollup_scope_start'),
+    ],
+    windows.WINDOWS: [
+        IndexModel([('period', ASCENDING), ('start', ASCENDING)], name='window_period_start'),
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=0, name='window_expiry'),
+    ],
+    windows.ENTRIES: [
+        IndexModel([('window', ASCENDING), ('total_calories', DESCENDING), ('user_id', ASCENDING)],
+                   name='window_rank'),
+        IndexModel([('user_id', ASCENDING)], name='window_user'),
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=0, name='window_expiry'),
+    ],
+    search.INDEX: [
+        IndexModel([('kind', ASCENDING), ('terms', ASCENDING), ('pk', ASCENDING)], name='search_terms'),
+    ],
+    sync.TOMBSTONES: [
+        IndexModel([('collection', ASCENDING), ('version', ASCENDING), ('pk', ASCENDING)], name='tombstone_version'),
+    ],
+}
+
+# Filter/sort shapes issued by the viewsets, used to report index coverage.
+QUERY_SHAPES = [
+    ('TeamViewSet.members', 'users', {'team_id': 'team_marvel'}, None),
+    ('TeamViewSet.standings', 'team_standings', {}, [('total_calories', -1), ('team_id', 1)]),
+    ('UserViewSet.list', 'users', {}, [('id', 1)]),
+    ('UserViewSet.by_team', 'users', {'team_id': 'team_marvel'}, [('id', 1)]),
+    ('UserViewSet.activities', 'activities', {'user_id': '1'}, [('activity_date', -1), ('id', -1)]),
+    ('WorkoutViewSet.by_difficulty', 'workouts', {'difficulty': 'Hard'}, [('id', 1)]),
+    ('ActivityViewSet.list', 'activities', {}, [('activity_date', -1), ('id', -1)]),
+    ('ActivityViewSet.by_user', 'activities', {'user_id': '1'}, [('activity_date', -1), ('id', -1)]),
+    ('ActivityViewSet.recent', 'activities', {}, [('activity_date', -1)]),
+    ('ActivityViewSet.history', archive.ARCHIVE, {'user_id': '1', 'activity_date': {'$lt': datetime(2024, 1, 1)}},
+     [('activity_date', -1), ('id', -1)]),
+    ('LeaderboardViewSet.list', 'leaderboard', {}, [('rank', 1), ('id', 1)]),
+    ('LeaderboardViewSet.top', 'leaderboard', {}, [('rank', 1)]),
+    ('LeaderboardViewSet.by_team', 'leaderboard', {'team_id': 'team_marvel'}, [('rank', 1), ('id', 1)]),
+    ('LeaderboardViewSet.window', windows.ENTRIES, {'window': 'week:2024-W01', 'total_workouts': {'$gt': 0}},
+     [('total_calories', -1), ('user_id', 1)]),
+    ('leaderboard.apply_delta', 'leaderboard', {'user_id': '1'}, None),
+    ('denormalized.propagate', 'activities', {'workout_id': '1'}, None),
+    ('UserViewSet.search', search.INDEX, {'kind': 'user', 'terms': {'$all': ['th', 'tho']}}, [('pk', 1)]),
+    ('ActivityViewSet.search', search.INDEX, {'kind': 'activity', 'terms': {'$all': ['gr']}}, [('pk', -1)]),
+    ('DeltaSyncMixin.changes', 'activities', {'version': {'$gt': 0}}, [('version', 1), ('id', 1)]),
+    ('DeltaSyncMixin.deleted', sync.TOMBSTONES, {'collection': 'activities', 'version': {'$gt': 0}},
+     [('version', 1), ('pk', 1)]),
+]
+
+
+def declared_indexes():
+    """Return the declared indexes keyed by collection name."""
+    declared = {}
+    for model in apps.get_app_config('octofit_tracker').get_models():
+        indexes = getattr(model, 'mongo_indexes', None)
+        if indexes:
+            declared.setdefault(model._meta.db_table, []).extend(indexes)
+    for name, indexes in EXTRA_INDEXES.items():
+        declared.setdefault(name, []).extend(indexes)
+    return declared
+
+
+def _key(pairs):
+    return tuple((field, int(direction) if isinstance(direction, (int, float)) else direction)
+                 for field, direction in pairs)
+
+
+def diff_indexes(db):
+    """
+    Compare declared indexes with the database.
+
+    Indexes are matched on their key pattern, so an existing index with the
+    same keys under another name counts as present.  Returns a pair of
+    lists: missing ``(collection, IndexModel)`` and undeclared
+    ``(collection, index_name)``.
+    """
+    missing, extra = [], []
+    for name, indexes in sorted(declared_indexes().items()):
+        existing = {
+            _key(info['key']): index_name
+            for index_name, info in db[name].index_information().items()
+        }
+        wanted = set()
+        for index in indexes:
+            key = _key(index.document['key'].items())
+            wanted.add(key)
+            if key not in existing:
+                missing.append((name, index))
+        for key, index_name in existing.items():
+            if key not in wanted and index_name != '_id_':
+                extra.append((name, index_name))
+    return missing, extra
+
+
+def _plan_stages(plan):
+    yield plan
+    children = list(plan.get('inputStages', []))
+    if 'inputStage' in plan:
+        children.append(plan['inputStage'])
+    for child in children:
+        yield from _plan_stages(child)
+
+
+def explain_coverage(db):
+    """Explain every query shape and report whether an index serves it."""
+    report = []
+    for label, name, query, sort in QUERY_SHAPES:
+        cursor = db[name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()['queryPlanner']['winningPlan']
+        stages = list(_plan_stages(plan))
+        names = [stage['stage'] for stage in stages]
+        index_names = [stage['indexName'] for stage in stages if 'indexName' in stage]
+        report.append({
+            'query': label,
+            'collection': name,
+            'indexed': 'COLLSCAN' not in names and bool(index_names),
+            'in_memory_sort': 'SORT' in names,
+            'index': index_names[0] if index_names else None,
+            'stages': names,
+        })
+    return report
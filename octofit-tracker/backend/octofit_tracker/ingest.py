@@ -0,0 +1,77 @@
+"""
+Bulk activity ingestion from NDJSON.
+
+Rows are read one line at a time from the request stream, validated with
+``ActivitySerializer`` and written with unordered ``insert_many`` in
+batches, bypassing djongo's per-row SQL translation.  Leaderboard totals
+and rollups are updated once per batch.
+"""
+import json
+
+from django.conf import settings
+from pymongo.errors import BulkWriteError
+from rest_framework.exceptions import ValidationError
+
+from . import events, mongo, sync
+from .models import Activity
+from .serializers import ActivitySerializer
+
+
+def ingest_activities(lines, batch_size=None):
+    """
+    Insert activities from an iterable of NDJSON lines.
+
+    Returns a summary with the number of rows received and created, and a
+    list of ``{'line': n, 'errors': ...}`` entries for rejected rows.
+    """
+    batch_size = batch_size or settings.OCTOFIT_BULK_BATCH_SIZE
+    summary = {'received': 0, 'created': 0, 'errors': []}
+    batch = []
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        summary['received'] += 1
+        batch.append((number, line))
+        if len(batch) >= batch_size:
+            _ingest_batch(batch, summary)
+            batch = []
+    if batch:
+        _ingest_batch(batch, summary)
+    return summary
+
+
+def _ingest_batch(batch, summary):
+    serializer = ActivitySerializer()
+    numbers, activities = [], []
+    for number, line in batch:
+        try:
+            data = serializer.run_validation(json.loads(line))
+        except ValueError as exc:
+            summary['errors'].append({'line': number, 'errors': {'non_field_errors': [f'Invalid JSON: {exc}']}})
+            continue
+        except ValidationError as exc:
+            summary['errors'].append({'line': number, 'errors': exc.detail})
+            continue
+        numbers.append(number)
+        activities.append(Activity(**data))
+    if not activities:
+        return
+
+    first_id = mongo.reserve_ids(Activity, len(activities))
+    for offset, activity in enumerate(activities):
+        activity.id = first_id + offset
+
+    failed = set()
+    with events.writing():
+        try:
+            mongo.collection(Activity).insert_many(
+                sync.stamp_documents([mongo.to_document(activity) for activity in activities]), ordered=False)
+        except BulkWriteError as exc:
+            for error in exc.details['writeErrors']:
+                failed.add(error['index'])
+                summary['errors'].append(
+                    {'line': numbers[error['index']], 'errors': {'non_field_errors': [error['errmsg']]}})
+
+        created = [activity for index, activity in enumerate(activities) if index not in failed]
+        summary['created'] += len(created)
+        events.activities_created(created)
@@ -0,0 +1,265 @@
+"""
+Per-request query and timing instrumentation.
+
+A pymongo command listener and a djongo execute wrapper report into the
+``RequestMetrics`` of the request being served, which is held in a
+context variable so concurrent requests never mix.  Four phases are
+tracked:
+
+* ``db`` - time spent in Mongo round trips, from the command listener;
+* ``orm`` - time djongo spends translating SQL around those round trips;
+* ``serialize`` - time spent in serializer ``to_representation``;
+* ``render`` - time DRF spends encoding the response body.
+
+``RequestMetricsMiddleware`` exposes them in a ``Server-Timing`` header
+and adds every finished request to a process-wide registry, which
+``metrics_view`` renders in the Prometheus text format.  Counters are kept
+per process, so with several workers each one reports its own share.
+"""
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.http import HttpResponse
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('octofit_request_metrics', default=None)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class RequestMetrics:
+    """Timings and query counts collected while serving one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.commands = Counter()
+        self.db = 0.0
+        self.orm = 0.0
+        self.serialize = 0.0
+        self.render = 0.0
+        self.render_started = None
+        self._depth = 0
+
+    @property
+    def duration(self):
+        return time.perf_counter() - self.started
+
+    def repeated_queries(self):
+        """Return the most repeated ``(command, collection)`` pair and its count."""
+        if not self.commands:
+            return None, 0
+        return self.commands.most_common(1)[0]
+
+
+def current():
+    """Return the metrics of the request being served, if any."""
+    return _current.get()
+
+
+def start():
+    """Start collecting metrics for a request and return the reset token."""
+    return _current.set(RequestMetrics())
+
+
+def stop(token):
+    _current.reset(token)
+
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    Add the time spent in the block to a phase of the current request.
+
+    Nested blocks are only counted once, so a list serializer and its
+    per-item calls do not add up twice.
+    """
+    metrics = _current.get()
+    if metrics is None or metrics._depth:
+        yield
+        return
+    metrics._depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics._depth -= 1
+        setattr(metrics, name, getattr(metrics, name) + time.perf_counter() - started)
+
+
+@contextlib.contextmanager
+def command(name, collection):
+    """
+    Count a Mongo command the listener cannot attribute, timing the block as its round trip.
+
+    Motor runs pymongo on its own executor threads, outside the request's
+    context, so ``async_mongo`` reports its calls through this instead.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    metrics.queries += 1
+    metrics.commands[(name, collection)] += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.db += time.perf_counter() - started
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Counts Mongo commands and their server round-trip time per request."""
+
+    def started(self, event):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.queries += 1
+            collection = event.command.get(event.command_name)
+            if not isinstance(collection, str):
+                collection = event.database_name
+            metrics.commands[(event.command_name, collection)] += 1
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+    def _finished(self, event):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.db += event.duration_micros / 1e6
+
+
+def time_orm(execute, sql, params, many, context):
+    """djongo execute wrapper attributing translation time to the ``orm`` phase."""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    db_before = metrics.db
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.orm += max(0.0, elapsed - (metrics.db - db_before))
+
+
+def server_timing(metrics):
+    """Return the ``Server-Timing`` header value for a finished request."""
+    entries = [
+        ('db', metrics.db, f'{metrics.queries} Mongo commands'),
+        ('orm', metrics.orm, 'djongo translation'),
+        ('serialize', metrics.serialize, 'DRF serializers'),
+        ('render', metrics.render, 'response rendering'),
+        ('total', metrics.duration, None),
+    ]
+    return ', '.join(
+        f'{name};dur={seconds * 1000:.2f}' + (f';desc="{desc}"' if desc else '')
+        for name, seconds, desc in entries
+    )
+
+
+def check_n_plus_one(metrics, label):
+    """Log and return True if one query shape repeats more than the configured threshold."""
+    shape, count = metrics.repeated_queries()
+    if count <= settings.OCTOFIT_N_PLUS_ONE_THRESHOLD:
+        return False
+    command, collection = shape
+    logger.warning('Possible N+1 in %s: %s on %s ran %d times', label, command, collection, count)
+    return True
+
+
+class Registry:
+    """Process-wide request counters rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = Counter()
+            self.n_plus_one = Counter()
+            self.sums = defaultdict(Counter)
+            self.buckets = defaultdict(Counter)
+
+    def observe(self, view, method, status, metrics, size, n_plus_one):
+        duration = metrics.duration
+        with self._lock:
+            self.requests[(view, method, str(status))] += 1
+            sums = self.sums[view]
+            sums['duration_seconds'] += duration
+            sums['db_seconds'] += metrics.db
+            sums['orm_seconds'] += metrics.orm
+            sums['serialize_seconds'] += metrics.serialize
+            sums['render_seconds'] += metrics.render
+            sums['queries'] += metrics.queries
+            sums['response_bytes'] += size
+            sums['count'] += 1
+            for bound in DURATION_BUCKETS:
+                if duration <= bound:
+                    self.buckets[view][bound] += 1
+            if n_plus_one:
+                self.n_plus_one[view] += 1
+
+    def render(self):
+        lines = [
+            '# HELP octofit_requests_total Requests served, by view, method and status.',
+            '# TYPE octofit_requests_total counter',
+        ]
+        with self._lock:
+            for (view, method, status), count in sorted(self.requests.items()):
+                lines.append(f'octofit_requests_total{{view="{view}",method="{method}",status="{status}"}} {count}')
+
+            lines += [
+                '# HELP octofit_request_duration_seconds Request latency, by view.',
+                '# TYPE octofit_request_duration_seconds histogram',
+            ]
+            for view in sorted(self.sums):
+                for bound in DURATION_BUCKETS:
+                    lines.append(f'octofit_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} '
+                                 f'{self.buckets[view][bound]}')
+                sums = self.sums[view]
+                lines.append(f'octofit_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {sums["count"]}')
+                lines.append(f'octofit_request_duration_seconds_sum{{view="{view}"}} {sums["duration_seconds"]:.6f}')
+                lines.append(f'octofit_request_duration_seconds_count{{view="{view}"}} {sums["count"]}')
+
+            for name, help_text in (
+                ('db_seconds', 'Time spent in Mongo round trips.'),
+                ('orm_seconds', 'Time spent in djongo query translation.'),
+                ('serialize_seconds', 'Time spent in DRF serializers.'),
+                ('render_seconds', 'Time spent rendering response bodies.'),
+                ('queries', 'Mongo commands issued.'),
+                ('response_bytes', 'Response body bytes written.'),
+            ):
+                metric = f'octofit_request_{name}_total'
+                lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+                for view in sorted(self.sums):
+                    value = self.sums[view][name]
+                    lines.append(f'{metric}{{view="{view}"}} {value:.6f}' if isinstance(value, float)
+                                 else f'{metric}{{view="{view}"}} {value}')
+
+            lines += [
+                '# HELP octofit_n_plus_one_total Requests exceeding OCTOFIT_N_PLUS_ONE_THRESHOLD repeated queries.',
+                '# TYPE octofit_n_plus_one_total counter',
+            ]
+            for view, count in sorted(self.n_plus_one.items()):
+                lines.append(f'octofit_n_plus_one_total{{view="{view}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def metrics_view(request):
+    """Expose the request registry in the Prometheus text format."""
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,256 @@
+"""
+Incremental leaderboard maintenance.
+
+Every Activity write is turned into a delta on the owning user's totals.
+Ranks are ordered by ``total_calories`` (highest first), so when a user's
+calories move from ``old`` to ``new`` only the entries whose calories lie
+between the two values change rank; they are shifted by one with a single
+range update instead of re-sorting the whole board.  Ranks by other totals
+are served from the in-memory ``ranking.index``, which is kept in step here.
+
+Rank shifts and rebuilds run under ``_locked``: a thread lock within the
+process and ``mongo.lock`` across web processes and ``run_worker``, so two
+writers never shift the same rank window at once.
+"""
+import threading
+from contextlib import contextmanager
+from itertools import chain
+
+from pymongo import ReturnDocument, UpdateOne
+
+from . import archive, events, mongo, ranking, standings, sync
+from .models import Leaderboard, User
+
+TOTAL_FIELDS = ('total_calories', 'total_workouts', 'total_minutes', 'total_distance_km')
+
+_lock = threading.Lock()
+
+
+@contextmanager
+def _locked():
+    # The thread lock keeps threads of one process from polling the Mongo lock against each other.
+    with _lock, mongo.lock('leaderboard'):
+        yield
+
+
+def activity_totals(activity):
+    """Return the leaderboard totals contributed by a single activity."""
+    return {
+        'total_calories': activity.calories_burned,
+        'total_workouts': 1,
+        'total_minutes': activity.duration_minutes,
+        'total_distance_km': activity.distance_km or 0.0,
+    }
+
+
+def negate(totals):
+    """Return the delta that removes ``totals`` from an entry."""
+    return {field: -value for field, value in totals.items()}
+
+
+def subtract(totals, previous):
+    """Return the delta that turns ``previous`` into ``totals``."""
+    return {field: totals[field] - previous[field] for field in TOTAL_FIELDS}
+
+
+def record_activities(activities):
+    """Add a batch of new activities, applying one delta per user."""
+    deltas = {}
+    for activity in activities:
+        delta = deltas.setdefault(str(activity.user_id), dict.fromkeys(TOTAL_FIELDS, 0))
+        for field, value in activity_totals(activity).items():
+            delta[field] += value
+    for user_id, delta in deltas.items():
+        apply_delta(user_id, delta)
+
+
+def discard_activity(activity):
+    """Remove a deleted activity from its user's entry."""
+    apply_delta(activity.user_id, negate(activity_totals(activity)))
+
+
+def replace_activity(previous, activity):
+    """Apply an activity update, moving its totals if the owner changed."""
+    if str(previous.user_id) != str(activity.user_id):
+        discard_activity(previous)
+        record_activities([activity])
+    else:
+        apply_delta(activity.user_id, subtract(activity_totals(activity), activity_totals(previous)))
+
+
+def apply_delta(user_id, delta):
+    """Add ``delta`` to a user's totals and re-rank the affected window."""
+    if not any(delta.values()):
+        return
+    user_id = str(user_id)
+    leaderboard = mongo.collection(Leaderboard)
+    with _locked():
+        if not _ensure_entry(leaderboard, user_id, delta):
+            return
+        before = leaderboard.find_one_and_update(
+            {'user_id': user_id},
+            {'$inc': delta, '$set': {'last_updated': mongo.now(), **sync.stamp()}},
+            return_document=ReturnDocument.BEFORE,
+        )
+        old = before['total_calories']
+        _rerank(leaderboard, user_id, before['rank'], old, old + delta.get('total_calories', 0))
+        standings.apply_delta(before['team_id'], delta, before['total_workouts'])
+        ranking.index.update(user_id, {field: before[field] + delta.get(field, 0) for field in TOTAL_FIELDS})
+
+
+def change_team(user_id, team_id):
+    """Move a user's entry to another team, returning the entry as it was."""
+    return mongo.collection(Leaderboard).find_one_and_update(
+        {'user_id': str(user_id)}, {'$set': {'team_id': team_id, **sync.stamp()}})
+
+
+def remove_user(user_id):
+    """Delete a user's entry and close the gap in the ranks, returning the entry."""
+    leaderboard = mongo.collection(Leaderboard)
+    with _locked():
+        entry = leaderboard.find_one_and_delete({'user_id': str(user_id)})
+        if entry:
+            sync.tombstone(Leaderboard._meta.db_table, [entry['id']])
+            leaderboard.update_many({'rank': {'$gt': entry['rank']}}, {'$inc': {'rank': -1}, '$set': sync.stamp()})
+            ranking.index.discard(user_id)
+    return entry
+
+
+def _ensure_entry(leaderboard, user_id, delta):
+    """
+    Create an empty entry ranked last for users not yet on the board.
+
+    Only a delta adding workouts creates one.  Edits and deletions of
+    activities whose entry is gone, typically those left behind by a
+    deleted user, are skipped instead of resurrecting the entry with
+    negative totals.  Returns False when the delta should be skipped.
+    """
+    if leaderboard.count_documents({'user_id': user_id}, limit=1):
+        return True
+    if delta.get('total_workouts', 0) <= 0:
+        return False
+    user = User.objects.filter(pk=user_id).first() if user_id.isdigit() else None
+    Leaderboard.objects.create(
+        user_id=user_id,
+        user_name=user.name if user else '',
+        user_alias=user.alias if user else '',
+        team_id=user.team_id if user else '',
+        total_calories=0,
+        total_workouts=0,
+        total_minutes=0,
+        total_distance_km=0.0,
+        rank=leaderboard.count_documents({}) + 1,
+    )
+    return True
+
+
+def _rerank(leaderboard, user_id, rank, old, new):
+    """Move an entry from ``rank`` past the entries its new total overtakes."""
+    if new > old:
+        window = {'rank': {'$lt': rank}, 'total_calories': {'$lt': new}}
+        step = 1
+    elif new < old:
+        window = {'rank': {'$gt': rank}, 'total_calories': {'$gt': new}}
+        step = -1
+    else:
+        return
+    shifted = leaderboard.update_many(window, {'$inc': {'rank': step}, '$set': sync.stamp()}).modified_count
+    if shifted:
+        leaderboard.update_one({'user_id': user_id}, {'$inc': {'rank': -step * shifted}, '$set': sync.stamp()})
+
+
+def rebuild(batch_size=10000):
+    """
+    Recompute every entry from the activities collection.
+
+    Totals come from one ``$group`` aggregation per activity collection,
+    hot and archived, summed per user and sorted by calories.  Users
+    without activities are ranked last.  Entries are written with
+    ``replace_entries``, so they keep their ids.  Writes wait for the whole
+    rebuild under ``events.rebuilding``.  Returns the number of entries
+    written.
+    """
+    with events.rebuilding():
+        return _rebuild(batch_size)
+
+
+def _rebuild(batch_size=10000):
+    users = {
+        str(user['id']): user
+        for user in mongo.collection(User).find({}, {'id': 1, 'name': 1, 'alias': 1, 'team_id': 1, '_id': 0})
+    }
+    totals = {}
+    for source in archive.sources():
+        for row in source.aggregate([
+            {'$group': {
+                '_id': '$user_id',
+                'total_calories': {'$sum': '$calories_burned'},
+                'total_workouts': {'$sum': 1},
+                'total_minutes': {'$sum': '$duration_minutes'},
+                'total_distance_km': {'$sum': {'$ifNull': ['$distance_km', 0]}},
+            }},
+        ], allowDiskUse=True):
+            summed = totals.setdefault(str(row['_id']), dict.fromkeys(TOTAL_FIELDS, 0))
+            for field in TOTAL_FIELDS:
+                summed[field] += row[field]
+
+    def entries():
+        ranked = sorted(totals.items(), key=lambda item: (-item[1]['total_calories'], item[0]))
+        idle = ((user_id, dict.fromkeys(TOTAL_FIELDS, 0)) for user_id in users if user_id not in totals)
+        for rank, (user_id, row) in enumerate(chain(ranked, idle), 1):
+            user = users.get(user_id, {})
+            yield {
+                'user_id': user_id,
+                'user_name': user.get('name', ''),
+                'user_alias': user.get('alias', ''),
+                'team_id': user.get('team_id', ''),
+                **row,
+                'total_distance_km': round(row['total_distance_km'], 2),
+                'rank': rank,
+            }
+
+    return replace_entries(entries(), batch_size)
+
+
+def replace_entries(entries, batch_size=10000):
+    """
+    Upsert precomputed ``entries`` by user and delete every other entry.
+
+    The board is never emptied: existing entries keep their ids and are
+    updated in place, new users get freshly reserved ids, and deleted
+    entries leave sync tombstones.  Callers hold ``events.rebuilding()``
+    from computing the entries on.  Returns the number of entries written.
+    """
+    leaderboard = mongo.collection(Leaderboard)
+    now = mongo.now()
+    with _locked():
+        ids = {entry['user_id']: entry['id'] for entry in leaderboard.find({}, {'user_id': 1, 'id': 1, '_id': 0})}
+        written, batch = set(), []
+        for entry in entries:
+            written.add(entry['user_id'])
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                _upsert_entries(leaderboard, batch, ids, now)
+                batch = []
+        if batch:
+            _upsert_entries(leaderboard, batch, ids, now)
+        stale = [entry_id for user_id, entry_id in ids.items() if user_id not in written]
+        for offset in range(0, len(stale), batch_size):
+            leaderboard.delete_many({'id': {'$in': stale[offset:offset + batch_size]}})
+            sync.tombstone(Leaderboard._meta.db_table, stale[offset:offset + batch_size])
+        ranking.index.invalidate()
+    return len(written)
+
+
+def _upsert_entries(leaderboard, batch, ids, now):
+    new = [entry['user_id'] for entry in batch if entry['user_id'] not in ids]
+    if new:
+        first_id = mongo.reserve_ids(Leaderboard, len(new))
+        ids.update((user_id, first_id + offset) for offset, user_id in enumerate(new))
+    first_version = sync.next_versions(len(batch))
+    leaderboard.bulk_write([
+        UpdateOne({'user_id': entry['user_id']},
+                  {'$set': {**entry, 'id': ids[entry['user_id']], 'last_updated': now,
+                            'version': first_version + offset, 'updated_at': now}}, upsert=True)
+        for offset, entry in enumerate(batch)
+    ], ordered=False)
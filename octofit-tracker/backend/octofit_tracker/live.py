@@ -0,0 +1,257 @@
+"""
+Live leaderboard and activity updates over Server-Sent Events.
+
+Writes reach ``hub`` through ``events``: new activities are queued and
+any change to leaderboard totals marks the leaderboard dirty.  While
+clients are connected, one ticker task per process wakes every
+``OCTOFIT_LIVE_TICK`` seconds, re-reads the top of the leaderboard only if
+it is dirty or the ``sync`` version counter moved, diffs it against the
+previous tick and offers the result to every subscriber.  However many writes land in a tick, each subscriber
+gets at most one update for it, and a subscriber that falls behind has
+its pending updates merged instead of queued.
+
+A leaderboard update lists the top entries that ``changed``, the user
+ids ``dropped`` from the top but still ranked below it, and the entry ids
+``deleted`` from the board, read from the ``sync`` tombstones so
+deletions made by other processes are told apart from rank churn too.
+Only the top entries are pushed: a client showing ranks below them has
+to fetch those again when users join or leave the top.
+
+``updates`` serves the stream at ``/api/live/`` under ASGI, where
+``streaming.StreamingASGIHandler`` awaits its events.  Polling the version counter lets leaderboard
+changes made by other processes (WSGI workers, ``run_worker`` jobs) reach
+the stream, but the activities channel only carries activities created in
+the same ASGI process.
+"""
+import asyncio
+import json
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.exceptions import ValidationError
+
+from . import async_mongo, sync
+from .async_views import async_api_view
+from .models import Activity, Leaderboard
+from .repositories import projection
+from .serializers import ActivitySerializer, LeaderboardSerializer, activity_reader, leaderboard_reader
+from .streaming import AsyncStreamingHttpResponse
+
+CHANNELS = ('leaderboard', 'activities')
+
+
+class Subscriber:
+    """One connected client's channels and the updates not yet sent to it."""
+
+    def __init__(self, channels):
+        self.channels = channels
+        self.ready = asyncio.Event()
+        self._changed = {}
+        self._dropped = set()
+        self._deleted = set()
+        self._activities = deque(maxlen=settings.OCTOFIT_LIVE_ACTIVITIES)
+
+    def offer(self, update):
+        """Merge a tick's update into the pending one."""
+        if 'leaderboard' in self.channels and 'leaderboard' in update:
+            changes = update['leaderboard']
+            for entry in changes['changed']:
+                self._changed[entry['user_id']] = entry
+                self._dropped.discard(entry['user_id'])
+            for user_id in changes['dropped']:
+                self._changed.pop(user_id, None)
+                self._dropped.add(user_id)
+            self._deleted.update(changes['deleted'])
+            self._changed = {user_id: entry for user_id, entry in self._changed.items()
+                             if entry['id'] not in self._deleted}
+        if 'activities' in self.channels and 'activities' in update:
+            self._activities.extend(update['activities'])
+        if self._changed or self._dropped or self._deleted or self._activities:
+            self.ready.set()
+
+    def take(self):
+        """Return the pending update and reset it."""
+        update = {}
+        if self._changed or self._dropped or self._deleted:
+            update['leaderboard'] = {
+                'changed': sorted(self._changed.values(), key=lambda entry: (entry['rank'], entry['id'])),
+                'dropped': sorted(self._dropped),
+                'deleted': sorted(self._deleted),
+            }
+        if self._activities:
+            update['activities'] = list(self._activities)
+        self._changed, self._dropped, self._deleted = {}, set(), set()
+        self._activities.clear()
+        self.ready.clear()
+        return update
+
+
+class Hub:
+    """Collects changes from any thread and fans them out to subscribers once per tick."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._dirty = False
+        self._activities = []
+        self._ranks = {}
+        self._version = None
+        self._ticker = None
+        self._loaded = None
+
+    def leaderboard_changed(self):
+        with self._lock:
+            if self._subscribers:
+                self._dirty = True
+
+    def activities_created(self, activities):
+        with self._lock:
+            if not self._subscribers:
+                return
+        rows = activity_reader.many(activities)
+        with self._lock:
+            self._activities.extend(rows)
+            del self._activities[:-settings.OCTOFIT_LIVE_ACTIVITIES]
+
+    def subscribe(self, channels):
+        """Register a subscriber on the running loop, starting the ticker if needed."""
+        subscriber = Subscriber(channels)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        if self._ticker is None or self._ticker.done():
+            self._loaded = asyncio.Event()
+            self._ticker = asyncio.get_running_loop().create_task(self._run())
+        return subscriber
+
+    async def loaded(self):
+        """Wait until the ticker has read the leaderboard that the first update is diffed against."""
+        await self._loaded.wait()
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            idle = not self._subscribers
+        if idle and self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
+
+    async def _run(self):
+        with self._lock:
+            self._dirty, self._activities = False, []
+        self._version = await current_version()
+        self._ranks = await top_entries()
+        self._loaded.set()
+        while True:
+            await asyncio.sleep(settings.OCTOFIT_LIVE_TICK)
+            await self.tick()
+
+    async def tick(self):
+        """Offer the changes since the previous tick to every subscriber."""
+        update = await self.collect()
+        if update:
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for subscriber in subscribers:
+                subscriber.offer(update)
+
+    async def collect(self):
+        """Return the changes since the previous tick, or an empty dict."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, False
+            activities, self._activities = self._activities, []
+        version, previous = await current_version(), self._version
+        deleted = []
+        if version != previous:
+            # Written by another process, or by this one since the flag was read.
+            dirty, self._version = True, version
+            deleted = await deleted_entries(previous, version) if version else []
+        update = {}
+        if dirty:
+            ranks = await top_entries()
+            changed = [entry for user_id, entry in ranks.items() if self._ranks.get(user_id) != entry]
+            dropped = [user_id for user_id, entry in self._ranks.items()
+                       if user_id not in ranks and entry['id'] not in deleted]
+            self._ranks = ranks
+            if changed or dropped or deleted:
+                update['leaderboard'] = {'changed': changed, 'dropped': dropped, 'deleted': deleted}
+        if activities:
+            update['activities'] = activities
+        return update
+
+
+hub = Hub()
+
+
+async def current_version():
+    """Return the last version drawn by any write stamped for delta sync."""
+    counter = await async_mongo.find_one(sync.COUNTER, {'_id': 'version'}, {'seq': 1})
+    return counter and counter['seq']
+
+
+async def deleted_entries(after, through):
+    """Return the ids of leaderboard entries deleted with versions after ``after`` up to ``through``."""
+    tombstones = await async_mongo.find(
+        sync.TOMBSTONES, {'collection': Leaderboard._meta.db_table, 'version': {'$gt': after or 0, '$lte': through}},
+        {'_id': 0, 'pk': 1}, sort=[('version', 1)])
+    return [tombstone['pk'] for tombstone in tombstones]
+
+
+async def top_entries():
+    """Return the top ``OCTOFIT_LIVE_LEADERBOARD_SIZE`` entries keyed by user id."""
+    entries = await async_mongo.find(Leaderboard, {}, projection(LeaderboardSerializer),
+                                     sort=[('rank', 1), ('id', 1)], limit=settings.OCTOFIT_LIVE_LEADERBOARD_SIZE)
+    return {entry['user_id']: entry for entry in leaderboard_reader.many(entries)}
+
+
+async def snapshot(channels):
+    """Return the current state of each channel, sent when a client connects."""
+    data = {}
+    if 'leaderboard' in channels:
+        data['leaderboard'] = list((await top_entries()).values())
+    if 'activities' in channels:
+        activities = await async_mongo.find(Activity, {}, projection(ActivitySerializer),
+                                            sort=[('activity_date', -1), ('id', -1)],
+                                            limit=settings.OCTOFIT_LIVE_ACTIVITIES)
+        data['activities'] = activity_reader.many(activities)
+    return data
+
+
+def event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+
+@async_api_view
+async def updates(request):
+    """Stream Server-Sent Events for the ``channels`` requested, all of them by default."""
+    names = [name.strip() for value in request.GET.getlist('channels') for name in value.split(',') if name.strip()]
+    unknown = sorted(set(names) - set(CHANNELS))
+    if unknown:
+        raise ValidationError({'channels': [f'Unknown channel: {", ".join(unknown)}.']})
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type='text/event-stream')
+    else:
+        response = AsyncStreamingHttpResponse(stream(set(names or CHANNELS)), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def stream(channels):
+    """Yield the snapshot event, then each pending update, or a keepalive when there is none for a while."""
+    subscriber = hub.subscribe(channels)
+    try:
+        await hub.loaded()
+        yield event('snapshot', await snapshot(channels))
+        while True:
+            try:
+                await asyncio.wait_for(subscriber.ready.wait(), settings.OCTOFIT_LIVE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                # A comment line keeps proxies from timing out idle streams.
+                yield b': keepalive\n\n'
+            else:
+                yield event('update', subscriber.take())
+    finally:
+        hub.unsubscribe(subscriber)
@@ -0,0 +1,58 @@
+"""
+Heavy maintenance work run as background jobs.
+
+Each function is a registered task, so it can be queued through
+``/api/jobs/`` (see ``MAINTENANCE_TASKS``) or by the endpoints that
+trigger it, and runs on a ``run_worker`` process instead of a request.
+"""
+from . import archive, caching, columnar, denormalized, leaderboard, live, rollups, search, standings, tasks, windows
+
+
+@tasks.task
+def rebuild_leaderboard():
+    """Recompute every leaderboard entry and the team standings."""
+    if columnar.enabled():
+        entries, teams = columnar.rebuild()
+    else:
+        entries = leaderboard.rebuild()
+        teams = standings.rebuild()
+    windows.reset()
+    caching.invalidate('leaderboard', 'teams')
+    live.hub.leaderboard_changed()
+    return {'entries': entries, 'teams': teams}
+
+
+@tasks.task
+def rebuild_rollups():
+    """Recompute the daily and weekly activity rollups."""
+    daily, weekly = rollups.rebuild()
+    windows.reset()
+    return {'daily': daily, 'weekly': weekly}
+
+
+@tasks.task
+def repair_denormalized():
+    """Rewrite copied user and workout fields that drifted from their source."""
+    return denormalized.verify(repair=True)
+
+
+@tasks.task
+def archive_activities():
+    """Move activities older than ``OCTOFIT_ARCHIVE_AFTER_DAYS`` into the archive collection."""
+    return {'archived': archive.archive_activities()}
+
+
+@tasks.task
+def rebuild_search_index():
+    """Recompute the search index from the users, workouts and activities."""
+    return search.rebuild()
+
+
+# Tasks clients may queue directly through POST /api/jobs/.
+MAINTENANCE_TASKS = (
+    rebuild_leaderboard.task_name,
+    rebuild_rollups.task_name,
+    repair_denormalized.task_name,
+    archive_activities.task_name,
+    rebuild_search_index.task_name,
+)
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from octofit_tracker import archive, mongo
+
+
+class Command(BaseCommand):
+    help = 'Move old activities from the activities collection into the compressed archive collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.OCTOFIT_ARCHIVE_AFTER_DAYS,
+                            help='Archive activities older than this many days')
+        parser.add_argument('--batch-size', type=int, default=settings.OCTOFIT_ARCHIVE_BATCH_SIZE,
+                            help='Activities moved per batch')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['batch_size'] < 1:
+            raise CommandError('--days must not be negative and --batch-size must be at least 1.')
+        before = mongo.now() - timedelta(days=options['days'])
+        self.stdout.write(f'Archiving activities before {before:%Y-%m-%d %H:%M}...')
+        moved = archive.archive_activities(before, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} activities.'))
@@ -0,0 +1,141 @@
+import json
+import platform
+import subprocess
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from octofit_tracker import async_mongo, benchmark, columnar, mongo
+
+
+class Command(BaseCommand):
+    help = 'Seed a benchmark database and measure API, serializer and rebuild performance'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Number of users to seed')
+        parser.add_argument('--teams', type=int, default=4, help='Number of teams to seed')
+        parser.add_argument('--activities-per-user', type=int, default=20,
+                            help='Number of activities seeded per user')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the dataset')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed calls per benchmark')
+        parser.add_argument('--rebuild-iterations', type=int, default=3, help='Timed runs of each rebuild')
+        parser.add_argument('--serializer-rows', type=int, default=100, help='Rows rendered per serializer call')
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help='Requests in flight when comparing WSGI and ASGI throughput (0 to skip)')
+        parser.add_argument('--columnar-sizes', default='',
+                            help='Comma-separated activity counts for the vectorized recompute, e.g. 1000000,10000000')
+        parser.add_argument('--columnar-users', type=int, default=100000,
+                            help='Users spread over the synthetic activities of --columnar-sizes')
+        parser.add_argument('--cold-cache', action='store_true',
+                            help='Clear the response cache before every request')
+        parser.add_argument('--database', default='octofit_benchmark',
+                            help='Database to seed and benchmark; it is dropped afterwards unless --keep is set')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark database')
+        parser.add_argument('--mongomock', action='store_true', help='Run against an in-memory mongomock server')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+        parser.add_argument('--baseline', help='Compare against a previous JSON result')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Relative p95 increase reported as a regression (default 0.2)')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Exit with an error if the baseline comparison finds regressions')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1 or options['rebuild_iterations'] < 1:
+            raise CommandError('--iterations and --rebuild-iterations must be at least 1.')
+        if options['database'] == settings.DATABASES['default']['NAME'] and not options['mongomock']:
+            raise CommandError('Refusing to seed the application database; pick another --database.')
+        try:
+            columnar_sizes = [int(size) for size in options['columnar_sizes'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError('--columnar-sizes must be a comma-separated list of integers.')
+        if columnar_sizes and not columnar.available():
+            raise CommandError('--columnar-sizes needs NumPy; run `pip install numpy`.')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as handle:
+                baseline = json.load(handle)
+
+        if options['mongomock']:
+            try:
+                benchmark.use_mongomock()
+            except ImportError as error:
+                raise CommandError(str(error))
+        benchmark.use_database(options['database'])
+
+        try:
+            self.stderr.write('Seeding benchmark dataset...')
+            call_command('populate_db', users=options['users'], teams=options['teams'],
+                         activities_per_user=options['activities_per_user'], seed=options['seed'],
+                         stdout=self.stderr)
+
+            self.stderr.write('Benchmarking routes...')
+            routes, skipped = benchmark.bench_routes(options['iterations'], cold_cache=options['cold_cache'])
+            concurrency = {}
+            if options['concurrency'] > 0:
+                self.stderr.write('Comparing WSGI and ASGI throughput...')
+                concurrency = benchmark.bench_concurrency(options['iterations'], options['concurrency'],
+                                                          cold_cache=options['cold_cache'])
+            self.stderr.write('Benchmarking serializers...')
+            serializer_results = benchmark.bench_serializers(options['iterations'], options['serializer_rows'])
+            self.stderr.write('Benchmarking rebuilds...')
+            rebuilds = benchmark.bench_rebuilds(options['rebuild_iterations'])
+            columnar_results = {}
+            if columnar_sizes:
+                self.stderr.write('Benchmarking the vectorized recompute...')
+                columnar_results = benchmark.bench_columnar(columnar_sizes, options['columnar_users'],
+                                                            options['rebuild_iterations'])
+        finally:
+            if not options['keep']:
+                mongo.get_client().drop_database(options['database'])
+
+        results = {
+            'meta': {
+                'commit': self.git_commit(),
+                'created_at': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'backend': 'mongomock' if options['mongomock'] else 'mongodb',
+                'users': options['users'],
+                'teams': options['teams'],
+                'activities_per_user': options['activities_per_user'],
+                'seed': options['seed'],
+                'iterations': options['iterations'],
+                'cold_cache': options['cold_cache'],
+                'concurrency': options['concurrency'],
+                'motor': async_mongo.uses_motor(),
+                'numpy': columnar.np.__version__ if columnar.available() else None,
+            },
+            'routes': routes,
+            'skipped_routes': skipped,
+            'concurrency': concurrency,
+            'serializers': serializer_results,
+            'rebuilds': rebuilds,
+            'columnar': columnar_results,
+        }
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
+        else:
+            self.stdout.write(output)
+
+        if baseline is not None:
+            regressions = benchmark.compare(baseline, results, options['threshold'])
+            for row in regressions:
+                self.stderr.write(self.style.WARNING(
+                    f'{row["section"]}: {row["label"]} p95 {row["baseline"]}ms -> {row["current"]}ms '
+                    f'(+{row["change"]:.0%})'
+                ))
+            if not regressions:
+                self.stderr.write(self.style.SUCCESS('No regressions against the baseline.'))
+            elif options['fail_on_regression']:
+                raise CommandError(f'{len(regressions)} benchmark(s) regressed beyond {options["threshold"]:.0%}.')
+
+    def git_commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
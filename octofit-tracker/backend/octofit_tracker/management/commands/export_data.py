@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from octofit_tracker import exports
+
+
+class Command(BaseCommand):
+    help = 'Stream activities or the leaderboard to a CSV or NDJSON file in constant memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(exports.DATASETS), help='What to export')
+        parser.add_argument('--output', default='csv', choices=sorted(exports.FORMATS), help='File format')
+        parser.add_argument('--compression', choices=exports.COMPRESSIONS, help='Compress the file as it is written')
+        parser.add_argument('--file', help='Write to this file instead of stdout')
+        parser.add_argument('--user', help='Only rows of this user id')
+        parser.add_argument('--team', help='Only rows of this team id')
+        parser.add_argument('--start', help='Only activities on or after this ISO 8601 date or datetime')
+        parser.add_argument('--end', help='Only activities before this ISO 8601 date or datetime')
+        parser.add_argument('--batch-size', type=int, help='Documents read and written together')
+
+    def handle(self, *args, **options):
+        if options['compression'] and not options['file']:
+            raise CommandError('--compression needs --file; compressed output is not written to stdout.')
+        if options['batch_size'] is not None and options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        params = {'user_id': options['user'], 'team_id': options['team'],
+                  'start': options['start'], 'end': options['end']}
+        try:
+            query = exports.build_query(options['dataset'], params)
+        except ValidationError as error:
+            raise CommandError(' '.join(f'{name}: {message}' for name, messages in error.detail.items()
+                                        for message in messages))
+        chunks = exports.stream(options['dataset'], query, options['output'], options['compression'],
+                                batch_size=options['batch_size'])
+
+        if not options['file']:
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending='')
+            return
+        size = 0
+        with open(options['file'], 'wb') as handle:
+            for chunk in chunks:
+                handle.write(chunk)
+                size += len(chunk)
+        self.stderr.write(self.style.SUCCESS(f'Exported {options["dataset"]} to {options["file"]} ({size} bytes).'))
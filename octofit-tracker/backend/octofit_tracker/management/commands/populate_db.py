@@ -1,187 +1,196 @@
-from django.core.management.base import BaseCommand
-from pymongo import MongoClient
-from datetime import datetime, timedelta
+from contextlib import contextmanager
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from datetime import timedelta
 import random
+import time
+
+from octofit_tracker import archive, columnar, leaderboard, mongo, rollups, search, standings, sync, windows
+from octofit_tracker.models import Team, User, Workout, Activity, Leaderboard, TeamStanding
+
+HEROES = [
+    {'name': 'Tony Stark', 'alias': 'Iron Man', 'email': 'ironman@marvel.com', 'power': 'Technology'},
+    {'name': 'Steve Rogers', 'alias': 'Captain America', 'email': 'cap@marvel.com', 'power': 'Super Soldier'},
+    {'name': 'Thor Odinson', 'alias': 'Thor', 'email': 'thor@asgard.com', 'power': 'Thunder God'},
+    {'name': 'Natasha Romanoff', 'alias': 'Black Widow', 'email': 'blackwidow@marvel.com', 'power': 'Espionage'},
+    {'name': 'Bruce Banner', 'alias': 'Hulk', 'email': 'hulk@marvel.com', 'power': 'Super Strength'},
+    {'name': 'Clark Kent', 'alias': 'Superman', 'email': 'superman@dc.com', 'power': 'Flight'},
+    {'name': 'Bruce Wayne', 'alias': 'Batman', 'email': 'batman@dc.com', 'power': 'Intelligence'},
+    {'name': 'Diana Prince', 'alias': 'Wonder Woman', 'email': 'wonderwoman@dc.com', 'power': 'Super Strength'},
+    {'name': 'Barry Allen', 'alias': 'Flash', 'email': 'flash@dc.com', 'power': 'Super Speed'},
+    {'name': 'Arthur Curry', 'alias': 'Aquaman', 'email': 'aquaman@dc.com', 'power': 'Aquatic'},
+]
+
+TEAMS = [
+    {'_id': 'team_marvel', 'name': 'Team Marvel', 'description': 'Earth\'s Mightiest Heroes'},
+    {'_id': 'team_dc', 'name': 'Team DC', 'description': 'Justice League United'},
+]
+
+WORKOUT_TYPES = [
+    {'name': 'Power Training', 'description': 'Strength and power exercises', 'difficulty': 'Hard', 'duration': 60},
+    {'name': 'Speed Work', 'description': 'Agility and speed drills', 'difficulty': 'Medium', 'duration': 45},
+    {'name': 'Endurance Run', 'description': 'Long distance running', 'difficulty': 'Medium', 'duration': 90},
+    {'name': 'Combat Training', 'description': 'Hand-to-hand combat practice', 'difficulty': 'Hard', 'duration': 75},
+    {'name': 'Flexibility Yoga', 'description': 'Stretching and balance', 'difficulty': 'Easy', 'duration': 30},
+]
 
 
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
-    def handle(self, *args, **kwargs):
-        # Connect to MongoDB
-        client = MongoClient('localhost', 27017)
-        db = client['octofit_db']
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Number of users to create')
+        parser.add_argument('--teams', type=int, default=2, help='Number of teams to create')
+        parser.add_argument('--activities-per-user', type=int, default=5,
+                            help='Number of activities to create per user')
+        parser.add_argument('--days', type=int, default=30, help='Spread activities over this many past days')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible data')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Documents per insert_many call')
+
+    def handle(self, *args, **options):
+        if options['teams'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--teams and --batch-size must be at least 1.')
+        rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        db = mongo.get_db()
 
         self.stdout.write(self.style.SUCCESS('Starting database population...'))
 
         # Clear existing data
         self.stdout.write('Clearing existing collections...')
-        db.users.delete_many({})
-        db.teams.delete_many({})
-        db.activities.delete_many({})
-        db.leaderboard.delete_many({})
-        db.workouts.delete_many({})
-
-        # Create unique index on email field
-        self.stdout.write('Creating unique index on email field...')
-        db.users.create_index([('email', 1)], unique=True)
-
-        # Insert teams
-        self.stdout.write('Inserting teams...')
-        teams_data = [
-            {
-                '_id': 'team_marvel',
-                'name': 'Team Marvel',
-                'description': 'Earth\'s Mightiest Heroes',
-                'created_at': datetime.now().isoformat(),
-                'member_count': 0
-            },
-            {
-                '_id': 'team_dc',
-                'name': 'Team DC',
-                'description': 'Justice League United',
-                'created_at': datetime.now().isoformat(),
-                'member_count': 0
-            }
-        ]
-        db.teams.insert_many(teams_data)
-
-        # Insert users (superheroes)
-        self.stdout.write('Inserting users...')
-        marvel_heroes = [
-            {'name': 'Tony Stark', 'alias': 'Iron Man', 'email': 'ironman@marvel.com', 'power': 'Technology'},
-            {'name': 'Steve Rogers', 'alias': 'Captain America', 'email': 'cap@marvel.com', 'power': 'Super Soldier'},
-            {'name': 'Thor Odinson', 'alias': 'Thor', 'email': 'thor@asgard.com', 'power': 'Thunder God'},
-            {'name': 'Natasha Romanoff', 'alias': 'Black Widow', 'email': 'blackwidow@marvel.com', 'power': 'Espionage'},
-            {'name': 'Bruce Banner', 'alias': 'Hulk', 'email': 'hulk@marvel.com', 'power': 'Super Strength'},
-        ]
+        for model in (User, Team, Activity, Leaderboard, Workout, TeamStanding):
+            mongo.collection(model).delete_many({})
+        db[rollups.DAILY].delete_many({})
+        db[rollups.WEEKLY].delete_many({})
+        db[sync.TOMBSTONES].delete_many({})
+        db[archive.ARCHIVE].delete_many({})
+        db[archive.STATE].delete_many({})
+
+        # Create the indexes declared on the models
+        self.stdout.write('Syncing indexes...')
+        call_command('sync_indexes', stdout=self.stdout)
+
+        now = mongo.now()
+
+        with self.step('Inserting teams'):
+            teams = self.make_teams(options['teams'], now)
+            mongo.collection(Team).insert_many(sync.stamp_documents(teams))
+
+        with self.step('Inserting users'):
+            users = self.make_users(options['users'], teams, rng, now)
+            self.insert(User, users)
+
+        with self.step('Inserting workouts'):
+            workouts = self.make_workouts(rng, now)
+            self.insert(Workout, workouts)
+
+        with self.step('Inserting activities'):
+            activities = self.make_activities(users, workouts, options['activities_per_user'],
+                                              options['days'], rng, now)
+            self.insert(Activity, activities)
+
+        if columnar.enabled():
+            with self.step('Calculating leaderboard and team standings'):
+                columnar.rebuild(self.batch_size)
+        else:
+            with self.step('Calculating leaderboard'):
+                leaderboard.rebuild(self.batch_size)
+            with self.step('Calculating team standings'):
+                standings.rebuild()
+        with self.step('Building rollups'):
+            rollups.rebuild()
+            windows.reset()
+        with self.step('Building search index'):
+            search.rebuild(self.batch_size)
 
-        dc_heroes = [
-            {'name': 'Clark Kent', 'alias': 'Superman', 'email': 'superman@dc.com', 'power': 'Flight'},
-            {'name': 'Bruce Wayne', 'alias': 'Batman', 'email': 'batman@dc.com', 'power': 'Intelligence'},
-            {'name': 'Diana Prince', 'alias': 'Wonder Woman', 'email': 'wonderwoman@dc.com', 'power': 'Super Strength'},
-            {'name': 'Barry Allen', 'alias': 'Flash', 'email': 'flash@dc.com', 'power': 'Super Speed'},
-            {'name': 'Arthur Curry', 'alias': 'Aquaman', 'email': 'aquaman@dc.com', 'power': 'Aquatic'},
-        ]
+        # Print summary
+        self.stdout.write(self.style.SUCCESS('\n=== Database Population Complete ==='))
+        self.stdout.write(f'Teams: {db.teams.count_documents({})}')
+        self.stdout.write(f'Users: {db.users.count_documents({})}')
+        self.stdout.write(f'Workouts: {db.workouts.count_documents({})}')
+        self.stdout.write(f'Activities: {db.activities.count_documents({})}')
+        self.stdout.write(f'Leaderboard Entries: {db.leaderboard.count_documents({})}')
 
-        users_data = []
-        for hero in marvel_heroes:
-            users_data.append({
-                'name': hero['name'],
-                'alias': hero['alias'],
-                'email': hero['email'],
-                'team_id': 'team_marvel',
-                'power': hero['power'],
-                'fitness_level': random.randint(50, 100),
-                'joined_at': datetime.now().isoformat()
-            })
+        self.stdout.write(self.style.SUCCESS('\nDatabase successfully populated with superhero test data!'))
 
-        for hero in dc_heroes:
-            users_data.append({
+    @contextmanager
+    def step(self, message):
+        self.stdout.write(f'{message}...')
+        started = time.perf_counter()
+        yield
+        self.stdout.write(f'  done in {time.perf_counter() - started:.2f}s')
+
+    def insert(self, model, documents):
+        """Insert documents in batches, assigning djongo-compatible ids."""
+        collection = mongo.collection(model)
+        batch = []
+        for document in documents:
+            batch.append(document)
+            if len(batch) >= self.batch_size:
+                self.insert_batch(model, collection, batch)
+                batch = []
+        if batch:
+            self.insert_batch(model, collection, batch)
+
+    def insert_batch(self, model, collection, batch):
+        first_id = mongo.reserve_ids(model, len(batch))
+        for offset, document in enumerate(batch):
+            document['id'] = first_id + offset
+        collection.insert_many(sync.stamp_documents(batch), ordered=False)
+
+    def make_teams(self, count, now):
+        teams = [dict(team) for team in TEAMS[:count]]
+        for number in range(len(teams) + 1, count + 1):
+            teams.append({'_id': f'team_{number}', 'name': f'Team {number}', 'description': f'Squad number {number}'})
+        for team in teams:
+            team.update({'created_at': now, 'member_count': 0})
+        return teams
+
+    def make_users(self, count, teams, rng, now):
+        # Users are kept in memory so activities can be generated without lookups.
+        users = []
+        for index in range(count):
+            hero = HEROES[index % len(HEROES)]
+            round_ = index // len(HEROES)
+            local, domain = hero['email'].split('@')
+            users.append({
                 'name': hero['name'],
-                'alias': hero['alias'],
-                'email': hero['email'],
-                'team_id': 'team_dc',
+                'alias': hero['alias'] if not round_ else f"{hero['alias']} {round_ + 1}",
+                'email': hero['email'] if not round_ else f'{local}+{round_ + 1}@{domain}',
+                # Contiguous blocks keep the first five heroes on Team Marvel and the next five on Team DC.
+                'team_id': teams[index * len(teams) // count]['_id'],
                 'power': hero['power'],
-                'fitness_level': random.randint(50, 100),
-                'joined_at': datetime.now().isoformat()
+                'fitness_level': rng.randint(50, 100),
+                'joined_at': now,
             })
+        return users
 
-        result = db.users.insert_many(users_data)
-        user_ids = result.inserted_ids
-
-        # Update team member counts
-        db.teams.update_one({'_id': 'team_marvel'}, {'$set': {'member_count': len(marvel_heroes)}})
-        db.teams.update_one({'_id': 'team_dc'}, {'$set': {'member_count': len(dc_heroes)}})
-
-        # Insert workouts
-        self.stdout.write('Inserting workouts...')
-        workout_types = [
-            {'name': 'Power Training', 'description': 'Strength and power exercises', 'difficulty': 'Hard', 'duration': 60},
-            {'name': 'Speed Work', 'description': 'Agility and speed drills', 'difficulty': 'Medium', 'duration': 45},
-            {'name': 'Endurance Run', 'description': 'Long distance running', 'difficulty': 'Medium', 'duration': 90},
-            {'name': 'Combat Training', 'description': 'Hand-to-hand combat practice', 'difficulty': 'Hard', 'duration': 75},
-            {'name': 'Flexibility Yoga', 'description': 'Stretching and balance', 'difficulty': 'Easy', 'duration': 30},
-        ]
-
-        workouts_data = []
-        for workout in workout_types:
-            workouts_data.append({
+    def make_workouts(self, rng, now):
+        return [
+            {
                 'name': workout['name'],
                 'description': workout['description'],
                 'difficulty': workout['difficulty'],
                 'duration_minutes': workout['duration'],
-                'calories_per_session': random.randint(200, 800),
-                'created_at': datetime.now().isoformat()
-            })
+                'calories_per_session': rng.randint(200, 800),
+                'created_at': now,
+            }
+            for workout in WORKOUT_TYPES
+        ]
 
-        workout_result = db.workouts.insert_many(workouts_data)
-        workout_ids = workout_result.inserted_ids
-
-        # Insert activities
-        self.stdout.write('Inserting activities...')
-        activities_data = []
-        for user_id in user_ids:
-            # Generate 3-7 activities per user
-            num_activities = random.randint(3, 7)
-            for i in range(num_activities):
-                workout_id = random.choice(workout_ids)
-                workout = db.workouts.find_one({'_id': workout_id})
-                days_ago = random.randint(0, 30)
-                activity_date = datetime.now() - timedelta(days=days_ago)
-                
-                activities_data.append({
-                    'user_id': user_id,
-                    'workout_id': workout_id,
+    def make_activities(self, users, workouts, per_user, days, rng, now):
+        """Yield activities lazily so memory stays flat however many are generated."""
+        for user in users:
+            for _ in range(per_user):
+                workout = rng.choice(workouts)
+                activity_date = now - timedelta(days=rng.randint(0, days), seconds=rng.randint(0, 86399))
+                yield {
+                    'user_id': str(user['id']),
+                    'workout_id': str(workout['id']),
                     'workout_name': workout['name'],
                     'duration_minutes': workout['duration_minutes'],
-                    'calories_burned': workout['calories_per_session'] + random.randint(-50, 50),
-                    'distance_km': round(random.uniform(1.0, 15.0), 2) if 'Run' in workout['name'] else 0,
-                    'activity_date': activity_date.isoformat(),
-                    'notes': f"Great {workout['name'].lower()} session!"
-                })
-
-        db.activities.insert_many(activities_data)
-
-        # Calculate and insert leaderboard
-        self.stdout.write('Calculating leaderboard...')
-        leaderboard_data = []
-        
-        for user_id in user_ids:
-            user = db.users.find_one({'_id': user_id})
-            user_activities = list(db.activities.find({'user_id': user_id}))
-            
-            total_calories = sum(activity['calories_burned'] for activity in user_activities)
-            total_workouts = len(user_activities)
-            total_minutes = sum(activity['duration_minutes'] for activity in user_activities)
-            total_distance = sum(activity.get('distance_km', 0) for activity in user_activities)
-            
-            leaderboard_data.append({
-                'user_id': user_id,
-                'user_name': user['name'],
-                'user_alias': user['alias'],
-                'team_id': user['team_id'],
-                'total_calories': total_calories,
-                'total_workouts': total_workouts,
-                'total_minutes': total_minutes,
-                'total_distance_km': round(total_distance, 2),
-                'rank': 0,  # Will be updated after sorting
-                'last_updated': datetime.now().isoformat()
-            })
-
-        # Sort by total calories and assign ranks
-        leaderboard_data.sort(key=lambda x: x['total_calories'], reverse=True)
-        for idx, entry in enumerate(leaderboard_data, 1):
-            entry['rank'] = idx
-
-        db.leaderboard.insert_many(leaderboard_data)
-
-        # Print summary
-        self.stdout.write(self.style.SUCCESS('\n=== Database Population Complete ==='))
-        self.stdout.write(f'Teams: {db.teams.count_documents({})}')
-        self.stdout.write(f'Users: {db.users.count_documents({})}')
-        self.stdout.write(f'Workouts: {db.workouts.count_documents({})}')
-        self.stdout.write(f'Activities: {db.activities.count_documents({})}')
-        self.stdout.write(f'Leaderboard Entries: {db.leaderboard.count_documents({})}')
-        
-        self.stdout.write(self.style.SUCCESS('\nDatabase successfully populated with superhero test data!'))
+                    'calories_burned': workout['calories_per_session'] + rng.randint(-50, 50),
+                    'distance_km': round(rng.uniform(1.0, 15.0), 2) if 'Run' in workout['name'] else 0.0,
+                    'activity_date': activity_date,
+                    'notes': f"Great {workout['name'].lower()} session!",
+                }
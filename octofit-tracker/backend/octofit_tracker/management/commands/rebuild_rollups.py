@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import rollups, windows
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily and weekly activity rollups from the activities collection'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding rollups...')
+        daily, weekly = rollups.rebuild()
+        windows.reset()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {daily} daily and {weekly} weekly rollups.'))
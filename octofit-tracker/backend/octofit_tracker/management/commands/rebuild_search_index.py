@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from octofit_tracker import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search index of user, workout and activity text from their collections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Index entries inserted together')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        self.stdout.write('Rebuilding search index...')
+        counts = search.rebuild(options['batch_size'])
+        summary = ', '.join(f'{count} {kind} entries' for kind, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Indexed {summary}.'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import standings
+
+
+class Command(BaseCommand):
+    help = 'Rebuild team standings and member counts from users and the leaderboard'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding team standings...')
+        count = standings.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt standings for {count} teams.'))
@@ -0,0 +1,73 @@
+import multiprocessing
+import os
+import signal
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def run_process(settings_module, threads, poll_interval, burst):
+    """Entry point of a spawned worker process."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+    from octofit_tracker.tasks import Worker
+
+    worker = Worker(threads=threads, poll_interval=poll_interval)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: worker.stop())
+    worker.run(burst=burst)
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the jobs collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2, help='Jobs run concurrently per process')
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes to start')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait before polling an empty queue again')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        from octofit_tracker.tasks import Worker, registered
+
+        if options['threads'] < 1 or options['processes'] < 1:
+            raise CommandError('--threads and --processes must be at least 1.')
+        self.stdout.write(f'Registered tasks: {", ".join(registered())}')
+
+        if options['processes'] == 1:
+            worker = Worker(threads=options['threads'], poll_interval=options['poll_interval'])
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda *args: worker.stop())
+            self.stdout.write(self.style.SUCCESS(f'Worker {worker.name} started with {options["threads"]} threads.'))
+            processed = worker.run(burst=options['burst'])
+            self.stdout.write(self.style.SUCCESS(f'Worker stopped after {processed} jobs.'))
+            return
+
+        # Spawned rather than forked so no process shares a MongoClient with its parent.
+        context = multiprocessing.get_context('spawn')
+        processes = [
+            context.Process(target=run_process, args=(
+                settings.SETTINGS_MODULE, options['threads'], options['poll_interval'], options['burst'],
+            ))
+            for _ in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(self.style.SUCCESS(
+            f'Started {len(processes)} worker processes with {options["threads"]} threads each.'))
+
+        def forward(signum, frame):
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+        signal.signal(signal.SIGTERM, forward)
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            # Children received the same SIGINT and finish their current jobs.
+            for process in processes:
+                process.join()
+        self.stdout.write(self.style.SUCCESS('All worker processes stopped.'))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import archive, mongo
+from octofit_tracker.indexes import diff_indexes, explain_coverage
+
+
+class Command(BaseCommand):
+    help = 'Create the Mongo indexes declared on the octofit models'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report missing indexes, do not create them')
+        parser.add_argument('--explain', action='store_true',
+                            help='Report which viewset queries are served by an index')
+
+    def handle(self, *args, **options):
+        db = mongo.get_db()
+        missing, extra = diff_indexes(db)
+
+        if not missing:
+            self.stdout.write(self.style.SUCCESS('All declared indexes exist.'))
+        if missing and not options['dry_run']:
+            # Creating an index would create the archive without its block compressor.
+            archive.ensure_collection()
+        for name, index in missing:
+            document = index.document
+            keys = ', '.join(f'{field} {direction}' for field, direction in document['key'].items())
+            if options['dry_run']:
+                self.stdout.write(f'Missing {name}.{document["name"]} ({keys})')
+            else:
+                db[name].create_indexes([index])
+                self.stdout.write(self.style.SUCCESS(f'Created {name}.{document["name"]} ({keys})'))
+        for name, index_name in extra:
+            self.stdout.write(self.style.WARNING(f'Undeclared index {name}.{index_name}'))
+
+        if options['explain']:
+            self.stdout.write('\nQuery coverage:')
+            for row in explain_coverage(db):
+                if row['indexed'] and not row['in_memory_sort']:
+                    status = self.style.SUCCESS(f'index {row["index"]}')
+                elif row['indexed']:
+                    status = self.style.WARNING(f'index {row["index"]} + in-memory sort')
+                else:
+                    status = self.style.ERROR('collection scan')
+                self.stdout.write(f'  {row["query"]:<32} {status}')
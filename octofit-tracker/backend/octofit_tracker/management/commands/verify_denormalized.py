@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import denormalized
+
+
+class Command(BaseCommand):
+    help = 'Check copied user and workout fields against their sources and optionally repair drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='Rewrite copies that drifted from their source')
+
+    def handle(self, *args, **options):
+        reports = denormalized.verify(repair=options['repair'])
+        for report in reports:
+            label = f'{report["collection"]} ({", ".join(report["fields"])} from {report["source"]})'
+            if report['drifted']:
+                self.stdout.write(self.style.WARNING(
+                    f'{label}: {report["drifted"]} of {report["checked"]} documents drifted '
+                    f'across {report["drifted_keys"]} {report["source"]}'
+                ))
+                if options['repair']:
+                    self.stdout.write(self.style.SUCCESS(f'  repaired {report["repaired"]} documents'))
+            else:
+                self.stdout.write(f'{label}: {report["checked"]} documents consistent')
+            if report['orphaned']:
+                self.stdout.write(self.style.WARNING(
+                    f'  {report["orphaned"]} documents reference a missing {report["source"]} row'
+                ))
+
+        if not any(report['drifted'] for report in reports):
+            self.stdout.write(self.style.SUCCESS('All denormalized copies are consistent.'))
+        elif not options['repair']:
+            self.stdout.write('Run with --repair to fix the drifted copies.')
@@ -0,0 +1,87 @@
+import time
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+
+from . import instrumentation
+
+
+class AsyncCapableMiddleware(MiddlewareMixin):
+    """
+    Base for middleware that runs natively in both WSGI and ASGI handlers.
+
+    Subclasses implement ``handle`` and ``__acall__`` rather than the
+    request and response hooks, which ``MiddlewareMixin`` would run on a
+    thread under ASGI.
+    """
+
+    def __call__(self, request):
+        if self._is_coroutine:
+            return self.__acall__(request)
+        return self.handle(request)
+
+
+class AsgiUrlconfMiddleware(AsyncCapableMiddleware):
+    """Route ASGI requests through ``OCTOFIT_ASGI_URLCONF`` so hot reads reach the async views."""
+
+    def handle(self, request):
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if isinstance(request, ASGIRequest):
+            request.urlconf = settings.OCTOFIT_ASGI_URLCONF
+        return await self.get_response(request)
+
+
+class RequestMetricsMiddleware(AsyncCapableMiddleware):
+    """
+    Collect query counts and phase timings for every request.
+
+    The totals are returned in a ``Server-Timing`` header (and an
+    ``X-Query-Warning`` header when the N+1 threshold is exceeded) and
+    added to the registry served at ``/metrics``.
+    """
+
+    def handle(self, request):
+        token = instrumentation.start()
+        try:
+            with connections['default'].execute_wrapper(instrumentation.time_orm):
+                response = self.get_response(request)
+            return self._finish(request, response)
+        finally:
+            instrumentation.stop(token)
+
+    async def __acall__(self, request):
+        # ORM calls made from async views run on other threads with their own
+        # connections, so only the Mongo commands of async_mongo are collected here.
+        token = instrumentation.start()
+        try:
+            return self._finish(request, await self.get_response(request))
+        finally:
+            instrumentation.stop(token)
+
+    def _finish(self, request, response):
+        metrics = instrumentation.current()
+        match = getattr(request, 'resolver_match', None)
+        label = match.view_name if match else 'unmatched'
+        n_plus_one = instrumentation.check_n_plus_one(metrics, label)
+        response['Server-Timing'] = instrumentation.server_timing(metrics)
+        if n_plus_one:
+            response['X-Query-Warning'] = f'n+1; queries={metrics.queries}'
+        size = 0 if response.streaming else len(response.content)
+        instrumentation.registry.observe(label, request.method, response.status_code, metrics, size, n_plus_one)
+        return response
+
+    def process_template_response(self, request, response):
+        metrics = instrumentation.current()
+        if metrics is not None:
+            metrics.render_started = time.perf_counter()
+            response.add_post_render_callback(self._rendered)
+        return response
+
+    def _rendered(self, response):
+        metrics = instrumentation.current()
+        if metrics is not None and metrics.render_started is not None:
+            metrics.render += time.perf_counter() - metrics.render_started
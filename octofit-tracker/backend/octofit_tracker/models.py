@@ -1,14 +1,43 @@
 from djongo import models
 from django.utils import timezone
+from pymongo import ASCENDING, DESCENDING, IndexModel
 
+from . import sync
 
-class Team(models.Model):
+
+class Versioned(models.Model):
+    """A model whose writes and deletions are tracked for delta sync (see ``sync``)."""
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        self.version = sync.next_versions()
+        self.updated_at = timezone.now()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        pk = self.pk
+        result = super().delete(*args, **kwargs)
+        sync.tombstone(self._meta.db_table, [pk])
+        return result
+
+
+class Team(Versioned):
     _id = models.CharField(max_length=100, primary_key=True)
     name = models.CharField(max_length=200)
     description = models.TextField()
     created_at = models.DateTimeField(default=timezone.now)
     member_count = models.IntegerField(default=0)
 
+    mongo_indexes = [
+        IndexModel([('version', ASCENDING), ('_id', ASCENDING)], name='team_version'),
+    ]
+
     class Meta:
         db_table = 'teams'
 
@@ -16,7 +45,29 @@ class Team(models.Model):
         return self.name
 
 
-class User(models.Model):
+class TeamStanding(models.Model):
+    team_id = models.CharField(max_length=100, primary_key=True)
+    member_count = models.IntegerField(default=0)
+    active_members = models.IntegerField(default=0)
+    total_calories = models.IntegerField(default=0)
+    total_workouts = models.IntegerField(default=0)
+    total_minutes = models.IntegerField(default=0)
+    total_distance_km = models.FloatField(default=0.0)
+    last_updated = models.DateTimeField(default=timezone.now)
+
+    mongo_indexes = [
+        IndexModel([('total_calories', DESCENDING)], name='standing_calories'),
+    ]
+
+    class Meta:
+        db_table = 'team_standings'
+        ordering = ['-total_calories']
+
+    def __str__(self):
+        return f"{self.team_id} - {self.total_calories} calories"
+
+
+class User(Versioned):
     name = models.CharField(max_length=200)
     alias = models.CharField(max_length=200)
     email = models.EmailField(unique=True)
@@ -25,6 +76,12 @@ class User(models.Model):
     fitness_level = models.IntegerField()
     joined_at = models.DateTimeField(default=timezone.now)
 
+    mongo_indexes = [
+        IndexModel([('email', ASCENDING)], unique=True, name='email_1'),
+        IndexModel([('team_id', ASCENDING), ('id', ASCENDING)], name='user_team'),
+        IndexModel([('version', ASCENDING), ('id', ASCENDING)], name='user_version'),
+    ]
+
     class Meta:
         db_table = 'users'
 
@@ -32,7 +89,7 @@ class User(models.Model):
         return f"{self.alias} ({self.name})"
 
 
-class Workout(models.Model):
+class Workout(Versioned):
     name = models.CharField(max_length=200)
     description = models.TextField()
     difficulty = models.CharField(max_length=50)
@@ -40,6 +97,11 @@ class Workout(models.Model):
     calories_per_session = models.IntegerField()
     created_at = models.DateTimeField(default=timezone.now)
 
+    mongo_indexes = [
+        IndexModel([('difficulty', ASCENDING), ('id', ASCENDING)], name='workout_difficulty'),
+        IndexModel([('version', ASCENDING), ('id', ASCENDING)], name='workout_version'),
+    ]
+
     class Meta:
         db_table = 'workouts'
 
@@ -47,7 +109,7 @@ class Workout(models.Model):
         return self.name
 
 
-class Activity(models.Model):
+class Activity(Versioned):
     user_id = models.CharField(max_length=100)
     workout_id = models.CharField(max_length=100)
     workout_name = models.CharField(max_length=200)
@@ -57,6 +119,13 @@ class Activity(models.Model):
     activity_date = models.DateTimeField()
     notes = models.TextField(blank=True)
 
+    mongo_indexes = [
+        IndexModel([('user_id', ASCENDING), ('activity_date', DESCENDING), ('id', DESCENDING)], name='activity_user_date'),
+        IndexModel([('activity_date', DESCENDING), ('id', DESCENDING)], name='activity_date'),
+        IndexModel([('workout_id', ASCENDING)], name='activity_workout'),
+        IndexModel([('version', ASCENDING), ('id', ASCENDING)], name='activity_version'),
+    ]
+
     class Meta:
         db_table = 'activities'
         ordering = ['-activity_date']
@@ -65,7 +134,7 @@ class Activity(models.Model):
         return f"{self.workout_name} - {self.activity_date}"
 
 
-class Leaderboard(models.Model):
+class Leaderboard(Versioned):
     user_id = models.CharField(max_length=100)
     user_name = models.CharField(max_length=200)
     user_alias = models.CharField(max_length=200)
@@ -77,9 +146,49 @@ class Leaderboard(models.Model):
     rank = models.IntegerField()
     last_updated = models.DateTimeField(default=timezone.now)
 
+    mongo_indexes = [
+        IndexModel([('user_id', ASCENDING)], name='leaderboard_user'),
+        IndexModel([('rank', ASCENDING), ('id', ASCENDING)], name='leaderboard_rank'),
+        IndexModel([('team_id', ASCENDING), ('rank', ASCENDING), ('id', ASCENDING)], name='leaderboard_team_rank'),
+        IndexModel([('version', ASCENDING), ('id', ASCENDING)], name='leaderboard_version'),
+    ]
+
     class Meta:
         db_table = 'leaderboard'
         ordering = ['rank']
 
     def __str__(self):
         return f"{self.rank}. {self.user_alias} - {self.total_calories} calories"
+
+
+class Job(models.Model):
+    name = models.CharField(max_length=200)
+    args = models.TextField(default='[]')
+    dedupe_key = models.CharField(max_length=500, null=True, blank=True)
+    status = models.CharField(max_length=20, default='queued')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=200, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+    result = models.TextField(blank=True, default='')
+
+    mongo_indexes = [
+        IndexModel([('status', ASCENDING), ('run_after', ASCENDING), ('id', ASCENDING)], name='job_queue'),
+        # Only queued jobs carry a dedupe_key, so a sparse unique index coalesces waiting duplicates.
+        IndexModel([('dedupe_key', ASCENDING)], unique=True, sparse=True, name='job_dedupe'),
+    ]
+
+    class Meta:
+        db_table = 'jobs'
+        ordering = ['-id']
+
+    def __str__(self):
+        return f"{self.name} #{self.id} ({self.status})"
+
+
+# Models tracked for delta sync.
+VERSIONED = (Team, User, Workout, Activity, Leaderboard)
@@ -0,0 +1,189 @@
+"""
+Native pymongo access to the octofit database.
+
+djongo translates ORM calls into Mongo queries, but it can only emit plain
+``$set`` updates.  Atomic counters and range updates go through the shared
+client below instead, which points at the same database as the ORM.
+"""
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+LOCKS = 'locks'
+
+_client = None
+
+
+def get_client():
+    """Return the process-wide MongoClient, creating it on first use."""
+    global _client
+    if _client is None:
+        options = settings.DATABASES['default'].get('CLIENT', {})
+        _client = MongoClient(**options)
+    return _client
+
+
+def get_db():
+    """Return the database the ORM is currently connected to."""
+    # Resolved per call so the test runner's test database is honoured.
+    return get_client()[connections['default'].settings_dict['NAME']]
+
+
+def collection(model):
+    """Return the collection backing a model."""
+    return get_db()[model._meta.db_table]
+
+
+def now():
+    """Return the current time the way djongo stores it (naive UTC)."""
+    return timezone.now().replace(tzinfo=None)
+
+
+def naive_utc(value):
+    """Convert an aware datetime to the naive UTC form stored in Mongo."""
+    if value is not None and timezone.is_aware(value):
+        return value.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def reserve_ids(model, count):
+    """
+    Reserve ``count`` auto-increment ids for rows inserted natively.
+
+    djongo keeps the counter for each table in the ``__schema__``
+    collection; bumping it here keeps ORM inserts from reusing the ids.
+    Returns the first id of the reserved range.
+    """
+    schema = get_db()['__schema__'].find_one_and_update(
+        {'name': model._meta.db_table},
+        {'$inc': {'auto.seq': count}, '$setOnInsert': {'auto.field_names': [model._meta.pk.column]}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return schema['auto']['seq'] - count + 1
+
+
+def to_document(instance):
+    """Return the document djongo would store for a model instance."""
+    connection = connections['default']
+    return {
+        field.column: field.get_db_prep_save(getattr(instance, field.attname), connection)
+        for field in instance._meta.concrete_fields
+    }
+
+
+# Locks held by this process, renewed together by one heartbeat thread.
+_held = {}
+_held_lock = threading.Lock()
+_heartbeat = None
+
+
+def _renew_leases():
+    """Extend the lease of every lock this process holds."""
+    with _held_lock:
+        held = list(_held.items())
+    for (name, owner), locks in held:
+        locks.update_one({'_id': name, 'owner': owner},
+                         {'$set': {'expires_at': now() + timedelta(seconds=settings.OCTOFIT_LOCK_LEASE)}})
+
+
+def _renew_forever():
+    while True:
+        time.sleep(settings.OCTOFIT_LOCK_LEASE / 3)
+        _renew_leases()
+
+
+def _start_heartbeat():
+    global _heartbeat
+    with _held_lock:
+        if _heartbeat is None:
+            _heartbeat = threading.Thread(target=_renew_forever, name='lock-heartbeat', daemon=True)
+            _heartbeat.start()
+
+
+@contextmanager
+def lock(name, poll=0.005, max_poll=0.5):
+    """
+    Hold the named lock across every process sharing the database.
+
+    The lock is a document in ``locks`` leased for ``OCTOFIT_LOCK_LEASE``
+    seconds.  One heartbeat thread per process renews the leases of the
+    locks the process holds, so a lock left by a crashed process frees
+    itself when its lease runs out.  Acquiring polls until the lock is
+    free, doubling the wait from ``poll`` up to ``max_poll``.
+    """
+    _start_heartbeat()
+    locks, owner, lease = get_db()[LOCKS], uuid.uuid4().hex, settings.OCTOFIT_LOCK_LEASE
+    while True:
+        try:
+            # Matches a missing or expired lock; a live one fails the upsert on its _id.
+            locks.update_one({'_id': name, 'expires_at': {'$lt': now()}},
+                             {'$set': {'owner': owner, 'expires_at': now() + timedelta(seconds=lease)}}, upsert=True)
+            break
+        except DuplicateKeyError:
+            time.sleep(poll)
+            poll = min(poll * 2, max_poll)
+    with _leased(locks, name, owner):
+        yield
+
+
+@contextmanager
+def _leased(locks, key, owner):
+    """Renew the lease on lock document ``key`` while held, and delete it on release."""
+    with _held_lock:
+        _held[(key, owner)] = locks
+    try:
+        yield
+    finally:
+        with _held_lock:
+            del _held[(key, owner)]
+        locks.delete_one({'_id': key, 'owner': owner})
+
+
+def _claimed(locks, name):
+    return locks.count_documents({'_id': name, 'expires_at': {'$gt': now()}}, limit=1)
+
+
+@contextmanager
+def shared_lock(name, poll=0.005, max_poll=0.5):
+    """
+    Hold ``name`` alongside other shared holders, keeping ``exclusive_lock(name)`` out.
+
+    Each holder leaves its own leased document ``<name>:<owner>``.  While
+    an exclusive holder has claimed the name, new holders poll as ``lock``
+    does, and a holder that raced the claim steps aside again.
+    """
+    _start_heartbeat()
+    locks, owner = get_db()[LOCKS], uuid.uuid4().hex
+    key = f'{name}:{owner}'
+    while True:
+        if not _claimed(locks, name):
+            locks.insert_one({'_id': key, 'shared': name, 'owner': owner,
+                              'expires_at': now() + timedelta(seconds=settings.OCTOFIT_LOCK_LEASE)})
+            # The exclusive holder claims first and then waits for shared holders, so one of the two backs off.
+            if not _claimed(locks, name):
+                break
+            locks.delete_one({'_id': key})
+        time.sleep(poll)
+        poll = min(poll * 2, max_poll)
+    with _leased(locks, key, owner):
+        yield
+
+
+@contextmanager
+def exclusive_lock(name, poll=0.005, max_poll=0.5):
+    """Hold ``lock(name)`` once every ``shared_lock(name)`` holder has released it."""
+    with lock(name, poll, max_poll):
+        locks = get_db()[LOCKS]
+        while locks.count_documents({'shared': name, 'expires_at': {'$gt': now()}}, limit=1):
+            time.sleep(poll)
+            poll = min(poll * 2, max_poll)
+        yield
@@ -0,0 +1,29 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination shared by every list endpoint.
+
+    Pages are selected with a range filter on the ordering field rather
+    than an OFFSET, so deep pages cost the same as the first one.
+    """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class TeamCursorPagination(IdCursorPagination):
+    ordering = '_id'
+
+
+class ActivityCursorPagination(IdCursorPagination):
+    ordering = ('-activity_date', '-id')
+
+
+class LeaderboardCursorPagination(IdCursorPagination):
+    ordering = ('rank', 'id')
+
+
+class JobCursorPagination(IdCursorPagination):
+    ordering = '-id'
@@ -0,0 +1,304 @@
+"""
+Order-statistic index over the leaderboard for rank lookups.
+
+The stored ``Leaderboard.rank`` only orders users by calories, and finding
+a user's position by any other total would take a sort or a counting scan.
+``RankIndex`` keeps every user's totals in memory in one ``OrderedKeys``
+per metric: sorted keys split into buckets of a few hundred, with a
+Fenwick tree over the bucket sizes, so a user's position and the keys
+around it are found in O(log n).
+
+The index is loaded from the leaderboard on first use and kept current
+by ``leaderboard`` as it applies deltas in this process.  Writes made by
+other processes are picked up by a full reload once the index is older
+than ``OCTOFIT_RANK_INDEX_MAX_AGE`` seconds.  Entries a lookup reads whose
+totals disagree with the index are corrected in place, so a lookup never
+triggers a reload of its own.
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+
+from . import mongo
+from .models import Leaderboard
+from .repositories import projection
+from .serializers import LeaderboardSerializer, leaderboard_reader
+
+METRICS = {
+    'calories': 'total_calories',
+    'minutes': 'total_minutes',
+    'workouts': 'total_workouts',
+    'distance': 'total_distance_km',
+}
+
+MAX_NEIGHBOURS = 50
+
+FIELDS = dict.fromkeys(METRICS.values(), 1)
+
+
+def parse_metric(value):
+    """Validate a ``by`` query parameter and return the leaderboard field it ranks on."""
+    metric = value or 'calories'
+    if metric not in METRICS:
+        raise ValidationError({'by': f'Must be one of: {", ".join(METRICS)}.'})
+    return METRICS[metric]
+
+
+def parse_neighbours(value):
+    """Validate a ``neighbours`` query parameter."""
+    if value in (None, ''):
+        return 5
+    try:
+        neighbours = int(value)
+    except ValueError:
+        neighbours = -1
+    if not 0 <= neighbours <= MAX_NEIGHBOURS:
+        raise ValidationError({'neighbours': f'Must be an integer between 0 and {MAX_NEIGHBOURS}.'})
+    return neighbours
+
+
+class OrderedKeys:
+    """A sorted multiset of keys supporting O(log n) insert, remove, position and lookup by position."""
+
+    load = 256
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self._buckets = [keys[start:start + self.load] for start in range(0, len(keys), self.load)]
+        self._reindex()
+
+    def __len__(self):
+        return self._len
+
+    def _reindex(self):
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._len = sum(len(bucket) for bucket in self._buckets)
+        tree = [0] * (len(self._buckets) + 1)
+        for index, bucket in enumerate(self._buckets, 1):
+            tree[index] += len(bucket)
+            parent = index + (index & -index)
+            if parent < len(tree):
+                tree[parent] += tree[index]
+        self._tree = tree
+
+    def _resize(self, bucket, delta):
+        self._len += delta
+        index = bucket + 1
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
+
+    def _before(self, bucket):
+        """Return the number of keys in the buckets before ``bucket``."""
+        total = 0
+        while bucket:
+            total += self._tree[bucket]
+            bucket -= bucket & -bucket
+        return total
+
+    def _locate(self, position):
+        """Return the bucket holding ``position`` and the offset within it."""
+        bucket, step = 0, 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            following = bucket + step
+            if following < len(self._tree) and self._tree[following] <= position:
+                bucket = following
+                position -= self._tree[following]
+            step >>= 1
+        return bucket, position
+
+    def add(self, key):
+        if not self._buckets:
+            self._buckets = [[key]]
+            self._reindex()
+            return
+        index = min(bisect_left(self._maxes, key), len(self._buckets) - 1)
+        bucket = self._buckets[index]
+        insort(bucket, key)
+        self._maxes[index] = bucket[-1]
+        if len(bucket) > 2 * self.load:
+            self._buckets[index:index + 1] = [bucket[:self.load], bucket[self.load:]]
+            self._reindex()
+        else:
+            self._resize(index, 1)
+
+    def remove(self, key):
+        index = bisect_left(self._maxes, key)
+        bucket = self._buckets[index] if index < len(self._buckets) else []
+        offset = bisect_left(bucket, key)
+        if offset == len(bucket) or bucket[offset] != key:
+            raise KeyError(key)
+        del bucket[offset]
+        if not bucket:
+            del self._buckets[index]
+            self._reindex()
+        else:
+            self._maxes[index] = bucket[-1]
+            self._resize(index, -1)
+
+    def position(self, key):
+        """Return the number of keys smaller than ``key``."""
+        index = bisect_left(self._maxes, key)
+        if index == len(self._buckets):
+            return self._len
+        return self._before(index) + bisect_left(self._buckets[index], key)
+
+    def between(self, start, stop):
+        """Return the keys at positions ``start`` to ``stop`` (exclusive)."""
+        start, stop = max(start, 0), min(stop, self._len)
+        if start >= stop:
+            return []
+        bucket, offset = self._locate(start)
+        keys = []
+        while len(keys) < stop - start:
+            keys.extend(self._buckets[bucket][offset:offset + stop - start - len(keys)])
+            bucket, offset = bucket + 1, 0
+        return keys
+
+
+class RankIndex:
+    """Every leaderboard entry's totals, ordered once per metric."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._totals = None
+        self._orders = {}
+        self._loaded_at = 0.0
+
+    @staticmethod
+    def _key(field, user_id, totals):
+        # Highest total first; ties are broken by user id as in leaderboard.rebuild.
+        return -totals[field], user_id
+
+    @staticmethod
+    def _row(document):
+        return {field: document.get(field) or 0 for field in FIELDS}
+
+    def load(self):
+        """Read every entry's totals from the leaderboard and rebuild the orders."""
+        with self._lock:
+            documents = mongo.collection(Leaderboard).find({}, {**FIELDS, 'user_id': 1, '_id': 0})
+            self._totals = {document['user_id']: self._row(document) for document in documents}
+            self._orders = {
+                field: OrderedKeys(self._key(field, user_id, row) for user_id, row in self._totals.items())
+                for field in FIELDS
+            }
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        """Drop the index so the next lookup reloads it."""
+        with self._lock:
+            self._totals = None
+
+    def _ensure_loaded(self):
+        max_age = settings.OCTOFIT_RANK_INDEX_MAX_AGE
+        if self._totals is None or (max_age is not None and time.monotonic() - self._loaded_at > max_age):
+            self.load()
+
+    def update(self, user_id, totals):
+        """Record a user's new totals; a no-op until the index is first loaded."""
+        user_id = str(user_id)
+        with self._lock:
+            if self._totals is None:
+                return
+            previous = self._totals.get(user_id)
+            row = {field: totals[field] for field in self._orders}
+            for field, order in self._orders.items():
+                if previous is not None:
+                    order.remove(self._key(field, user_id, previous))
+                order.add(self._key(field, user_id, row))
+            self._totals[user_id] = row
+
+    def discard(self, user_id):
+        """Remove a user from the index."""
+        user_id = str(user_id)
+        with self._lock:
+            previous = self._totals.pop(user_id, None) if self._totals is not None else None
+            if previous is not None:
+                for field, order in self._orders.items():
+                    order.remove(self._key(field, user_id, previous))
+
+    def window(self, user_id, field, neighbours):
+        """
+        Return ``(rank, count, user_ids)`` for a user ranked by ``field``.
+
+        ``user_ids`` lists up to ``neighbours`` users on either side of the
+        user, in rank order and including the user; the first of them has
+        rank ``rank - neighbours`` or 1.  Returns None for unknown users.
+        """
+        user_id = str(user_id)
+        with self._lock:
+            self._ensure_loaded()
+            totals = self._totals.get(user_id)
+            if totals is None:
+                return None
+            order = self._orders[field]
+            position = order.position(self._key(field, user_id, totals))
+            keys = order.between(position - neighbours, position + neighbours + 1)
+            return position + 1, len(order), [key[1] for key in keys]
+
+    def reconcile(self, user_ids, documents):
+        """
+        Bring ``user_ids`` in line with their leaderboard ``documents``, keyed by user id.
+
+        Users without a document are removed.  Returns True if the index
+        had to change; a no-op until the index is first loaded.
+        """
+        changed = False
+        with self._lock:
+            if self._totals is None:
+                return False
+            for user_id in user_ids:
+                document = documents.get(user_id)
+                if document is None:
+                    changed |= user_id in self._totals
+                    self.discard(user_id)
+                elif self._totals.get(user_id) != self._row(document):
+                    changed = True
+                    self.update(user_id, self._row(document))
+        return changed
+
+
+index = RankIndex()
+
+
+def _read(user_id, field, neighbours):
+    found = index.window(user_id, field, neighbours)
+    if found is None:
+        return None
+    rank, count, user_ids = found
+    documents = mongo.collection(Leaderboard).find({'user_id': {'$in': user_ids}}, projection(LeaderboardSerializer))
+    by_user = {document['user_id']: document for document in documents}
+    entries = [by_user[key] for key in user_ids if key in by_user]
+    current = not index.reconcile(user_ids, by_user)
+    return rank - user_ids.index(user_id), count, entries, current
+
+
+def neighbourhood(user_id, field, neighbours=5):
+    """
+    Return a user's rank by ``field`` and the entries around it, or None.
+
+    Unknown users are answered from the indexed ``user_id`` lookup alone.
+    Entries are read fresh from the leaderboard; their ``rank`` is their
+    position by ``field``.  If any entry disagreed with the index, it is
+    corrected and the window is read once more before answering.
+    """
+    user_id = str(user_id)
+    document = mongo.collection(Leaderboard).find_one({'user_id': user_id}, {**FIELDS, '_id': 0})
+    if document is None:
+        return None
+    index.reconcile([user_id], {user_id: document})
+    found = _read(user_id, field, neighbours)
+    if found is not None and not found[3]:
+        found = _read(user_id, field, neighbours)
+    if found is None:
+        return None
+    first, count, entries, _ = found
+    results = leaderboard_reader.many(entries)
+    for offset, entry in enumerate(results):
+        entry['rank'] = first + offset
+    rank = next(entry['rank'] for entry in results if entry['user_id'] == user_id)
+    return {'user_id': user_id, 'metric': field, 'rank': rank, 'count': count, 'results': results}
@@ -0,0 +1,37 @@
+"""
+Native read path for hot, read-heavy endpoints.
+
+These queries go straight to the shared pymongo client with a projection
+on the serializer's fields, skipping djongo's SQL parsing and translation.
+The returned documents are plain dicts that the regular serializers can
+render, so responses are identical to the ORM path.
+"""
+from django.conf import settings
+
+from . import mongo
+from .models import Activity, Leaderboard
+from .serializers import ActivitySerializer, LeaderboardSerializer
+
+
+def uses_native_reads(view):
+    """Return True if ``OCTOFIT_NATIVE_READS`` enables the native path for a viewset."""
+    return settings.OCTOFIT_NATIVE_READS.get(type(view).__name__, False)
+
+
+def projection(serializer_class, fields=None):
+    """Return a Mongo projection selecting a serializer's fields, or only ``fields``."""
+    fields = dict.fromkeys(serializer_class.Meta.fields if fields is None else fields, 1)
+    fields['_id'] = 0
+    return fields
+
+
+def top_leaderboard(limit, fields=None):
+    """Return the ``limit`` best ranked leaderboard entries."""
+    cursor = mongo.collection(Leaderboard).find({}, projection(LeaderboardSerializer, fields))
+    return list(cursor.sort([('rank', 1), ('id', 1)]).limit(limit))
+
+
+def recent_activities(limit, fields=None):
+    """Return the ``limit`` most recent activities."""
+    cursor = mongo.collection(Activity).find({}, projection(ActivitySerializer, fields))
+    return list(cursor.sort([('activity_date', -1), ('id', -1)]).limit(limit))
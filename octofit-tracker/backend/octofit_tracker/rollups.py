@@ -0,0 +1,223 @@
+"""
+Daily and weekly activity rollups.
+
+Each rollup document holds the totals of one user, team or workout for one
+day or ISO week, plus the sum of squared calories and a calorie histogram
+so distributions can be derived without touching raw activities.  Rollups
+are updated with ``$inc`` upserts on every activity write and rebuilt from
+scratch, archived activities included, by the ``rebuild_rollups`` management
+command.
+
+Team rollups hold the totals of the team's current members: when a user
+changes team, ``change_team`` moves their user rollups out of the old
+team's buckets and into the new team's, so later deletes and edits of
+their activities land on the team that counted them.
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from pymongo import UpdateOne
+
+from . import archive, events, mongo
+from .models import User
+
+DAILY = 'rollups_daily'
+WEEKLY = 'rollups_weekly'
+
+SCOPES = ('user', 'team', 'workout')
+
+FIELDS = ('calories', 'workouts', 'minutes', 'distance_km', 'calories_sq')
+
+
+def day_bucket(moment):
+    """Return the key and start of the day containing ``moment``."""
+    start = datetime(moment.year, moment.month, moment.day)
+    return start.strftime('%Y-%m-%d'), start
+
+
+def week_bucket(moment):
+    """Return the ISO week key and start (Monday) of the week containing ``moment``."""
+    year, week, weekday = moment.isocalendar()
+    start = datetime(moment.year, moment.month, moment.day) - timedelta(days=weekday - 1)
+    return f'{year}-W{week:02d}', start
+
+
+def calorie_bucket(calories):
+    """Return the histogram bucket (its lower bound) for a calorie count."""
+    size = settings.OCTOFIT_CALORIE_BUCKET_SIZE
+    return calories // size * size
+
+
+def _team_ids(user_ids):
+    ids = [int(user_id) for user_id in user_ids if str(user_id).isdigit()]
+    users = mongo.collection(User).find({'id': {'$in': ids}}, {'id': 1, 'team_id': 1, '_id': 0})
+    return {str(user['id']): user.get('team_id') for user in users}
+
+
+def _keys(activity, teams):
+    yield 'user', str(activity.user_id)
+    team_id = teams.get(str(activity.user_id))
+    if team_id:
+        yield 'team', team_id
+    yield 'workout', str(activity.workout_id)
+
+
+def _apply(changes):
+    """Apply ``(activity, sign)`` pairs to both rollup collections in bulk."""
+    teams = _team_ids({activity.user_id for activity, _ in changes})
+    updates = {}
+    for activity, sign in changes:
+        moment = mongo.naive_utc(activity.activity_date)
+        calories = activity.calories_burned
+        for name, bucket in ((DAILY, day_bucket), (WEEKLY, week_bucket)):
+            period, start = bucket(moment)
+            for scope, key in _keys(activity, teams):
+                _id = f'{scope}:{key}:{period}'
+                update = updates.setdefault((name, _id), {
+                    '$inc': {},
+                    '$set': {'scope': scope, 'key': key, 'period': period, 'start': start},
+                })
+                inc = update['$inc']
+                for field, value in (
+                    ('calories', calories),
+                    ('workouts', 1),
+                    ('minutes', activity.duration_minutes),
+                    ('distance_km', activity.distance_km or 0.0),
+                    ('calories_sq', calories * calories),
+                ):
+                    inc[field] = inc.get(field, 0) + sign * value
+                if scope == 'workout':
+                    histogram = f'histogram.{calorie_bucket(calories)}'
+                    inc[histogram] = inc.get(histogram, 0) + sign
+                    update['$set']['workout_name'] = activity.workout_name
+
+    db = mongo.get_db()
+    for name in (DAILY, WEEKLY):
+        operations = [
+            UpdateOne({'_id': _id}, update, upsert=True)
+            for (collection, _id), update in updates.items() if collection == name
+        ]
+        if operations:
+            db[name].bulk_write(operations, ordered=False)
+
+
+def record_activities(activities):
+    """Add new activities to their rollups."""
+    if activities:
+        _apply([(activity, 1) for activity in activities])
+
+
+def discard_activity(activity):
+    """Remove a deleted activity from its rollups."""
+    _apply([(activity, -1)])
+
+
+def replace_activity(previous, activity):
+    """Move an updated activity's contribution from its old values to its new ones."""
+    _apply([(previous, -1), (activity, 1)])
+
+
+def change_team(user_id, previous, team_id):
+    """Move a user's totals from ``previous``'s team rollups to ``team_id``'s."""
+    db = mongo.get_db()
+    for name in (DAILY, WEEKLY):
+        operations = []
+        for row in db[name].find({'scope': 'user', 'key': str(user_id), 'workouts': {'$gt': 0}}):
+            for team, sign in ((previous, -1), (team_id, 1)):
+                if team:
+                    operations.append(UpdateOne(
+                        {'_id': f'team:{team}:{row["period"]}'},
+                        {'$inc': {field: sign * row[field] for field in FIELDS},
+                         '$set': {'scope': 'team', 'key': team, 'period': row['period'], 'start': row['start']}},
+                        upsert=True,
+                    ))
+        if operations:
+            db[name].bulk_write(operations, ordered=False)
+
+
+def rebuild():
+    """Recompute every rollup from the hot and archived activities, holding off writes."""
+    with events.rebuilding():
+        return _rebuild()
+
+
+def _rebuild():
+    db = mongo.get_db()
+    db[DAILY].delete_many({})
+    db[WEEKLY].delete_many({})
+
+    fields = FIELDS
+    daily = {}
+
+    def add(scope, key, day, row, histogram=None):
+        period, start = day_bucket(day)
+        doc = daily.setdefault(f'{scope}:{key}:{period}', {
+            'scope': scope, 'key': key, 'period': period, 'start': start,
+            **dict.fromkeys(fields, 0),
+        })
+        for field in fields:
+            doc[field] += row[field]
+        if histogram is not None:
+            doc.setdefault('histogram', {})
+            doc['histogram'][histogram] = doc['histogram'].get(histogram, 0) + row['workouts']
+            doc['workout_name'] = row['workout_name']
+
+    sums = {
+        'calories': {'$sum': '$calories_burned'},
+        'workouts': {'$sum': 1},
+        'minutes': {'$sum': '$duration_minutes'},
+        'distance_km': {'$sum': {'$ifNull': ['$distance_km', 0]}},
+        'calories_sq': {'$sum': {'$multiply': ['$calories_burned', '$calories_burned']}},
+    }
+    day = {'$dateToString': {'format': '%Y-%m-%d', 'date': '$activity_date'}}
+
+    user_days = [
+        row
+        for source in archive.sources()
+        for row in source.aggregate([
+            {'$group': {'_id': {'user_id': '$user_id', 'day': day}, **sums}},
+        ], allowDiskUse=True)
+    ]
+    teams = _team_ids({row['_id']['user_id'] for row in user_days})
+    for row in user_days:
+        moment = datetime.strptime(row['_id']['day'], '%Y-%m-%d')
+        user_id = str(row['_id']['user_id'])
+        add('user', user_id, moment, row)
+        if teams.get(user_id):
+            add('team', teams[user_id], moment, row)
+
+    size = settings.OCTOFIT_CALORIE_BUCKET_SIZE
+    for source in archive.sources():
+        for row in source.aggregate([
+            {'$group': {
+                '_id': {
+                    'workout_id': '$workout_id',
+                    'day': day,
+                    'bucket': {'$multiply': [{'$floor': {'$divide': ['$calories_burned', size]}}, size]},
+                },
+                'workout_name': {'$last': '$workout_name'},
+                **sums,
+            }},
+        ], allowDiskUse=True):
+            moment = datetime.strptime(row['_id']['day'], '%Y-%m-%d')
+            add('workout', str(row['_id']['workout_id']), moment, row, str(int(row['_id']['bucket'])))
+
+    weekly = {}
+    for doc in daily.values():
+        period, start = week_bucket(doc['start'])
+        week = weekly.setdefault(f'{doc["scope"]}:{doc["key"]}:{period}', {
+            'scope': doc['scope'], 'key': doc['key'], 'period': period, 'start': start,
+            **dict.fromkeys(fields, 0),
+        })
+        for field in fields:
+            week[field] += doc[field]
+        if 'histogram' in doc:
+            week.setdefault('histogram', {})
+            for bucket, count in doc['histogram'].items():
+                week['histogram'][bucket] = week['histogram'].get(bucket, 0) + count
+            week['workout_name'] = doc['workout_name']
+
+    for name, docs in ((DAILY, daily), (WEEKLY, weekly)):
+        if docs:
+            db[name].insert_many([{'_id': _id, **doc} for _id, doc in docs.items()], ordered=False)
+    return len(daily), len(weekly)
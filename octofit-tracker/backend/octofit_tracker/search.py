@@ -0,0 +1,155 @@
+"""
+Prefix index behind typeahead search and the admin search boxes.
+
+Every user, workout and activity with searchable text has one document in
+``search_index`` holding the prefixes of its words: user names, aliases
+and emails, workout names and activity notes.  Words are lowercased and
+stripped of accents, and each contributes its prefixes from
+``OCTOFIT_SEARCH_MIN_PREFIX`` to ``OCTOFIT_SEARCH_MAX_PREFIX`` characters
+long.  A query matches the documents holding a prefix for each of its
+words, which one multikey index lookup answers in primary key order,
+instead of the regex scans djongo issues for ``icontains``.
+
+``events`` and the admin keep entries in step with writes, archiving an
+activity drops its entry and ``rebuild`` recomputes the whole index; run
+it after changing the prefix lengths.
+"""
+import re
+import unicodedata
+from collections import namedtuple
+
+from django.conf import settings
+from pymongo import DeleteOne, ReplaceOne
+from rest_framework.exceptions import ValidationError
+
+from . import mongo
+from .models import Activity, User, Workout
+from .repositories import projection
+from .serializers import activity_reader, user_reader, workout_reader
+
+INDEX = 'search_index'
+
+WORD = re.compile(r'\w+')
+
+Source = namedtuple('Source', 'model fields reader newest_first')
+
+SOURCES = {
+    'user': Source(User, ('name', 'alias', 'email'), user_reader, False),
+    'workout': Source(Workout, ('name',), workout_reader, False),
+    'activity': Source(Activity, ('notes',), activity_reader, True),
+}
+
+
+def words(text):
+    """Return the normalized words of ``text``."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return WORD.findall(''.join(char for char in decomposed if not unicodedata.combining(char)).casefold())
+
+
+def terms(texts):
+    """Return the sorted prefixes indexed for ``texts``."""
+    low, high = settings.OCTOFIT_SEARCH_MIN_PREFIX, settings.OCTOFIT_SEARCH_MAX_PREFIX
+    prefixes = set()
+    for text in texts:
+        for word in words(text):
+            prefixes.update(word[:length] for length in range(low, min(len(word), high) + 1))
+    return sorted(prefixes)
+
+
+def query_terms(text):
+    """Return the prefixes a query must match, one per word long enough to be indexed."""
+    low, high = settings.OCTOFIT_SEARCH_MIN_PREFIX, settings.OCTOFIT_SEARCH_MAX_PREFIX
+    return sorted({word[:high] for word in words(text) if len(word) >= low})
+
+
+def _entry(kind, row):
+    # Model instances keep concrete fields in __dict__; rows from Mongo are dicts.
+    get = row.get if isinstance(row, dict) else row.__dict__.get
+    pk = get('id')
+    return f'{kind}:{pk}', pk, terms(get(field) for field in SOURCES[kind].fields)
+
+
+def index(kind, rows, new=False):
+    """
+    Add or refresh the entries of ``rows``, instances or documents of the ``kind`` model.
+
+    Rows left without searchable text lose their entry; ``new`` rows have
+    none yet, so those are simply skipped.
+    """
+    operations = []
+    for _id, pk, prefixes in (_entry(kind, row) for row in rows):
+        if prefixes:
+            operations.append(ReplaceOne({'_id': _id}, {'kind': kind, 'pk': pk, 'terms': prefixes}, upsert=True))
+        elif not new:
+            operations.append(DeleteOne({'_id': _id}))
+    if operations:
+        mongo.get_db()[INDEX].bulk_write(operations, ordered=False)
+
+
+def remove(kind, pks):
+    """Drop the entries of deleted ``pks``."""
+    pks = list(pks)
+    if pks:
+        mongo.get_db()[INDEX].delete_many({'_id': {'$in': [f'{kind}:{pk}' for pk in pks]}})
+
+
+def find(kind, text, limit):
+    """
+    Return the primary keys of at most ``limit`` matches of ``text``.
+
+    Matches come in primary key order, newest first for activities.  A
+    query without a word of ``OCTOFIT_SEARCH_MIN_PREFIX`` characters
+    matches nothing.
+    """
+    prefixes = query_terms(text)
+    if not prefixes:
+        return []
+    cursor = mongo.get_db()[INDEX].find(
+        {'kind': kind, 'terms': {'$all': prefixes}}, {'_id': 0, 'pk': 1},
+        sort=[('pk', -1 if SOURCES[kind].newest_first else 1)], limit=limit,
+    )
+    return [entry['pk'] for entry in cursor]
+
+
+def results(kind, params, fields=None):
+    """Validate ``q`` and ``limit`` and return the rendered matches, best first."""
+    text = params.get('q', '').strip()
+    if not text:
+        raise ValidationError({'q': 'This query parameter is required.'})
+    try:
+        limit = int(params.get('limit', 10))
+    except ValueError:
+        raise ValidationError({'limit': 'Must be an integer.'})
+    if limit < 1:
+        raise ValidationError({'limit': 'Must be at least 1.'})
+    source = SOURCES[kind]
+    pks = find(kind, text, min(limit, settings.OCTOFIT_SEARCH_MAX_LIMIT))
+    documents = {
+        document['id']: document
+        for document in mongo.collection(source.model).find(
+            {'id': {'$in': pks}}, {**projection(source.reader.serializer_class, fields), 'id': 1})
+    }
+    return source.reader.many([documents[pk] for pk in pks if pk in documents], fields)
+
+
+def rebuild(batch_size=10000):
+    """Recompute every entry from the users, workouts and activities; returns entries per kind."""
+    collection = mongo.get_db()[INDEX]
+    collection.delete_many({})
+    counts = {}
+    for kind, source in SOURCES.items():
+        counts[kind], batch = 0, []
+        cursor = mongo.collection(source.model).find(
+            {}, {'_id': 0, 'id': 1, **dict.fromkeys(source.fields, 1)}, batch_size=batch_size)
+        for row in cursor:
+            _id, pk, prefixes = _entry(kind, row)
+            if prefixes:
+                batch.append({'_id': _id, 'kind': kind, 'pk': pk, 'terms': prefixes})
+            if len(batch) >= batch_size:
+                collection.insert_many(batch, ordered=False)
+                counts[kind] += len(batch)
+                batch = []
+        if batch:
+            collection.insert_many(batch, ordered=False)
+            counts[kind] += len(batch)
+    return counts
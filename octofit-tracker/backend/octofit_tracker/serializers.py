@@ -1,32 +1,158 @@
-from rest_framework import serializers
-from .models import Team, User, Workout, Activity, Leaderboard
+import json
+from datetime import timezone as dt_timezone
 
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+from . import instrumentation
+from .models import Team, TeamStanding, User, Workout, Activity, Leaderboard, Job
 
-class TeamSerializer(serializers.ModelSerializer):
+
+class TimedRepresentationMixin:
+    """Count serializer time towards the ``serialize`` phase of the request metrics."""
+
+    def to_representation(self, instance):
+        with instrumentation.phase('serialize'):
+            return super().to_representation(instance)
+
+
+class SparseFieldsMixin:
+    """Accept a ``fields`` argument limiting the serializer to those fields."""
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class TeamSerializer(SparseFieldsMixin, TimedRepresentationMixin, serializers.ModelSerializer):
     class Meta:
         model = Team
         fields = ['_id', 'name', 'description', 'created_at', 'member_count']
 
 
-class UserSerializer(serializers.ModelSerializer):
+class TeamStandingSerializer(SparseFieldsMixin, TimedRepresentationMixin, serializers.ModelSerializer):
+    class Meta:
+        model = TeamStanding
+        fields = ['team_id', 'member_count', 'active_members', 'total_calories', 'total_workouts', 'total_minutes', 'total_distance_km', 'last_updated']
+
+
+class UserSerializer(SparseFieldsMixin, TimedRepresentationMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'name', 'alias', 'email', 'team_id', 'power', 'fitness_level', 'joined_at']
 
 
-class WorkoutSerializer(serializers.ModelSerializer):
+class WorkoutSerializer(SparseFieldsMixin, TimedRepresentationMixin, serializers.ModelSerializer):
     class Meta:
         model = Workout
         fields = ['id', 'name', 'description', 'difficulty', 'duration_minutes', 'calories_per_session', 'created_at']
 
 
-class ActivitySerializer(serializers.ModelSerializer):
+class ActivitySerializer(SparseFieldsMixin, TimedRepresentationMixin, serializers.ModelSerializer):
     class Meta:
         model = Activity
         fields = ['id', 'user_id', 'workout_id', 'workout_name', 'duration_minutes', 'calories_burned', 'distance_km', 'activity_date', 'notes']
 
 
-class LeaderboardSerializer(serializers.ModelSerializer):
+class LeaderboardSerializer(SparseFieldsMixin, TimedRepresentationMixin, serializers.ModelSerializer):
     class Meta:
         model = Leaderboard
         fields = ['id', 'user_id', 'user_name', 'user_alias', 'team_id', 'total_calories', 'total_workouts', 'total_minutes', 'total_distance_km', 'rank', 'last_updated']
+
+
+class JobSerializer(SparseFieldsMixin, TimedRepresentationMixin, serializers.ModelSerializer):
+    args = serializers.SerializerMethodField()
+    result = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = ['id', 'name', 'args', 'status', 'attempts', 'max_attempts', 'run_after', 'created_at', 'started_at', 'finished_at', 'worker', 'last_error', 'result']
+
+    def get_args(self, job):
+        return json.loads(job.args or '[]')
+
+    def get_result(self, job):
+        return json.loads(job.result) if job.result else None
+
+
+class FastReadSerializer:
+    """
+    Read-only renderer for large list responses.
+
+    Builds plain dicts straight from model instances, ``.values()`` rows or
+    projected Mongo documents.  The field list and a converter per field
+    are derived once from a ModelSerializer, so the output matches what
+    that serializer renders without DRF's per-field machinery.
+    """
+    simple_types = {
+        serializers.CharField: str,
+        serializers.EmailField: str,
+        serializers.IntegerField: int,
+        serializers.FloatField: float,
+    }
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self._converters = {}
+
+    @property
+    def fields(self):
+        """Return the model fields to fetch, in output order."""
+        return list(self.serializer_class.Meta.fields)
+
+    def _converter(self, field, naive_is_utc):
+        if type(field) in self.simple_types:
+            return self.simple_types[type(field)]
+        if type(field) is serializers.DateTimeField and \
+                str(getattr(field, 'format', api_settings.DATETIME_FORMAT)).lower() == ISO_8601 and naive_is_utc:
+            def datetime_converter(value):
+                if isinstance(value, str):
+                    return value
+                if value.tzinfo is not None:
+                    value = value.astimezone(dt_timezone.utc).replace(tzinfo=None)
+                return value.isoformat() + 'Z'
+            return datetime_converter
+        return field.to_representation
+
+    def converters(self):
+        """Return ``(name, source, converter)`` for each readable field."""
+        # DRF makes naive datetimes aware in the current time zone; only UTC renders them with a bare 'Z'.
+        naive_is_utc = settings.USE_TZ and timezone.get_current_timezone_name() == 'UTC'
+        if naive_is_utc not in self._converters:
+            converters = []
+            for name, field in self.serializer_class().fields.items():
+                if field.write_only:
+                    continue
+                if '.' in field.source or field.source == '*':
+                    raise ImproperlyConfigured(f'{self.serializer_class.__name__}.{name} has a nested source.')
+                converters.append((name, field.source, self._converter(field, naive_is_utc)))
+            self._converters[naive_is_utc] = converters
+        return self._converters[naive_is_utc]
+
+    def many(self, rows, fields=None):
+        """Render an iterable of instances, dicts or documents, optionally only ``fields``."""
+        converters = self.converters()
+        if fields is not None:
+            converters = [converter for converter in converters if converter[0] in fields]
+        data = []
+        with instrumentation.phase('serialize'):
+            for row in rows:
+                # Concrete model fields live in the instance __dict__ under their attname.
+                get = row.get if isinstance(row, dict) else row.__dict__.get
+                item = {}
+                for name, source, convert in converters:
+                    value = get(source)
+                    item[name] = None if value is None else convert(value)
+                data.append(item)
+        return data
+
+
+activity_reader = FastReadSerializer(ActivitySerializer)
+leaderboard_reader = FastReadSerializer(LeaderboardSerializer)
+user_reader = FastReadSerializer(UserSerializer)
+team_reader = FastReadSerializer(TeamSerializer)
+workout_reader = FastReadSerializer(WorkoutSerializer)
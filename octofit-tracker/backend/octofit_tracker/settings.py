@@ -49,6 +49,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'octofit_tracker.middleware.RequestMetricsMiddleware',
+    'octofit_tracker.middleware.AsgiUrlconfMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -96,6 +98,33 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# The responses cache holds polled leaderboard/team responses. It is an
+# in-process LRU by default, whose invalidation tokens live in Mongo so
+# writes from any process still take effect; set OCTOFIT_CACHE_REDIS_URL
+# to share the cached bodies too.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'octofit-responses',
+        'TIMEOUT': 30,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+OCTOFIT_CACHE_REDIS_URL = os.getenv('OCTOFIT_CACHE_REDIS_URL')
+if OCTOFIT_CACHE_REDIS_URL:
+    CACHES['responses'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': OCTOFIT_CACHE_REDIS_URL,
+        'TIMEOUT': 30,
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -137,6 +166,95 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Django REST Framework
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.IdCursorPagination',
+    'PAGE_SIZE': 50,
+}
+
+# OctoFit settings
+# Number of NDJSON rows validated and inserted together by /api/activities/bulk/
+OCTOFIT_BULK_BATCH_SIZE = 1000
+
+# Width in calories of the histogram buckets returned by /api/workouts/calorie_distribution/
+OCTOFIT_CALORIE_BUCKET_SIZE = 100
+
+# Viewsets whose hot read actions query pymongo directly instead of going through djongo
+OCTOFIT_NATIVE_READS = {
+    'ActivityViewSet': True,
+    'LeaderboardViewSet': True,
+}
+
+# Requests repeating one Mongo command on one collection more often than this are flagged as N+1
+OCTOFIT_N_PLUS_ONE_THRESHOLD = 10
+
+# Run background jobs inline as they are queued instead of on `manage.py run_worker`
+OCTOFIT_TASKS_EAGER = False
+
+# Background job retries: attempts per job, first retry delay (doubling) and its cap, in seconds
+OCTOFIT_JOB_MAX_ATTEMPTS = 3
+OCTOFIT_JOB_RETRY_DELAY = 5
+OCTOFIT_JOB_RETRY_MAX_DELAY = 300
+
+# Lease in seconds of the cross-process locks in mongo.lock; a holder renews it while alive, so it only
+# runs out when the holding process dies
+OCTOFIT_LOCK_LEASE = 30
+
+# Seconds after which a running job is assumed lost with its worker and queued again
+OCTOFIT_JOB_TIMEOUT = 3600
+
+# Seconds between the worker's sweeps for such lost jobs
+OCTOFIT_JOB_REQUEUE_INTERVAL = 60
+
+# URLconf used for requests served over ASGI; it sends the hot read endpoints to async views
+OCTOFIT_ASGI_URLCONF = 'octofit_tracker.urls_async'
+
+# Live updates at /api/live/ (ASGI only): seconds between coalesced pushes, leaderboard entries
+# tracked, most recent activities sent per push and seconds between keepalive comments
+OCTOFIT_LIVE_TICK = 1.0
+OCTOFIT_LIVE_LEADERBOARD_SIZE = 50
+OCTOFIT_LIVE_ACTIVITIES = 20
+OCTOFIT_LIVE_KEEPALIVE = 15
+
+# Seconds before the in-memory rank index behind /api/leaderboard/rank/ is reloaded to pick up
+# writes made by other processes (None to rely on in-process updates only)
+OCTOFIT_RANK_INDEX_MAX_AGE = 60
+# Recompute the leaderboard and team standings with NumPy column arithmetic when NumPy is installed
+# (False to always use the Mongo aggregation rebuilds)
+OCTOFIT_COLUMNAR_REBUILD = True
+# Documents read from the cursor, rendered and written together by the streaming exports
+OCTOFIT_EXPORT_BATCH_SIZE = 5000
+# Activities older than this many days are moved from the activities collection to the archive
+OCTOFIT_ARCHIVE_AFTER_DAYS = 365
+# Activities copied to the archive and deleted from the hot collection together
+OCTOFIT_ARCHIVE_BATCH_SIZE = 5000
+# WiredTiger block compressor of the archive collection (snappy, zlib or zstd; None for the server default)
+OCTOFIT_ARCHIVE_COMPRESSOR = 'zstd'
+# Largest ?limit= accepted by /api/activities/history/
+OCTOFIT_HISTORY_MAX_LIMIT = 1000
+# Delta sync (?since= on the list endpoints): default and largest number of changes per response, and
+# seconds a write is held back so changes committed out of version order are not skipped
+OCTOFIT_SYNC_PAGE_SIZE = 500
+OCTOFIT_SYNC_SETTLE_SECONDS = 2
+# Search index behind the /search/ endpoints and the admin: shortest and longest word prefixes indexed
+# (run rebuild_search_index after changing them), the largest ?limit= and the matches an admin search lists
+OCTOFIT_SEARCH_MIN_PREFIX = 2
+OCTOFIT_SEARCH_MAX_PREFIX = 15
+OCTOFIT_SEARCH_MAX_LIMIT = 50
+OCTOFIT_SEARCH_ADMIN_LIMIT = 1000
+
+# Windowed leaderboards at /api/leaderboard/window/: days a day, week or month window is kept after
+# it closes, seconds a custom range is kept after it is built, the longest custom range in days and
+# the largest ?limit=
+OCTOFIT_WINDOW_RETENTION_DAYS = {
+    'day': 7,
+    'week': 56,
+    'month': 366,
+}
+OCTOFIT_WINDOW_CUSTOM_TTL = 3600
+OCTOFIT_WINDOW_MAX_DAYS = 366
+OCTOFIT_WINDOW_MAX_LIMIT = 100
+
 # CORS Settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
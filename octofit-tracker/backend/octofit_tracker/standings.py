@@ -0,0 +1,130 @@
+"""
+Materialized team standings.
+
+One ``team_standings`` document per team holds the summed leaderboard
+totals of its members, the number of members and the number of members
+with at least one workout.  Leaderboard deltas and user membership changes
+are applied with ``$inc`` upserts, so standings never need to scan the
+leaderboard.  ``Team.member_count`` is kept in step with the same changes.
+"""
+from . import events, leaderboard, mongo, sync
+from .models import Leaderboard, Team, TeamStanding, User
+
+# Standing counters besides the leaderboard totals.  ``leaderboard.TOTAL_FIELDS`` is read at call time,
+# since leaderboard imports this module.
+COUNTERS = ('member_count', 'active_members')
+
+
+def _inc(team_id, inc):
+    if not team_id:
+        return
+    # Zero increments make sure a freshly upserted standing has every counter.
+    mongo.collection(TeamStanding).update_one(
+        {'team_id': team_id},
+        {'$inc': {**dict.fromkeys(leaderboard.TOTAL_FIELDS + COUNTERS, 0), **inc},
+         '$set': {'last_updated': mongo.now()}},
+        upsert=True,
+    )
+    if inc.get('member_count'):
+        mongo.collection(Team).update_one({'_id': team_id},
+                                          {'$inc': {'member_count': inc['member_count']}, '$set': sync.stamp()})
+
+
+def apply_delta(team_id, delta, workouts_before):
+    """Add a member's leaderboard delta to their team."""
+    inc = {field: delta[field] for field in leaderboard.TOTAL_FIELDS if delta.get(field)}
+    workouts_after = workouts_before + delta.get('total_workouts', 0)
+    if workouts_before <= 0 < workouts_after:
+        inc['active_members'] = 1
+    elif workouts_after <= 0 < workouts_before:
+        inc['active_members'] = -1
+    if inc:
+        _inc(team_id, inc)
+
+
+def _contribution(entry, sign):
+    inc = {field: sign * entry[field] for field in leaderboard.TOTAL_FIELDS}
+    if entry['total_workouts'] > 0:
+        inc['active_members'] = sign
+    return inc
+
+
+def member_joined(team_id, entry=None):
+    """Count a new member, bringing their leaderboard totals if they have any."""
+    inc = _contribution(entry, 1) if entry else {}
+    _inc(team_id, {'member_count': 1, **inc})
+
+
+def member_left(team_id, entry=None):
+    """Stop counting a member and remove their leaderboard totals."""
+    inc = _contribution(entry, -1) if entry else {}
+    _inc(team_id, {'member_count': -1, **inc})
+
+
+def ranked():
+    """Return every team's standing ordered by calories, with rank and team name."""
+    names = {team['_id']: team.get('name', '') for team in mongo.collection(Team).find({}, {'name': 1})}
+    rows = mongo.collection(TeamStanding).find({}, {'_id': 0}).sort([('total_calories', -1), ('team_id', 1)])
+    return [
+        {'rank': rank, 'name': names.get(row['team_id'], ''), **row}
+        for rank, row in enumerate(rows, 1)
+    ]
+
+
+def rebuild():
+    """Recompute every standing and member count from users and the leaderboard, holding off writes."""
+    with events.rebuilding():
+        return _rebuild()
+
+
+def _rebuild():
+    counts = {
+        row['_id']: row['count']
+        for row in mongo.collection(User).aggregate([{'$group': {'_id': '$team_id', 'count': {'$sum': 1}}}])
+    }
+    totals = {
+        row.pop('_id'): row
+        for row in mongo.collection(Leaderboard).aggregate([
+            {'$group': {
+                '_id': '$team_id',
+                **{field: {'$sum': f'${field}'} for field in leaderboard.TOTAL_FIELDS},
+                'active_members': {'$sum': {'$cond': [{'$gt': ['$total_workouts', 0]}, 1, 0]}},
+            }},
+        ])
+    }
+    return write(counts, totals)
+
+
+def write(counts, totals):
+    """
+    Replace every standing and member count.
+
+    ``counts`` maps team ids to member counts and ``totals`` maps them to
+    summed leaderboard totals and active members.  Callers hold
+    ``events.rebuilding()`` from computing them on.  Returns the number of
+    standings written.
+    """
+    now = mongo.now()
+    standings = mongo.collection(TeamStanding)
+    standings.delete_many({})
+    documents = [
+        {
+            'team_id': team_id,
+            'member_count': counts.get(team_id, 0),
+            'active_members': 0,
+            **dict.fromkeys(leaderboard.TOTAL_FIELDS, 0),
+            **totals.get(team_id, {}),
+            'last_updated': now,
+        }
+        for team_id in sorted(set(counts) | set(totals)) if team_id
+    ]
+    for document in documents:
+        document['total_distance_km'] = round(document['total_distance_km'], 2)
+    if documents:
+        standings.insert_many(documents)
+    teams = mongo.collection(Team)
+    for team in teams.find({}, {'_id': 1, 'member_count': 1}):
+        count = counts.get(team['_id'], 0)
+        if team.get('member_count') != count:
+            teams.update_one({'_id': team['_id']}, {'$set': {'member_count': count, **sync.stamp()}})
+    return len(documents)
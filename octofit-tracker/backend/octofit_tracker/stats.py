@@ -0,0 +1,134 @@
+"""
+Activity statistics served from the daily and weekly rollups.
+
+Reads touch one rollup document per bucket, so their cost depends on the
+number of buckets in the range rather than on the number of activities.
+Day and month totals are read from the daily rollups, so ranges are exact
+to the day; week totals are read from the weekly rollups and include every
+week that starts on or after the week containing ``start``.
+"""
+import math
+from datetime import datetime, time
+
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from . import mongo
+from .rollups import DAILY, WEEKLY, day_bucket, week_bucket
+
+PERIOD_FORMATS = {
+    'day': '%Y-%m-%d',
+    'week': '%G-W%V',
+    'month': '%Y-%m',
+}
+
+TOTAL_FIELDS = ('calories', 'workouts', 'minutes', 'distance_km')
+
+
+def parse_period(value):
+    """Validate a ``period`` query parameter."""
+    period = value or 'day'
+    if period not in PERIOD_FORMATS:
+        raise ValidationError({'period': f'Must be one of: {", ".join(PERIOD_FORMATS)}.'})
+    return period
+
+
+def parse_bound(value, name):
+    """Parse a ``start``/``end`` query parameter into a naive UTC datetime."""
+    if not value:
+        return None
+    try:
+        # Both raise ValueError for well-formed but impossible dates such as 2024-02-30.
+        moment = parse_datetime(value)
+        day = parse_date(value) if moment is None else None
+    except ValueError:
+        moment = day = None
+    if moment is None:
+        if day is None:
+            raise ValidationError({name: 'Must be an ISO 8601 date or datetime.'})
+        moment = datetime.combine(day, time.min)
+    return mongo.naive_utc(moment)
+
+
+def _start_range(start, end, bucket):
+    bounds = {}
+    if start:
+        bounds['$gte'] = bucket(start)[1]
+    if end:
+        bounds['$lt'] = end
+    return {'start': bounds} if bounds else {}
+
+
+def _bucketed_totals(scope, key, period, start, end):
+    bucket = week_bucket if period == 'week' else day_bucket
+    match = {'scope': scope, 'key': str(key), 'workouts': {'$gt': 0}, **_start_range(start, end, bucket)}
+    db = mongo.get_db()
+    if period == 'month':
+        rows = db[DAILY].aggregate([
+            {'$match': match},
+            {'$group': {
+                '_id': {'$dateToString': {'format': PERIOD_FORMATS['month'], 'date': '$start'}},
+                **{field: {'$sum': f'${field}'} for field in TOTAL_FIELDS},
+            }},
+            {'$sort': {'_id': 1}},
+        ])
+        return [{'period': row.pop('_id'), **row} for row in rows]
+    collection = db[WEEKLY if period == 'week' else DAILY]
+    rows = collection.find(match, {'period': 1, **dict.fromkeys(TOTAL_FIELDS, 1), '_id': 0})
+    return [{'period': row.pop('period'), **row} for row in rows.sort('start', 1)]
+
+
+def user_totals(user_id, period, start=None, end=None):
+    """Return a user's totals per day, week or month."""
+    return _bucketed_totals('user', user_id, period, start, end)
+
+
+def team_totals(team_id, period, start=None, end=None):
+    """Return the combined totals of a team's members per day, week or month."""
+    return _bucketed_totals('team', team_id, period, start, end)
+
+
+def calorie_distribution(workout_id=None, start=None, end=None):
+    """
+    Return per-workout calorie statistics and a histogram.
+
+    Histogram buckets are ``OCTOFIT_CALORIE_BUCKET_SIZE`` calories wide and
+    keyed by their lower bound.  Without a range the weekly rollups are
+    read, since they hold the same totals in fewer documents.
+    """
+    name = DAILY if start or end else WEEKLY
+    match = {'scope': 'workout', **_start_range(start, end, day_bucket)}
+    if workout_id:
+        match['key'] = str(workout_id)
+    workouts = {}
+    for row in mongo.get_db()[name].find(match).sort('start', 1):
+        entry = workouts.setdefault(row['key'], {'count': 0, 'total': 0, 'total_sq': 0, 'histogram': {}})
+        entry['workout_name'] = row['workout_name']
+        entry['count'] += row['workouts']
+        entry['total'] += row['calories']
+        entry['total_sq'] += row['calories_sq']
+        for bucket, count in row.get('histogram', {}).items():
+            entry['histogram'][int(bucket)] = entry['histogram'].get(int(bucket), 0) + count
+
+    return [
+        describe_calories(key, entry['workout_name'], entry['count'], entry['total'], entry['total_sq'],
+                          {bucket: count for bucket, count in entry['histogram'].items() if count})
+        for key, entry in sorted(workouts.items()) if entry['count']
+    ]
+
+
+def describe_calories(workout_id, workout_name, count, total, total_sq, histogram):
+    """Build a distribution entry from a count, sum and sum of squares."""
+    mean = total / count if count else 0.0
+    variance = max(total_sq / count - mean * mean, 0.0) if count else 0.0
+    return {
+        'workout_id': workout_id,
+        'workout_name': workout_name,
+        'count': count,
+        'mean': round(mean, 2),
+        'stddev': round(math.sqrt(variance), 2),
+        'histogram': [
+            {'from': bucket, 'count': histogram[bucket]}
+            for bucket in sorted(histogram)
+        ],
+    }
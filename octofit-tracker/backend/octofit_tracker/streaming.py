@@ -0,0 +1,108 @@
+"""
+ASGI handler streaming responses without blocking the event loop.
+
+Django 4.1 iterates a ``StreamingHttpResponse`` on the event loop, so under
+ASGI an export read from a Mongo cursor stalls every other request of the
+process until it finishes, and it cannot stream an async iterator at all.
+``StreamingASGIHandler`` sends the chunks of a streaming response as worker
+threads produce them, or awaits them for an ``AsyncStreamingHttpResponse``,
+and stops as soon as the client disconnects.  Requests still go through
+the whole middleware stack; only the sending of streamed bodies differs
+from Django's own handler.
+"""
+import asyncio
+import contextlib
+import contextvars
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.http import StreamingHttpResponse
+
+# The ``receive`` of the request being handled, watched for disconnects while a body streams.
+_receive = contextvars.ContextVar('octofit_asgi_receive')
+
+
+class AsyncStreamingHttpResponse(StreamingHttpResponse):
+    """A streaming response over an async iterator, served by ``StreamingASGIHandler``."""
+
+    def _set_streaming_content(self, value):
+        self._iterator = value
+
+    async def __aiter__(self):
+        try:
+            async for part in self._iterator:
+                yield self.make_bytes(part)
+        finally:
+            if hasattr(self._iterator, 'aclose'):
+                await self._iterator.aclose()
+
+
+def in_thread(func):
+    """Wrap ``func`` to run on a thread of its own rather than Django's shared sync thread."""
+    return sync_to_async(func, thread_sensitive=False)
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """Django's ASGI handler, streaming response bodies off the event loop."""
+
+    async def handle(self, scope, receive, send):
+        token = _receive.set(receive)
+        try:
+            await super().handle(scope, receive, send)
+        finally:
+            _receive.reset(token)
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        headers = [
+            (header.encode('ascii') if isinstance(header, str) else header,
+             value.encode('latin1') if isinstance(value, str) else value)
+            for header, value in response.items()
+        ]
+        headers += [(b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+                    for cookie in response.cookies.values()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+        disconnected = asyncio.ensure_future(self.disconnect(_receive.get()))
+        try:
+            if isinstance(response, AsyncStreamingHttpResponse):
+                await self.send_async_chunks(response, send, disconnected)
+            else:
+                await self.send_chunks(response, send, disconnected)
+        finally:
+            disconnected.cancel()
+            # Closes the Mongo cursor of an export the client abandoned.
+            await sync_to_async(response.close, thread_sensitive=True)()
+
+    async def send_chunks(self, response, send, disconnected):
+        chunks = iter(response)
+        while not disconnected.done():
+            chunk = await in_thread(next)(chunks, None)
+            if chunk is None:
+                return await send({'type': 'http.response.body'})
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+    async def send_async_chunks(self, response, send, disconnected):
+        chunks = response.__aiter__()
+        try:
+            while True:
+                chunk = asyncio.ensure_future(chunks.__anext__())
+                await asyncio.wait({chunk, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if not chunk.done():
+                    # Cancelling the pending chunk unwinds the iterator and runs its cleanup.
+                    chunk.cancel()
+                    with contextlib.suppress(asyncio.CancelledError):
+                        await chunk
+                    return
+                try:
+                    body = chunk.result()
+                except StopAsyncIteration:
+                    return await send({'type': 'http.response.body'})
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        finally:
+            await chunks.aclose()
+
+    async def disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
@@ -0,0 +1,145 @@
+"""
+Change tracking for delta sync.
+
+Teams, users, workouts, activities and leaderboard entries carry a
+``version`` drawn from one counter shared by all of them and the
+``updated_at`` of their last write.  ORM saves are stamped by
+``models.Versioned``; native writes add ``stamp()`` to their ``$set`` or
+run new documents through ``stamp_documents``.  Deleting a row records a
+tombstone with a fresh version in ``sync_tombstones``.  Archiving an
+activity is not a deletion, so clients keep activities they already have.
+
+``changes`` returns the rows and tombstones of one collection that are
+newer than a token, in version order.  Tokens are keyset positions
+``<version>.<pk>``, so a page never splits rows sharing a version.  Rows
+written in the last ``OCTOFIT_SYNC_SETTLE_SECONDS`` are held back until
+the next sync, so a write that drew an older version but finished later
+is not skipped.
+"""
+import heapq
+from datetime import timedelta
+
+from django.conf import settings
+from pymongo import ReturnDocument, UpdateOne
+from rest_framework.exceptions import ValidationError
+
+from . import mongo
+
+COUNTER = 'sync_versions'
+TOMBSTONES = 'sync_tombstones'
+
+
+def next_versions(count=1):
+    """Reserve ``count`` consecutive versions and return the first."""
+    counter = mongo.get_db()[COUNTER].find_one_and_update(
+        {'_id': 'version'}, {'$inc': {'seq': count}}, upsert=True, return_document=ReturnDocument.AFTER)
+    return counter['seq'] - count + 1
+
+
+def stamp():
+    """Return the ``version`` and ``updated_at`` fields for a ``$set``, one version per update."""
+    return {'version': next_versions(), 'updated_at': mongo.now()}
+
+
+def stamp_documents(documents):
+    """Give each new document its own version and the current ``updated_at``."""
+    if not documents:
+        return documents
+    first, now = next_versions(len(documents)), mongo.now()
+    for offset, document in enumerate(documents):
+        document['version'] = first + offset
+        document['updated_at'] = now
+    return documents
+
+
+def tombstone(collection, pks):
+    """Record the deletion of ``pks`` from ``collection``."""
+    pks = list(pks)
+    if not pks:
+        return
+    first, now = next_versions(len(pks)), mongo.now()
+    mongo.get_db()[TOMBSTONES].insert_many([
+        {'collection': collection, 'pk': pk, 'version': first + offset, 'deleted_at': now}
+        for offset, pk in enumerate(pks)
+    ], ordered=False)
+
+
+def backfill(model, batch_size=1000):
+    """Stamp documents of ``model`` written before change tracking, returning how many were stamped."""
+    collection, column = mongo.collection(model), model._meta.pk.column
+    stamped = 0
+    while True:
+        keys = [document[column] for document in
+                collection.find({'version': {'$exists': False}}, {column: 1}).sort(column, 1).limit(batch_size)]
+        if not keys:
+            return stamped
+        first, now = next_versions(len(keys)), mongo.now()
+        collection.bulk_write([
+            UpdateOne({column: key}, {'$set': {'version': first + offset, 'updated_at': now}})
+            for offset, key in enumerate(keys)
+        ], ordered=False)
+        stamped += len(keys)
+
+
+def token(version, pk=None):
+    """Return the ``since`` token for a position."""
+    return str(version) if pk is None else f'{version}.{pk}'
+
+
+def parse_token(value, model):
+    """Return the ``(version, pk)`` position of a ``since`` token; ``0`` starts from the beginning."""
+    version, _, pk = str(value).partition('.')
+    try:
+        version = int(version)
+        if pk and model._meta.pk.get_internal_type() in ('AutoField', 'BigAutoField', 'IntegerField'):
+            pk = int(pk)
+    except ValueError:
+        raise ValidationError({'since': 'Invalid sync token.'})
+    if version < 0:
+        raise ValidationError({'since': 'Invalid sync token.'})
+    return version, pk or None
+
+
+def _after(version, pk, key):
+    if pk is None:
+        return {'version': {'$gt': version}}
+    return {'$or': [{'version': {'$gt': version}}, {'version': version, key: {'$gt': pk}}]}
+
+
+def changes(model, since, limit, projection):
+    """
+    Return ``(rows, deleted, next_token, more)`` for a collection since a token.
+
+    ``rows`` are the projected documents written after ``since`` and
+    ``deleted`` the primary keys removed after it, at most ``limit`` of
+    them together.  A key that was deleted and written again within the
+    page is only reported in its latest state.
+    """
+    version, pk = parse_token(since, model)
+    column = model._meta.pk.column
+    horizon = mongo.now() - timedelta(seconds=settings.OCTOFIT_SYNC_SETTLE_SECONDS)
+    rows = mongo.collection(model).find(
+        {**_after(version, pk, column), 'updated_at': {'$lte': horizon}},
+        {**projection, 'version': 1, column: 1}, sort=[('version', 1), (column, 1)], limit=limit + 1,
+    )
+    tombstones = mongo.get_db()[TOMBSTONES].find(
+        {'collection': model._meta.db_table, **_after(version, pk, 'pk'), 'deleted_at': {'$lte': horizon}},
+        {'_id': 0, 'pk': 1, 'version': 1}, sort=[('version', 1), ('pk', 1)], limit=limit + 1,
+    )
+    merged = heapq.merge(
+        ((row['version'], row[column], row) for row in rows),
+        ((row['version'], row['pk'], None) for row in tombstones),
+        key=lambda change: change[:2],
+    )
+    page = []
+    for change in merged:
+        page.append(change)
+        if len(page) > limit:
+            break
+    more = len(page) > limit
+    page = page[:limit]
+    latest = {key: row for _, key, row in page}
+    results = [row for row in latest.values() if row is not None]
+    deleted = [key for key, row in latest.items() if row is None]
+    next_token = token(*page[-1][:2]) if page else token(version, pk)
+    return results, deleted, next_token, more
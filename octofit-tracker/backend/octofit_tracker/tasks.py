@@ -0,0 +1,213 @@
+"""
+Background jobs backed by the ``jobs`` collection.
+
+Work that does not have to finish before a response is returned is
+registered by name with ``@task`` and queued with ``enqueue``, which
+stores a ``Job`` document.  ``manage.py run_worker`` claims queued jobs
+atomically with ``find_one_and_update`` and runs them on a thread pool,
+optionally in several processes.
+
+A queued job carries a ``dedupe_key`` (its name and arguments) under a
+sparse unique index, so enqueueing a job identical to one still waiting
+returns the waiting job instead: repeated "rebuild the leaderboard"
+requests coalesce into one run.  The key is dropped when a worker claims
+the job, so changes made while it runs queue a fresh one.  Failed jobs
+are retried with exponential backoff up to ``max_attempts``, and workers
+periodically queue again jobs left running past ``OCTOFIT_JOB_TIMEOUT`` by
+a worker that died.
+
+With ``OCTOFIT_TASKS_EAGER`` set, jobs run inline as they are enqueued,
+which keeps tests deterministic.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from . import mongo
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+_registry = {}
+
+
+def task(func):
+    """Register ``func`` as a task named ``<module>.<function>`` without the package prefix."""
+    name = f'{func.__module__.rsplit(".", 1)[-1]}.{func.__name__}'
+    _registry[name] = func
+    func.task_name = name
+    return func
+
+
+def registered():
+    """Return the names of every registered task."""
+    return sorted(_registry)
+
+
+def _jobs():
+    return mongo.collection(Job)
+
+
+def enqueue(name, *args, dedupe=True, max_attempts=None):
+    """
+    Queue a task by name with JSON-serializable positional arguments.
+
+    Returns the job document; with ``dedupe`` this is the already queued
+    job if an identical one is waiting.
+    """
+    if name not in _registry:
+        raise KeyError(f'Unknown task {name!r}')
+    encoded = json.dumps(list(args))
+    now = mongo.now()
+    job = {
+        'name': name,
+        'args': encoded,
+        'status': QUEUED,
+        'attempts': 0,
+        'max_attempts': max_attempts or settings.OCTOFIT_JOB_MAX_ATTEMPTS,
+        'run_after': now,
+        'created_at': now,
+        'started_at': None,
+        'finished_at': None,
+        'worker': '',
+        'last_error': '',
+        'result': '',
+    }
+    if settings.OCTOFIT_TASKS_EAGER:
+        job.update({'id': mongo.reserve_ids(Job, 1), 'status': RUNNING, 'attempts': 1, 'started_at': now,
+                    'worker': 'eager'})
+        _jobs().insert_one(job)
+        return execute(job, retry=False)
+    if dedupe:
+        job['dedupe_key'] = f'{name}:{encoded}'
+    while True:
+        job['id'] = mongo.reserve_ids(Job, 1)
+        try:
+            _jobs().insert_one(job)
+            return job
+        except DuplicateKeyError:
+            existing = _jobs().find_one({'dedupe_key': job['dedupe_key']})
+            if existing is not None:
+                return existing
+            # The waiting duplicate was claimed in the meantime; queue this one.
+            job.pop('_id', None)
+
+
+def get(job_id):
+    """Return a job document by id, or None."""
+    return _jobs().find_one({'id': int(job_id)})
+
+
+def claim(worker):
+    """Atomically mark the next due job as running for ``worker`` and return it."""
+    now = mongo.now()
+    return _jobs().find_one_and_update(
+        {'status': QUEUED, 'run_after': {'$lte': now}},
+        {
+            '$set': {'status': RUNNING, 'started_at': now, 'worker': worker},
+            '$unset': {'dedupe_key': ''},
+            '$inc': {'attempts': 1},
+        },
+        sort=[('run_after', 1), ('id', 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def backoff(attempts):
+    """Return the delay before retrying a job that failed ``attempts`` times."""
+    delay = settings.OCTOFIT_JOB_RETRY_DELAY * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(delay, settings.OCTOFIT_JOB_RETRY_MAX_DELAY))
+
+
+def execute(job, retry=True):
+    """Run a claimed job and record its outcome, returning the updated document."""
+    try:
+        result = _registry[job['name']](*json.loads(job['args']))
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception('Job %s #%s failed', job['name'], job['id'])
+        now = mongo.now()
+        if retry and job['attempts'] < job['max_attempts']:
+            update = {'status': QUEUED, 'run_after': now + backoff(job['attempts']), 'last_error': error}
+        else:
+            update = {'status': FAILED, 'finished_at': now, 'last_error': error}
+    else:
+        update = {'status': SUCCEEDED, 'finished_at': mongo.now(), 'last_error': '',
+                  'result': json.dumps(result, default=str)}
+    return _jobs().find_one_and_update({'id': job['id']}, {'$set': update}, return_document=ReturnDocument.AFTER)
+
+
+def requeue_stale(timeout):
+    """Return jobs left running longer than ``timeout`` seconds (e.g. by a killed worker) to the queue."""
+    cutoff = mongo.now() - timedelta(seconds=timeout)
+    stale = {'status': RUNNING, 'started_at': {'$lt': cutoff}}
+    jobs = _jobs()
+    failed = jobs.update_many({**stale, '$expr': {'$gte': ['$attempts', '$max_attempts']}},
+                              {'$set': {'status': FAILED, 'finished_at': mongo.now(), 'last_error': 'Timed out'}})
+    requeued = jobs.update_many(stale, {'$set': {'status': QUEUED, 'run_after': mongo.now()}})
+    return requeued.modified_count + failed.modified_count
+
+
+class Worker:
+    """Claims and runs jobs on a pool of threads until stopped."""
+
+    def __init__(self, threads=1, poll_interval=1.0, name=None):
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = threading.Event()
+        self._requeue_lock = threading.Lock()
+        self._next_requeue = 0.0
+
+    def stop(self):
+        self.stopping.set()
+
+    def requeue_stale(self):
+        """Run ``requeue_stale`` once every ``OCTOFIT_JOB_REQUEUE_INTERVAL`` seconds across the threads."""
+        if time.monotonic() < self._next_requeue or not self._requeue_lock.acquire(blocking=False):
+            return
+        try:
+            if time.monotonic() >= self._next_requeue:
+                self._next_requeue = time.monotonic() + settings.OCTOFIT_JOB_REQUEUE_INTERVAL
+                requeue_stale(settings.OCTOFIT_JOB_TIMEOUT)
+        finally:
+            self._requeue_lock.release()
+
+    def run(self, burst=False):
+        """Process jobs; with ``burst`` return once the queue is empty.  Returns the jobs run."""
+        with ThreadPoolExecutor(self.threads, thread_name_prefix='octofit-worker') as pool:
+            loops = [pool.submit(self._loop, f'{self.name}/{index}', burst) for index in range(self.threads)]
+            return sum(loop.result() for loop in loops)
+
+    def _loop(self, worker, burst):
+        processed = 0
+        while not self.stopping.is_set():
+            self.requeue_stale()
+            job = claim(worker)
+            if job is None:
+                if burst:
+                    break
+                self.stopping.wait(self.poll_interval)
+                continue
+            try:
+                execute(job)
+                processed += 1
+            finally:
+                close_old_connections()
+        return processed
@@ -1,9 +1,33 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import json
+import random
+import threading
+from io import StringIO
+from types import SimpleNamespace
+from urllib.parse import urlencode
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.contrib import admin
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections
+from django.test import TestCase, override_settings
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
-from .models import Team, User, Workout, Activity, Leaderboard
-from datetime import datetime
+from . import (archive, async_mongo, benchmark, caching, columnar, denormalized, exports, instrumentation,
+               leaderboard, live, mongo, ranking, repositories, rollups, search, standings, streaming, sync, tasks,
+               windows)
+from .fieldsets import fetch_fields, requested_fields
+from .admin import ActivityAdmin, UserAdmin
+from .indexes import diff_indexes
+from .models import Team, TeamStanding, User, Workout, Activity, Leaderboard
+from .serializers import ActivitySerializer, LeaderboardSerializer, activity_reader, leaderboard_reader
+from datetime import datetime, timedelta, timezone
 
 
 class TeamModelTest(TestCase):
@@ -132,7 +156,7 @@ class TeamAPITest(APITestCase):
         url = reverse('team-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_get_team_detail(self):
         """Test retrieving a single team."""
@@ -160,7 +184,7 @@ class UserAPITest(APITestCase):
         url = reverse('user-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertGreater(len(response.data), 0)
+        self.assertGreater(len(response.data['results']), 0)
 
     def test_get_user_detail(self):
         """Test retrieving a single user."""
@@ -187,7 +211,7 @@ class WorkoutAPITest(APITestCase):
         url = reverse('workout-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertGreater(len(response.data), 0)
+        self.assertGreater(len(response.data['results']), 0)
 
 
 class ActivityAPITest(APITestCase):
@@ -210,7 +234,35 @@ class ActivityAPITest(APITestCase):
         url = reverse('activity-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertGreater(len(response.data), 0)
+        self.assertGreater(len(response.data['results']), 0)
+
+
+class ActivityPaginationTest(APITestCase):
+    """Test cases for cursor pagination of activity lists."""
+
+    def setUp(self):
+        for day in range(1, 6):
+            Activity.objects.create(
+                user_id='123',
+                workout_id='456',
+                workout_name='Running',
+                duration_minutes=30,
+                calories_burned=300,
+                activity_date=datetime(2024, 1, day, tzinfo=timezone.utc)
+            )
+
+    def test_pages_follow_cursor(self):
+        """Test that following next links walks every activity once, newest first."""
+        url = reverse('activity-by-user') + '?user_id=123&page_size=2'
+        dates = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            dates.extend(row['activity_date'] for row in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(dates, sorted(dates, reverse=True))
+        self.assertEqual(len(dates), 5)
 
 
 class LeaderboardAPITest(APITestCase):
@@ -234,4 +286,1729 @@ class LeaderboardAPITest(APITestCase):
         url = reverse('leaderboard-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertGreater(len(response.data), 0)
+        self.assertGreater(len(response.data['results']), 0)
+
+
+class LeaderboardMaintenanceTest(APITestCase):
+    """Test that Activity writes keep the leaderboard up to date."""
+
+    def setUp(self):
+        self.leader = User.objects.create(
+            name='Diana Prince', alias='Wonder Woman', email='wonderwoman@dc.com',
+            team_id='team_dc', power='Super Strength', fitness_level=95
+        )
+        self.challenger = User.objects.create(
+            name='Barry Allen', alias='Flash', email='flash@dc.com',
+            team_id='team_dc', power='Super Speed', fitness_level=90
+        )
+        self.post_activity(self.leader, calories=500)
+
+    def post_activity(self, user, calories, minutes=30, distance=2.0):
+        response = self.client.post(reverse('activity-list'), {
+            'user_id': str(user.id),
+            'workout_id': '1',
+            'workout_name': 'Endurance Run',
+            'duration_minutes': minutes,
+            'calories_burned': calories,
+            'distance_km': distance,
+            'activity_date': '2024-01-01T10:00:00Z',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def entry(self, user):
+        return Leaderboard.objects.get(user_id=str(user.id))
+
+    def test_create_adds_totals(self):
+        """Test that creating an activity adds to the user's totals."""
+        self.post_activity(self.leader, calories=250, minutes=45, distance=3.5)
+        entry = self.entry(self.leader)
+        self.assertEqual(entry.total_calories, 750)
+        self.assertEqual(entry.total_workouts, 2)
+        self.assertEqual(entry.total_minutes, 75)
+        self.assertAlmostEqual(entry.total_distance_km, 5.5)
+        self.assertEqual(entry.user_alias, 'Wonder Woman')
+        self.assertEqual(entry.rank, 1)
+
+    def test_overtaking_reranks(self):
+        """Test that overtaking another user swaps their ranks."""
+        activity_id = self.post_activity(self.challenger, calories=400)
+        self.assertEqual(self.entry(self.challenger).rank, 2)
+
+        url = reverse('activity-detail', args=[activity_id])
+        response = self.client.patch(url, {'calories_burned': 900}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.entry(self.challenger).rank, 1)
+        self.assertEqual(self.entry(self.leader).rank, 2)
+
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.entry(self.challenger).total_calories, 0)
+        self.assertEqual(self.entry(self.challenger).rank, 2)
+        self.assertEqual(self.entry(self.leader).rank, 1)
+
+    def test_deleted_user_activities_do_not_resurrect_entry(self):
+        """Test that editing or deleting a deleted user's leftover activity leaves the board alone."""
+        activity_id = self.post_activity(self.challenger, calories=200)
+        self.client.delete(reverse('user-detail', args=[self.challenger.id]))
+        url = reverse('activity-detail', args=[activity_id])
+        self.assertEqual(self.client.patch(url, {'calories_burned': 300}, format='json').status_code,
+                         status.HTTP_200_OK)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Leaderboard.objects.filter(user_id=str(self.challenger.id)).exists())
+        self.assertEqual([(entry.user_id, entry.rank) for entry in Leaderboard.objects.all()],
+                         [(str(self.leader.id), 1)])
+
+    def test_write_during_rebuild_is_kept(self):
+        """Test that an activity posted while a rebuild aggregates waits for it and is counted once."""
+        aggregating, resume = threading.Event(), threading.Event()
+        sources = archive.sources
+
+        def paused_sources():
+            aggregating.set()
+            resume.wait(5)
+            return sources()
+
+        with mock.patch.object(archive, 'sources', paused_sources):
+            rebuild = threading.Thread(target=leaderboard.rebuild)
+            rebuild.start()
+            self.assertTrue(aggregating.wait(5))
+            write = threading.Thread(target=self.post_activity, args=(self.leader, 250))
+            write.start()
+            write.join(0.2)
+            self.assertTrue(write.is_alive())
+            resume.set()
+            rebuild.join()
+            write.join()
+        entry = self.entry(self.leader)
+        self.assertEqual((entry.total_calories, entry.total_workouts), (750, 2))
+
+
+class MongoLockTest(TestCase):
+    """Test cases for the cross-process lock guarding rank shifts."""
+
+    def setUp(self):
+        self.addCleanup(mongo.get_db().drop_collection, mongo.LOCKS)
+
+    def test_lock_excludes_other_holders(self):
+        """Test that a second holder waits until the first releases the lock."""
+        acquired = threading.Event()
+
+        def contend():
+            with mongo.lock('test'):
+                acquired.set()
+
+        with mongo.lock('test'):
+            thread = threading.Thread(target=contend)
+            thread.start()
+            self.assertFalse(acquired.wait(0.2))
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+        self.assertEqual(mongo.get_db()[mongo.LOCKS].count_documents({}), 0)
+
+    def test_one_heartbeat_renews_every_held_lock(self):
+        """Test that acquisitions share one heartbeat thread, which extends the leases still held."""
+        with mongo.lock('warmup'):
+            pass
+        threads = threading.active_count()
+        for _ in range(20):
+            with mongo.lock('test'):
+                self.assertEqual(threading.active_count(), threads)
+        with mongo.lock('test'):
+            expires_at = mongo.get_db()[mongo.LOCKS].find_one({'_id': 'test'})['expires_at']
+            with override_settings(OCTOFIT_LOCK_LEASE=60):
+                mongo._renew_leases()
+            self.assertGreater(mongo.get_db()[mongo.LOCKS].find_one({'_id': 'test'})['expires_at'], expires_at)
+
+    def test_exclusive_lock_waits_for_shared_holders(self):
+        """Test that shared holders coexist, and an exclusive holder waits for them and keeps new ones out."""
+        acquired, order = threading.Event(), []
+
+        def hold_exclusive():
+            with mongo.exclusive_lock('test'):
+                acquired.set()
+                threading.Event().wait(0.2)
+                order.append('exclusive')
+
+        with mongo.shared_lock('test'), mongo.shared_lock('test'):
+            thread = threading.Thread(target=hold_exclusive)
+            thread.start()
+            self.assertFalse(acquired.wait(0.2))
+        self.assertTrue(acquired.wait(5))
+        with mongo.shared_lock('test'):
+            order.append('shared')
+        thread.join()
+        self.assertEqual(order, ['exclusive', 'shared'])
+
+    def test_expired_lease_is_taken_over(self):
+        """Test that a lock left behind by a dead process is acquired once its lease ran out."""
+        mongo.get_db()[mongo.LOCKS].insert_one(
+            {'_id': 'test', 'owner': 'dead', 'expires_at': mongo.now() - timedelta(seconds=1)})
+        with mongo.lock('test'):
+            self.assertNotEqual(mongo.get_db()[mongo.LOCKS].find_one({'_id': 'test'})['owner'], 'dead')
+
+
+class BulkActivityIngestTest(APITestCase):
+    """Test cases for NDJSON bulk activity ingestion."""
+
+    def row(self, calories, user_id='7'):
+        return json.dumps({
+            'user_id': user_id,
+            'workout_id': '1',
+            'workout_name': 'Speed Work',
+            'duration_minutes': 20,
+            'calories_burned': calories,
+            'activity_date': '2024-02-01T08:00:00Z',
+        })
+
+    def test_bulk_create_reports_row_errors(self):
+        """Test that valid rows are stored and invalid rows are reported by line."""
+        body = '\n'.join([self.row(100), '{not json', self.row(150), self.row('lots')]) + '\n'
+        response = self.client.post(reverse('activity-bulk'), data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['received'], 4)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['line'] for error in response.data['errors']], [2, 4])
+
+        activities = Activity.objects.filter(user_id='7')
+        self.assertEqual(len(activities), 2)
+        self.assertEqual(len({activity.id for activity in activities}), 2)
+        entry = Leaderboard.objects.get(user_id='7')
+        self.assertEqual(entry.total_calories, 250)
+        self.assertEqual(entry.total_workouts, 2)
+
+    def test_empty_body_is_rejected(self):
+        """Test that a body without rows is a 400, not a successful empty import."""
+        for body in ('', '\n \n'):
+            response = self.client.post(reverse('activity-bulk'), data=body, content_type='application/x-ndjson')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class NativeReadParityTest(APITestCase):
+    """Test that the native pymongo read path matches the ORM path."""
+
+    def setUp(self):
+        for index, calories in enumerate([900, 700, 500], 1):
+            Leaderboard.objects.create(
+                user_id=str(index), user_name=f'User {index}', user_alias=f'Hero {index}',
+                team_id='team_marvel', total_calories=calories, total_workouts=index,
+                total_minutes=30 * index, total_distance_km=1.25 * index, rank=index
+            )
+            Activity.objects.create(
+                user_id=str(index), workout_id='1', workout_name='Power Training',
+                duration_minutes=60, calories_burned=calories, distance_km=0.5 * index,
+                activity_date=datetime(2024, 3, index, 7, 30, tzinfo=timezone.utc), notes=''
+            )
+
+    def assert_parity(self, url, viewset):
+        caches['responses'].clear()
+        with override_settings(OCTOFIT_NATIVE_READS={viewset: False}):
+            orm = self.client.get(url)
+        caches['responses'].clear()
+        with override_settings(OCTOFIT_NATIVE_READS={viewset: True}):
+            native = self.client.get(url)
+        self.assertEqual(orm.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(orm.json()), 2)
+        self.assertEqual(native.content, orm.content)
+
+    def test_top_parity(self):
+        """Test that LeaderboardViewSet.top returns identical JSON on both paths."""
+        self.assert_parity(reverse('leaderboard-top') + '?limit=2', 'LeaderboardViewSet')
+
+    def test_recent_parity(self):
+        """Test that ActivityViewSet.recent returns identical JSON on both paths."""
+        self.assert_parity(reverse('activity-recent') + '?limit=2', 'ActivityViewSet')
+
+
+class ResponseCacheTest(APITestCase):
+    """Test cases for cached leaderboard responses."""
+
+    def setUp(self):
+        caches['responses'].clear()
+        Leaderboard.objects.create(
+            user_id='1', user_name='Tony Stark', user_alias='Iron Man', team_id='team_marvel',
+            total_calories=800, total_workouts=2, total_minutes=90, total_distance_km=0.0, rank=1
+        )
+
+    def test_etag_and_not_modified(self):
+        """Test that a matching If-None-Match gets a 304."""
+        url = reverse('leaderboard-top')
+        response = self.client.get(url)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_activity_write_invalidates(self):
+        """Test that logging an activity refreshes the cached leaderboard."""
+        url = reverse('leaderboard-top')
+        etag = self.client.get(url)['ETag']
+        Leaderboard.objects.filter(user_id='1').update(user_alias='Stale')
+        self.assertEqual(self.client.get(url).json()[0]['user_alias'], 'Iron Man')
+
+        self.client.post(reverse('activity-list'), {
+            'user_id': '1', 'workout_id': '1', 'workout_name': 'Power Training',
+            'duration_minutes': 60, 'calories_burned': 400, 'activity_date': '2024-01-01T10:00:00Z',
+        }, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()[0]['total_calories'], 1200)
+        self.assertEqual(response.json()[0]['user_alias'], 'Stale')
+
+    def test_invalidation_from_another_process(self):
+        """Test that a generation bumped in Mongo by another process drops this process's cached response."""
+        url = reverse('leaderboard-top')
+        etag = self.client.get(url)['ETag']
+        Leaderboard.objects.filter(user_id='1').update(user_alias='Changed')
+        mongo.get_db()[caching.GENERATIONS].update_one({'_id': 'leaderboard'}, {'$set': {'token': 'worker'}})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()[0]['user_alias'], 'Changed')
+
+
+class StatsAPITest(APITestCase):
+    """Test cases for the activity statistics endpoints."""
+
+    def setUp(self):
+        self.user = User.objects.create(
+            name='Clark Kent', alias='Superman', email='superman@dc.com',
+            team_id='team_dc', power='Flight', fitness_level=99
+        )
+        self.activities = []
+        for day, calories in [(1, 120), (2, 250), (9, 330)]:
+            self.activities.append(Activity.objects.create(
+                user_id=str(self.user.id), workout_id='3', workout_name='Endurance Run',
+                duration_minutes=30, calories_burned=calories, distance_km=5.0,
+                activity_date=datetime(2024, 1, day, 6, tzinfo=timezone.utc)
+            ))
+        call_command('rebuild_rollups', stdout=StringIO())
+
+    def test_user_weekly_totals(self):
+        """Test that user totals are bucketed by ISO week."""
+        url = reverse('user-stats', args=[self.user.id])
+        response = self.client.get(url, {'period': 'week'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(b['period'], b['calories'], b['workouts']) for b in response.data['buckets']],
+            [('2024-W01', 370, 2), ('2024-W02', 330, 1)]
+        )
+
+    def test_team_totals_with_range(self):
+        """Test that team totals honour the date range."""
+        url = reverse('team-stats', args=['team_dc'])
+        response = self.client.get(url, {'period': 'month', 'start': '2024-01-02'})
+        self.assertEqual(response.data['buckets'][0]['calories'], 580)
+
+    def test_rollups_follow_writes(self):
+        """Test that activity writes update the rollups incrementally."""
+        response = self.client.post(reverse('activity-list'), {
+            'user_id': str(self.user.id), 'workout_id': '3', 'workout_name': 'Endurance Run',
+            'duration_minutes': 45, 'calories_burned': 410, 'activity_date': '2024-01-09T18:00:00Z',
+        }, format='json')
+        self.client.delete(reverse('activity-detail', args=[response.data['id']]))
+        self.client.patch(reverse('activity-detail', args=[self.activities[-1].id]),
+                          {'calories_burned': 300}, format='json')
+        url = reverse('user-stats', args=[self.user.id])
+        buckets = self.client.get(url, {'period': 'day'}).data['buckets']
+        self.assertEqual(
+            [(b['period'], b['calories'], b['workouts']) for b in buckets],
+            [('2024-01-01', 120, 1), ('2024-01-02', 250, 1), ('2024-01-09', 300, 1)]
+        )
+        distribution = self.client.get(reverse('workout-calorie-distribution')).data[0]
+        self.assertEqual(distribution['histogram'], [
+            {'from': 100, 'count': 1}, {'from': 200, 'count': 1}, {'from': 300, 'count': 1},
+        ])
+
+    def test_team_change_moves_team_rollups(self):
+        """Test that a moved user's totals follow them, so deleting an old activity leaves no residue."""
+        def buckets(team, period):
+            response = self.client.get(reverse('team-stats', args=[team]), {'period': period})
+            return [(bucket['calories'], bucket['workouts']) for bucket in response.data['buckets']]
+
+        self.client.patch(reverse('user-detail', args=[self.user.id]), {'team_id': 'team_marvel'}, format='json')
+        self.assertEqual(buckets('team_dc', 'month'), [])
+        self.assertEqual(buckets('team_marvel', 'week'), [(370, 2), (330, 1)])
+
+        for activity in self.activities:
+            self.client.delete(reverse('activity-detail', args=[activity.id]))
+        self.assertEqual(buckets('team_dc', 'day') + buckets('team_marvel', 'day'), [])
+        self.assertFalse(mongo.get_db()[rollups.DAILY].count_documents(
+            {'scope': 'team', 'workouts': {'$lt': 0}}))
+
+    def test_invalid_period(self):
+        """Test that an unknown period is rejected."""
+        url = reverse('user-stats', args=[self.user.id])
+        response = self.client.get(url, {'period': 'decade'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_impossible_dates(self):
+        """Test that well-formed but impossible dates are a 400 wherever dates are parsed."""
+        for url, params in [
+            (reverse('user-stats', args=[self.user.id]), {'start': '2024-02-30'}),
+            (reverse('team-stats', args=['team_dc']), {'end': '2024-13-01T00:00:00Z'}),
+            (reverse('leaderboard-window'), {'period': 'day', 'date': '2023-02-29'}),
+            (reverse('activity-export'), {'start': '2024-04-31'}),
+        ]:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, url)
+
+    def test_calorie_distribution(self):
+        """Test the per-workout calorie histogram."""
+        response = self.client.get(reverse('workout-calorie-distribution'))
+        entry = response.data[0]
+        self.assertEqual(entry['count'], 3)
+        self.assertEqual(entry['mean'], 233.33)
+        self.assertEqual(entry['histogram'], [
+            {'from': 100, 'count': 1}, {'from': 200, 'count': 1}, {'from': 300, 'count': 1},
+        ])
+
+
+class TeamStandingsTest(APITestCase):
+    """Test cases for the materialized team standings."""
+
+    def setUp(self):
+        caches['responses'].clear()
+        for _id, name in [('team_marvel', 'Team Marvel'), ('team_dc', 'Team DC')]:
+            Team.objects.create(_id=_id, name=name, description=name)
+        self.thor = self.create_user('Thor', 'team_marvel')
+        self.hulk = self.create_user('Hulk', 'team_marvel')
+        self.log(self.thor, 600)
+        self.log(self.hulk, 300)
+
+    def create_user(self, alias, team_id):
+        response = self.client.post(reverse('user-list'), {
+            'name': alias, 'alias': alias, 'email': f'{alias.lower()}@octofit.test',
+            'team_id': team_id, 'power': 'Strength', 'fitness_level': 80,
+        }, format='json')
+        return response.data['id']
+
+    def log(self, user_id, calories):
+        self.client.post(reverse('activity-list'), {
+            'user_id': str(user_id), 'workout_id': '1', 'workout_name': 'Combat Training',
+            'duration_minutes': 75, 'calories_burned': calories, 'activity_date': '2024-01-01T10:00:00Z',
+        }, format='json')
+
+    def standings(self):
+        return {row['team_id']: row for row in self.client.get(reverse('team-standings')).json()}
+
+    def test_totals_follow_activities(self):
+        """Test that team totals and active members follow activity writes."""
+        marvel = self.standings()['team_marvel']
+        self.assertEqual(marvel['rank'], 1)
+        self.assertEqual(marvel['name'], 'Team Marvel')
+        self.assertEqual(marvel['total_calories'], 900)
+        self.assertEqual(marvel['member_count'], 2)
+        self.assertEqual(marvel['active_members'], 2)
+        self.assertEqual(Team.objects.get(_id='team_marvel').member_count, 2)
+
+    def test_team_change_moves_totals(self):
+        """Test that changing a user's team moves their totals and membership."""
+        self.client.patch(reverse('user-detail', args=[self.hulk]), {'team_id': 'team_dc'}, format='json')
+        standings = self.standings()
+        self.assertEqual(standings['team_marvel']['total_calories'], 600)
+        self.assertEqual(standings['team_marvel']['member_count'], 1)
+        self.assertEqual(standings['team_dc']['total_calories'], 300)
+        self.assertEqual(standings['team_dc']['active_members'], 1)
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.hulk)).team_id, 'team_dc')
+
+    def test_user_delete_removes_member(self):
+        """Test that deleting a user removes them from the standings and leaderboard."""
+        self.client.delete(reverse('user-detail', args=[self.thor]))
+        marvel = self.standings()['team_marvel']
+        self.assertEqual(marvel['total_calories'], 300)
+        self.assertEqual(marvel['member_count'], 1)
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.hulk)).rank, 1)
+
+    def test_rebuild_matches_incremental(self):
+        """Test that a rebuild reproduces the incrementally maintained standings."""
+        before = self.standings()
+        call_command('rebuild_standings', stdout=StringIO())
+        caches['responses'].clear()
+        after = self.standings()
+        for row in list(before.values()) + list(after.values()):
+            row.pop('last_updated')
+        self.assertEqual(after, before)
+
+
+class SyncIndexesCommandTest(TestCase):
+    """Test cases for the sync_indexes management command."""
+
+    def test_creates_declared_indexes(self):
+        """Test that every declared index exists after syncing."""
+        call_command('sync_indexes', stdout=StringIO())
+        missing, _ = diff_indexes(mongo.get_db())
+        self.assertEqual(missing, [])
+
+        out = StringIO()
+        call_command('sync_indexes', stdout=out)
+        self.assertIn('All declared indexes exist.', out.getvalue())
+
+
+class PopulateDbCommandTest(TestCase):
+    """Test cases for the populate_db management command."""
+
+    def test_generates_consistent_data(self):
+        """Test that generated data is readable through the ORM and ranked, replacing any archive."""
+        self.addCleanup(mongo.get_db().drop_collection, archive.STATE)
+        self.addCleanup(mongo.get_db().drop_collection, archive.ARCHIVE)
+        mongo.get_db()[archive.ARCHIVE].insert_one({'id': 10 ** 6, 'user_id': '1', 'calories_burned': 999})
+        mongo.get_db()[archive.STATE].insert_one({'_id': 'watermark', 'before': mongo.now()})
+        call_command('populate_db', users=12, teams=3, activities_per_user=4, seed=7,
+                     batch_size=5, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 12)
+        self.assertEqual(Activity.objects.count(), 48)
+        entries = list(Leaderboard.objects.all())
+        self.assertEqual([entry.rank for entry in entries], list(range(1, 13)))
+        calories = [entry.total_calories for entry in entries]
+        self.assertEqual(calories, sorted(calories, reverse=True))
+        self.assertEqual(sum(Team.objects.get(_id=team_id).member_count
+                             for team_id in ['team_marvel', 'team_dc', 'team_3']), 12)
+        self.assertEqual(mongo.get_db()[archive.ARCHIVE].count_documents({}), 0)
+        self.assertEqual(mongo.get_db()[archive.STATE].count_documents({}), 0)
+
+
+class BenchmarkTest(TestCase):
+    """Test cases for the benchmark helpers."""
+
+    def test_summarize_percentiles(self):
+        """Test that percentiles use the nearest rank in milliseconds."""
+        summary = benchmark.summarize([i / 1000 for i in range(1, 101)])
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(summary['p50_ms'], 50)
+        self.assertEqual(summary['p95_ms'], 95)
+        self.assertEqual(summary['p99_ms'], 99)
+
+    def test_compare_reports_regressions(self):
+        """Test that only entries slower than the threshold are reported."""
+        baseline = {'routes': {'GET /a/': {'p95_ms': 10}, 'GET /b/': {'p95_ms': 10}}}
+        current = {'routes': {'GET /a/': {'p95_ms': 15}, 'GET /b/': {'p95_ms': 11}, 'GET /c/': {'p95_ms': 1}}}
+        regressions = benchmark.compare(baseline, current, threshold=0.2)
+        self.assertEqual([row['label'] for row in regressions], ['GET /a/'])
+
+    def test_every_get_route_is_measured(self):
+        """Test that every routed GET endpoint is timed and answers successfully."""
+        caches['responses'].clear()
+        call_command('populate_db', users=4, teams=2, activities_per_user=2, seed=1, stdout=StringIO())
+        results, skipped = benchmark.bench_routes(iterations=1, warmup=0)
+        cases, _ = benchmark.route_cases(benchmark.fixtures())
+        for label, _, _ in cases:
+            self.assertIn(label, results)
+        self.assertIn('POST /api/activities/', results)
+        self.assertNotIn('POST /api/activities/', skipped)
+        self.assertEqual(Activity.objects.count(), 8)
+
+    def test_concurrency_compares_wsgi_and_asgi(self):
+        """Test that every async endpoint is driven through both handlers."""
+        caches['responses'].clear()
+        call_command('populate_db', users=4, teams=2, activities_per_user=2, seed=1, stdout=StringIO())
+        results = benchmark.bench_concurrency(requests=4, concurrency=2)
+        for label, _ in benchmark.async_cases(benchmark.fixtures()):
+            self.assertEqual(results[f'WSGI GET {label}']['count'], 4)
+            self.assertEqual(results[f'ASGI GET {label}']['count'], 4)
+
+
+class RequestMetricsTest(APITestCase):
+    """Test cases for the request instrumentation middleware."""
+
+    def setUp(self):
+        instrumentation.registry.reset()
+        Team.objects.create(_id='team_marvel', name='Team Marvel', description='Marvel')
+
+    def test_server_timing_header(self):
+        """Test that API responses report their phase timings."""
+        response = self.client.get(reverse('team-list'))
+        timing = response['Server-Timing']
+        for name in ('db;dur=', 'orm;dur=', 'serialize;dur=', 'render;dur=', 'total;dur='):
+            self.assertIn(name, timing)
+
+    def test_metrics_endpoint(self):
+        """Test that served requests show up in the Prometheus metrics."""
+        self.client.get(reverse('team-list'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn('octofit_requests_total{view="team-list",method="GET",status="200"} 1', body)
+        self.assertIn('octofit_request_duration_seconds_count{view="team-list"} 1', body)
+        self.assertIn('octofit_request_response_bytes_total{view="team-list"}', body)
+
+    def test_command_listener_counts_queries(self):
+        """Test that Mongo commands are attributed to the current request."""
+        listener = instrumentation.CommandTimer()
+        token = instrumentation.start()
+        try:
+            for _ in range(3):
+                event = SimpleNamespace(command_name='find', command={'find': 'users'}, database_name='octofit_db',
+                                        duration_micros=2000)
+                listener.started(event)
+                listener.succeeded(event)
+            metrics = instrumentation.current()
+            self.assertEqual(metrics.queries, 3)
+            self.assertAlmostEqual(metrics.db, 0.006)
+            self.assertEqual(metrics.repeated_queries(), (('find', 'users'), 3))
+            with override_settings(OCTOFIT_N_PLUS_ONE_THRESHOLD=2), self.assertLogs('octofit_tracker.instrumentation'):
+                self.assertTrue(instrumentation.check_n_plus_one(metrics, 'user-list'))
+            with override_settings(OCTOFIT_N_PLUS_ONE_THRESHOLD=3):
+                self.assertFalse(instrumentation.check_n_plus_one(metrics, 'user-list'))
+        finally:
+            instrumentation.stop(token)
+
+
+class FastReadSerializerTest(APITestCase):
+    """Test cases for the fast read-only list serializers."""
+
+    def setUp(self):
+        caches['responses'].clear()
+        Team.objects.create(_id='team_marvel', name='Team Marvel', description='Marvel')
+        self.user = User.objects.create(name='Thor Odinson', alias='Thor', email='thor@asgard.com',
+                                        team_id='team_marvel', power='Thunder', fitness_level=90)
+        for index, (distance, notes) in enumerate([(0.0, None), (12.5, 'Long run'), (3.333, '')]):
+            self.client.post(reverse('activity-list'), {
+                'user_id': str(self.user.id), 'workout_id': '1', 'workout_name': 'Endurance Run',
+                'duration_minutes': 30 + index, 'calories_burned': 300 + index, 'distance_km': distance,
+                'activity_date': f'2024-01-0{index + 1}T10:00:00.{index * 250000:06d}Z', 'notes': notes,
+            }, format='json')
+
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def test_matches_model_serializers(self):
+        """Test that instances, .values() rows and Mongo documents render byte-identical JSON."""
+        for model, serializer_class, reader in [
+            (Activity, ActivitySerializer, activity_reader),
+            (Leaderboard, LeaderboardSerializer, leaderboard_reader),
+        ]:
+            instances = list(model.objects.all())
+            self.assertTrue(instances)
+            expected = self.render(serializer_class(instances, many=True).data)
+            self.assertEqual(self.render(reader.many(instances)), expected)
+            self.assertEqual(self.render(reader.many(model.objects.values(*reader.fields))), expected)
+            documents = mongo.collection(model).find({}, repositories.projection(serializer_class))
+            by_id = {document['id']: document for document in documents}
+            self.assertEqual(self.render(reader.many([by_id[instance.id] for instance in instances])), expected)
+
+    def test_list_endpoints_match_model_serializers(self):
+        """Test that list, recent, top and by_user responses are unchanged."""
+        activities = ActivitySerializer(Activity.objects.order_by('-activity_date', '-id'), many=True).data
+        leaderboard = LeaderboardSerializer(Leaderboard.objects.order_by('rank', 'id'), many=True).data
+        cases = [
+            (reverse('activity-list'), activities, True),
+            (reverse('activity-by-user') + f'?user_id={self.user.id}', activities, True),
+            (reverse('activity-recent'), activities, False),
+            (reverse('leaderboard-list'), leaderboard, True),
+            (reverse('leaderboard-top'), leaderboard, False),
+        ]
+        for url, expected, paginated in cases:
+            data = json.loads(self.client.get(url).content)
+            self.assertEqual(json.dumps(data['results'] if paginated else data), json.dumps(expected), url)
+
+
+class SparseFieldsetTest(APITestCase):
+    """Test cases for ?fields= sparse fieldsets."""
+
+    def setUp(self):
+        caches['responses'].clear()
+        Team.objects.create(_id='team_marvel', name='Team Marvel', description='Marvel')
+        for alias in ['Thor', 'Hulk', 'Vision']:
+            user = User.objects.create(name=alias, alias=alias, email=f'{alias.lower()}@marvel.com',
+                                       team_id='team_marvel', power='Strength', fitness_level=80)
+            self.client.post(reverse('activity-list'), {
+                'user_id': str(user.id), 'workout_id': '1', 'workout_name': 'Power Training',
+                'duration_minutes': 60, 'calories_burned': 100 * len(alias), 'notes': 'long notes',
+                'activity_date': '2024-01-01T10:00:00Z',
+            }, format='json')
+
+    def test_leaderboard_fields_with_pagination(self):
+        """Test that trimmed leaderboard pages still paginate by rank."""
+        url = reverse('leaderboard-list') + '?fields=rank,user_alias,total_calories&page_size=1'
+        aliases = []
+        while url:
+            data = self.client.get(url).data
+            for row in data['results']:
+                self.assertEqual(set(row), {'rank', 'user_alias', 'total_calories'})
+                aliases.append(row['user_alias'])
+            url = data['next']
+        self.assertEqual(aliases, ['Vision', 'Thor', 'Hulk'])
+
+    def test_fields_on_native_and_orm_paths(self):
+        """Test that top, recent and model-serializer endpoints honour ?fields=."""
+        for native in (True, False):
+            caches['responses'].clear()
+            reads = {'ActivityViewSet': native, 'LeaderboardViewSet': native}
+            with override_settings(OCTOFIT_NATIVE_READS=reads):
+                top = self.client.get(reverse('leaderboard-top') + '?fields=user_alias,rank').data
+                recent = self.client.get(reverse('activity-recent') + '?fields=calories_burned').data
+            self.assertEqual([list(row) for row in top], [['user_alias', 'rank']] * 3)
+            self.assertEqual(sorted(row['calories_burned'] for row in recent), [400, 400, 600])
+            self.assertEqual({tuple(row) for row in recent}, {('calories_burned',)})
+
+        users = self.client.get(reverse('user-list') + '?fields=alias').data['results']
+        self.assertEqual([row for row in users], [{'alias': 'Thor'}, {'alias': 'Hulk'}, {'alias': 'Vision'}])
+        members = self.client.get(reverse('team-members', args=['team_marvel']) + '?fields=alias,team_id').data
+        self.assertEqual(members[0], {'alias': 'Thor', 'team_id': 'team_marvel'})
+        team = self.client.get(reverse('team-detail', args=['team_marvel']) + '?fields=name').data
+        self.assertEqual(team, {'name': 'Team Marvel'})
+
+    def test_fields_do_not_narrow_writes(self):
+        """Test that ?fields= on a POST still validates and saves the whole body."""
+        thor = User.objects.get(alias='Thor')
+        response = self.client.post(reverse('activity-list') + '?fields=id', {
+            'user_id': str(thor.id), 'workout_id': '1', 'workout_name': 'Power Training',
+            'duration_minutes': 30, 'calories_burned': 250, 'activity_date': '2024-01-02T10:00:00Z',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Activity.objects.get(id=response.data['id']).calories_burned, 250)
+        self.assertEqual(Leaderboard.objects.get(user_id=str(thor.id)).total_calories, 650)
+
+    def test_unknown_field_is_rejected(self):
+        """Test that unknown fields return a 400 listing the available ones."""
+        response = self.client.get(reverse('leaderboard-list') + '?fields=rank,password')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('password', response.data['fields'][0])
+
+    def test_projection_is_pushed_down(self):
+        """Test that the Mongo projection only selects the requested fields."""
+        self.assertEqual(repositories.projection(LeaderboardSerializer, ['rank', 'user_alias']),
+                         {'rank': 1, 'user_alias': 1, '_id': 0})
+        request = SimpleNamespace(query_params={'fields': 'notes, id'})
+        self.assertEqual(requested_fields(request, ActivitySerializer), ['id', 'notes'])
+        self.assertEqual(fetch_fields(['notes'], ('-activity_date', '-id')), ['notes', 'activity_date', 'id'])
+
+
+class DenormalizedCopiesTest(APITestCase):
+    """Test cases for propagating and verifying copied user and workout fields."""
+
+    def setUp(self):
+        caches['responses'].clear()
+        Team.objects.create(_id='team_marvel', name='Team Marvel', description='Marvel')
+        self.user = User.objects.create(name='Bruce Banner', alias='Hulk', email='hulk@marvel.com',
+                                        team_id='team_marvel', power='Strength', fitness_level=90)
+        self.workout = Workout.objects.create(name='Power Training', description='Lifting', difficulty='Hard',
+                                              duration_minutes=60, calories_per_session=500)
+        self.client.post(reverse('activity-list'), {
+            'user_id': str(self.user.id), 'workout_id': str(self.workout.id), 'workout_name': 'Power Training',
+            'duration_minutes': 60, 'calories_burned': 500, 'activity_date': '2024-01-01T10:00:00Z',
+        }, format='json')
+        call_command('rebuild_rollups', stdout=StringIO())
+
+    def workout_names(self):
+        db = mongo.get_db()
+        names = {document['workout_name'] for document in db.activities.find()}
+        for name in (rollups.DAILY, rollups.WEEKLY):
+            names |= {document['workout_name'] for document in db[name].find({'scope': 'workout'})}
+        return names
+
+    @override_settings(OCTOFIT_TASKS_EAGER=True)
+    def test_renames_propagate(self):
+        """Test that renaming a user or workout rewrites every copy."""
+        self.client.patch(reverse('user-detail', args=[self.user.id]), {'alias': 'The Hulk'}, format='json')
+        entry = Leaderboard.objects.get(user_id=str(self.user.id))
+        self.assertEqual(entry.user_alias, 'The Hulk')
+
+        self.client.patch(reverse('workout-detail', args=[self.workout.id]), {'name': 'Smash'}, format='json')
+        self.assertEqual(self.workout_names(), {'Smash'})
+
+    def test_renames_propagate_in_background(self):
+        """Test that propagation is queued as a job and applied by a worker."""
+        self.client.patch(reverse('workout-detail', args=[self.workout.id]), {'name': 'Smash'}, format='json')
+        self.assertEqual(self.workout_names(), {'Power Training'})
+        self.assertEqual(tasks.Worker().run(burst=True), 1)
+        self.assertEqual(self.workout_names(), {'Smash'})
+
+    def test_verify_reports_and_repairs_drift(self):
+        """Test that verify_denormalized finds drifted copies and --repair fixes them."""
+        db = mongo.get_db()
+        db.activities.update_many({}, {'$set': {'workout_name': 'Stale'}})
+        db.leaderboard.update_many({}, {'$set': {'user_name': 'Stale', 'team_id': 'team_dc'}})
+        reports = {report['collection']: report for report in denormalized.verify()}
+        self.assertEqual(reports['activities']['drifted'], 1)
+        self.assertEqual(reports['leaderboard']['drifted_keys'], 1)
+        self.assertEqual(reports[rollups.DAILY]['drifted'], 0)
+
+        out = StringIO()
+        call_command('verify_denormalized', repair=True, stdout=out)
+        self.assertIn('repaired 1 documents', out.getvalue())
+        self.assertFalse(any(report['drifted'] for report in denormalized.verify()))
+        entry = Leaderboard.objects.get(user_id=str(self.user.id))
+        self.assertEqual((entry.user_name, entry.team_id), ('Bruce Banner', 'team_marvel'))
+        self.assertEqual(TeamStanding.objects.get(team_id='team_marvel').total_calories, 500)
+
+
+
+calls = []
+
+
+@tasks.task
+def flaky(fail_times):
+    """Fail the first ``fail_times`` calls, then succeed."""
+    calls.append(fail_times)
+    if len(calls) <= fail_times:
+        raise RuntimeError('flaky failure')
+    return len(calls)
+
+
+class JobQueueTest(APITestCase):
+    """Test cases for the Mongo-backed background job queue."""
+
+    def setUp(self):
+        calls.clear()
+        Team.objects.create(_id='team_marvel', name='Team Marvel', description='Marvel')
+        user = User.objects.create(name='Thor', alias='Thor', email='thor@asgard.com', team_id='team_marvel',
+                                   power='Thunder', fitness_level=90)
+        Activity.objects.create(user_id=str(user.id), workout_id='1', workout_name='Power Training',
+                                duration_minutes=60, calories_burned=700,
+                                activity_date=datetime(2024, 1, 1, tzinfo=timezone.utc))
+
+    def test_duplicate_requests_coalesce(self):
+        """Test that rebuild requests coalesce while queued and report status once run."""
+        first = self.client.post(reverse('leaderboard-rebuild'))
+        second = self.client.post(reverse('leaderboard-rebuild'))
+        self.assertEqual(first.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(first.data['id'], second.data['id'])
+        self.assertEqual(first.data['status'], tasks.QUEUED)
+        self.assertTrue(first['Location'].endswith(reverse('job-detail', args=[first.data['id']])))
+
+        out = StringIO()
+        call_command('run_worker', burst=True, threads=2, stdout=out)
+        self.assertIn('Worker stopped after 1 jobs.', out.getvalue())
+        job = self.client.get(reverse('job-detail', args=[first.data['id']])).data
+        self.assertEqual(job['status'], tasks.SUCCEEDED)
+        self.assertEqual(job['result'], {'entries': 1, 'teams': 1})
+        self.assertEqual(Leaderboard.objects.get().total_calories, 700)
+
+        third = self.client.post(reverse('leaderboard-rebuild'))
+        self.assertNotEqual(third.data['id'], first.data['id'])
+        queued = self.client.get(reverse('job-list') + '?status=queued').data['results']
+        self.assertEqual([job['id'] for job in queued], [third.data['id']])
+
+    def test_failed_jobs_retry_with_backoff(self):
+        """Test that failures are retried after a growing delay and then marked failed."""
+        with override_settings(OCTOFIT_JOB_RETRY_DELAY=0, OCTOFIT_JOB_MAX_ATTEMPTS=3), \
+                self.assertLogs('octofit_tracker.tasks', 'ERROR'):
+            job = tasks.enqueue(flaky.task_name, 1)
+            tasks.Worker().run(burst=True)
+            self.assertEqual(tasks.get(job['id'])['status'], tasks.SUCCEEDED)
+            self.assertEqual(tasks.get(job['id'])['attempts'], 2)
+
+            calls.clear()
+            job = tasks.enqueue(flaky.task_name, 5)
+            tasks.Worker().run(burst=True)
+            job = tasks.get(job['id'])
+            self.assertEqual((job['status'], job['attempts']), (tasks.FAILED, 3))
+            self.assertIn('flaky failure', job['last_error'])
+        self.assertEqual(tasks.backoff(1).total_seconds(), 5)
+        self.assertEqual(tasks.backoff(3).total_seconds(), 20)
+
+    def test_only_maintenance_tasks_can_be_queued(self):
+        """Test that POST /api/jobs/ only accepts maintenance task names."""
+        response = self.client.post(reverse('job-list'), {'name': flaky.task_name}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('job-list'), {'name': 'maintenance.rebuild_rollups'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['name'], 'maintenance.rebuild_rollups')
+        for body in (['maintenance.rebuild_rollups'], 'maintenance.rebuild_rollups', 7):
+            response = self.client.post(reverse('job-list'), body, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_running_worker_requeues_stale_jobs(self):
+        """Test that a running worker periodically queues again jobs whose worker died."""
+        job = tasks.enqueue(flaky.task_name, 0)
+        tasks._jobs().update_one({'id': job['id']}, {'$set': {'run_after': mongo.now() + timedelta(days=1)}})
+        worker = tasks.Worker(poll_interval=0.01)
+        with override_settings(OCTOFIT_JOB_REQUEUE_INTERVAL=0):
+            thread = threading.Thread(target=worker.run)
+            thread.start()
+            try:
+                while not worker._next_requeue:
+                    worker.stopping.wait(0.01)
+                # The job's worker died after claiming it, two hours ago.
+                tasks._jobs().update_one({'id': job['id']}, {
+                    '$set': {'status': tasks.RUNNING, 'started_at': mongo.now() - timedelta(hours=2), 'attempts': 1},
+                    '$unset': {'dedupe_key': ''},
+                })
+                for _ in range(500):
+                    if tasks.get(job['id'])['status'] == tasks.SUCCEEDED:
+                        break
+                    worker.stopping.wait(0.01)
+            finally:
+                worker.stop()
+                thread.join()
+        self.assertEqual((tasks.get(job['id'])['status'], tasks.get(job['id'])['attempts']), (tasks.SUCCEEDED, 2))
+
+
+class AsyncReadEndpointTest(APITestCase):
+    """Test cases for the async read endpoints served over ASGI."""
+
+    def setUp(self):
+        caches['responses'].clear()
+        Team.objects.create(_id='team_marvel', name='Team Marvel', description='Marvel')
+        for index, alias in enumerate(['Thor', 'Hulk', 'Vision']):
+            user = User.objects.create(name=alias, alias=alias, email=f'{alias.lower()}@marvel.com',
+                                       team_id='team_marvel', power='Strength', fitness_level=80)
+            self.client.post(reverse('activity-list'), {
+                'user_id': str(user.id), 'workout_id': '1', 'workout_name': 'Power Training',
+                'duration_minutes': 60, 'calories_burned': 100 * len(alias), 'distance_km': 2.5,
+                'activity_date': f'2024-01-0{index + 1}T10:00:00.500000Z',
+            }, format='json')
+
+    async def test_matches_sync_endpoints(self):
+        """Test that ASGI requests reach the async views and return the same bodies as the DRF actions."""
+        urls = [
+            reverse('leaderboard-top') + '?limit=2',
+            reverse('activity-recent') + '?fields=id,calories_burned,activity_date',
+            reverse('team-members', args=['team_marvel']) + '?fields=alias,joined_at',
+            reverse('team-members', args=['team_marvel']),
+        ]
+        for url in urls:
+            expected = await sync_to_async(self.client.get)(url)
+            caches['responses'].clear()
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+            self.assertTrue(response.resolver_match.url_name.startswith('async-'), url)
+            self.assertEqual(response.content, expected.content, url)
+
+    async def test_cache_and_errors(self):
+        """Test ETags, unknown teams, unknown fields and write methods on the async views."""
+        url = reverse('leaderboard-top')
+        response = await self.async_client.get(url)
+        cached = await self.async_client.get(url, **{'if-none-match': response['ETag']})
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        missing = await self.async_client.get(reverse('team-members', args=['team_dc']))
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+        invalid = await self.async_client.get(reverse('activity-recent') + '?fields=bogus')
+        self.assertEqual(invalid.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('fields', json.loads(invalid.content))
+        post = await self.async_client.post(url)
+        self.assertEqual(post.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    async def test_motor_queries_are_measured(self):
+        """Test that queries Motor runs on its executor threads still reach the request metrics."""
+        class MotorCursor:
+            # Like Motor, run pymongo on an executor thread that does not carry the request context.
+            def __init__(self, cursor):
+                self.cursor = cursor
+
+            def sort(self, sort):
+                return MotorCursor(self.cursor.sort(sort))
+
+            def limit(self, limit):
+                return MotorCursor(self.cursor.limit(limit))
+
+            async def to_list(self, length):
+                return await asyncio.get_running_loop().run_in_executor(None, list, self.cursor)
+
+        class MotorCollection:
+            def __init__(self, model):
+                self.collection = mongo.collection(model)
+
+            def find(self, query, projection=None):
+                return MotorCursor(self.collection.find(query, projection))
+
+        with mock.patch.object(async_mongo, 'AsyncIOMotorClient', object), \
+                mock.patch.object(async_mongo, '_motor_collection', MotorCollection):
+            response = await self.async_client.get(reverse('activity-recent'))
+        self.assertEqual(len(json.loads(response.content)), 3)
+        self.assertIn('desc="1 Mongo commands"', response['Server-Timing'])
+
+
+async def asgi_request(path, receive, send, query_string=b'', method='GET', headers=()):
+    """Serve a request with ``StreamingASGIHandler``, keeping the database connection open like the test client."""
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string,
+             'headers': [(b'host', b'testserver'), *headers]}
+    request_started.disconnect(close_old_connections)
+    request_finished.disconnect(close_old_connections)
+    try:
+        await streaming.StreamingASGIHandler()(scope, receive, send)
+    finally:
+        request_started.connect(close_old_connections)
+        request_finished.connect(close_old_connections)
+
+
+class LiveUpdatesTest(APITestCase):
+    """Test cases for the Server-Sent Events stream at /api/live/."""
+
+    def setUp(self):
+        Team.objects.create(_id='team_marvel', name='Team Marvel', description='Marvel')
+        self.users = [
+            User.objects.create(name=alias, alias=alias, email=f'{alias.lower()}@marvel.com',
+                                team_id='team_marvel', power='Strength', fitness_level=80)
+            for alias in ['Thor', 'Hulk']
+        ]
+
+    def post_activity(self, user, calories):
+        return self.client.post(reverse('activity-list'), {
+            'user_id': str(user.id), 'workout_id': '1', 'workout_name': 'Power Training',
+            'duration_minutes': 30, 'calories_burned': calories, 'activity_date': '2024-01-01T10:00:00Z',
+        }, format='json')
+
+    def events(self, message):
+        body = message['body'].decode()
+        return [(block.split('\n')[0][len('event: '):], json.loads(block.split('\n')[1][len('data: '):]))
+                for block in body.split('\n\n') if block.startswith('event:')]
+
+    @override_settings(OCTOFIT_LIVE_TICK=3600)
+    async def test_writes_are_coalesced_per_tick(self):
+        """Test that a snapshot is sent first and a burst of writes arrives as one update."""
+        await sync_to_async(self.post_activity)(self.users[0], 100)
+        sent, inbox = asyncio.Queue(), asyncio.Queue()
+        await inbox.put({'type': 'http.request', 'body': b''})
+        stream = asyncio.ensure_future(asgi_request('/api/live/', inbox.get, sent.put,
+                                                    headers=[(b'origin', b'http://localhost:3000')]))
+
+        start = await sent.get()
+        self.assertEqual(start['status'], 200)
+        headers = {name.lower(): value for name, value in start['headers']}
+        self.assertEqual(headers[b'content-type'], b'text/event-stream')
+        # Served through Django's middleware: CORS and request metrics apply.
+        self.assertEqual(headers[b'access-control-allow-origin'], b'http://localhost:3000')
+        self.assertIn(b'server-timing', headers)
+        [(name, snapshot)] = self.events(await sent.get())
+        self.assertEqual(name, 'snapshot')
+        self.assertEqual([entry['user_alias'] for entry in snapshot['leaderboard']], ['Thor'])
+        self.assertEqual(len(snapshot['activities']), 1)
+
+        for calories in (200, 300, 400):
+            await sync_to_async(self.post_activity)(self.users[1], calories)
+        await live.hub.tick()
+        [(name, update)] = self.events(await asyncio.wait_for(sent.get(), 5))
+        self.assertEqual(name, 'update')
+        self.assertEqual([activity['calories_burned'] for activity in update['activities']], [200, 300, 400])
+        changed = {entry['user_alias']: entry for entry in update['leaderboard']['changed']}
+        self.assertEqual(changed['Hulk']['rank'], 1)
+        self.assertEqual(changed['Hulk']['total_calories'], 900)
+        self.assertEqual(changed['Thor']['rank'], 2)
+
+        await live.hub.tick()
+        await asyncio.sleep(0.05)
+        self.assertTrue(sent.empty())
+        await inbox.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(stream, 5)
+        self.assertFalse(live.hub._subscribers)
+
+    @override_settings(OCTOFIT_LIVE_TICK=3600)
+    async def test_writes_from_other_processes_are_seen(self):
+        """Test that leaderboard writes that bypass this process's hub still reach subscribers."""
+        await sync_to_async(self.post_activity)(self.users[0], 100)
+        subscriber = live.hub.subscribe({'leaderboard'})
+        try:
+            await live.hub.loaded()
+            # What a run_worker job or a WSGI worker does: no events reach this hub.
+            await sync_to_async(mongo.collection(Leaderboard).update_one)(
+                {'user_id': str(self.users[0].id)}, {'$inc': {'total_calories': 50}, '$set': sync.stamp()})
+            await live.hub.tick()
+            [entry] = subscriber.take()['leaderboard']['changed']
+            self.assertEqual((entry['user_alias'], entry['total_calories']), ('Thor', 150))
+            await live.hub.tick()
+            self.assertEqual(subscriber.take(), {})
+        finally:
+            live.hub.unsubscribe(subscriber)
+
+    def test_lagging_subscriber_merges_updates(self):
+        """Test that updates not yet sent are merged instead of queued."""
+        subscriber = live.Subscriber({'leaderboard'})
+        entry = {'id': 1, 'user_id': '1', 'rank': 2}
+        subscriber.offer({'leaderboard': {'changed': [entry], 'dropped': ['2'], 'deleted': []},
+                          'activities': [{'id': 1}]})
+        subscriber.offer({'leaderboard': {'changed': [{**entry, 'rank': 1}, {'id': 3, 'user_id': '3', 'rank': 2}],
+                                          'dropped': [], 'deleted': [3]}})
+        self.assertEqual(subscriber.take(), {
+            'leaderboard': {'changed': [{**entry, 'rank': 1}], 'dropped': ['2'], 'deleted': [3]}})
+        self.assertEqual(subscriber.take(), {})
+
+    @override_settings(OCTOFIT_LIVE_TICK=3600, OCTOFIT_LIVE_LEADERBOARD_SIZE=1)
+    async def test_deletions_are_told_apart_from_dropping_out(self):
+        """Test that a user pushed out of the top entries is dropped, and a deleted user is deleted."""
+        await sync_to_async(self.post_activity)(self.users[0], 100)
+        subscriber = live.hub.subscribe({'leaderboard'})
+        try:
+            await live.hub.loaded()
+            await sync_to_async(self.post_activity)(self.users[1], 200)
+            await live.hub.tick()
+            changes = subscriber.take()['leaderboard']
+            self.assertEqual([entry['user_alias'] for entry in changes['changed']], ['Hulk'])
+            self.assertEqual((changes['dropped'], changes['deleted']), ([str(self.users[0].id)], []))
+
+            entry_id = (await sync_to_async(Leaderboard.objects.get)(user_id=str(self.users[1].id))).id
+            await sync_to_async(self.client.delete)(reverse('user-detail', args=[self.users[1].id]))
+            await live.hub.tick()
+            changes = subscriber.take()['leaderboard']
+            self.assertEqual([entry['user_alias'] for entry in changes['changed']], ['Thor'])
+            self.assertEqual((changes['dropped'], changes['deleted']), ([], [entry_id]))
+        finally:
+            live.hub.unsubscribe(subscriber)
+
+    async def test_rejects_unknown_channels(self):
+        """Test that unknown channels are refused and a HEAD request gets the headers only."""
+        sent, inbox = [], asyncio.Queue()
+
+        async def send(message):
+            sent.append(message)
+
+        await inbox.put({'type': 'http.request', 'body': b''})
+        await asgi_request('/api/live/', inbox.get, send, b'channels=bogus')
+        self.assertEqual(sent[0]['status'], 400)
+        self.assertEqual(json.loads(b''.join(message.get('body', b'') for message in sent[1:])),
+                         {'channels': ['Unknown channel: bogus.']})
+
+        sent.clear()
+        await inbox.put({'type': 'http.request', 'body': b''})
+        await asgi_request('/api/live/', inbox.get, send, b'channels=leaderboard', method='HEAD')
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'Content-Type', b'text/event-stream'), sent[0]['headers'])
+        self.assertFalse(live.hub._subscribers)
+
+
+class RankQueryTest(APITestCase):
+    """Test cases for rank and neighbourhood lookups."""
+
+    def setUp(self):
+        caches['responses'].clear()
+        ranking.index.invalidate()
+        Team.objects.create(_id='team_marvel', name='Team Marvel', description='Marvel')
+        self.users = {}
+        for alias, calories, minutes in [('Thor', 500, 10), ('Hulk', 400, 90), ('Vision', 300, 50),
+                                         ('Wanda', 200, 70), ('Loki', 100, 30)]:
+            user = User.objects.create(name=alias, alias=alias, email=f'{alias.lower()}@marvel.com',
+                                       team_id='team_marvel', power='Magic', fitness_level=80)
+            self.users[alias] = user
+            self.post_activity(user, calories, minutes)
+
+    def post_activity(self, user, calories, minutes):
+        return self.client.post(reverse('activity-list'), {
+            'user_id': str(user.id), 'workout_id': '1', 'workout_name': 'Training',
+            'duration_minutes': minutes, 'calories_burned': calories, 'activity_date': '2024-01-01T10:00:00Z',
+        }, format='json')
+
+    def rank(self, alias, **params):
+        response = self.client.get(reverse('leaderboard-rank'), {'user_id': self.users[alias].id, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_rank_and_neighbours(self):
+        """Test that the rank and neighbours follow the requested metric."""
+        data = self.rank('Vision', neighbours=1)
+        self.assertEqual((data['rank'], data['count'], data['metric']), (3, 5, 'total_calories'))
+        self.assertEqual([(entry['user_alias'], entry['rank']) for entry in data['results']],
+                         [('Hulk', 2), ('Vision', 3), ('Wanda', 4)])
+
+        data = self.rank('Thor', by='minutes', neighbours=2)
+        self.assertEqual(data['rank'], 5)
+        self.assertEqual([entry['user_alias'] for entry in data['results']], ['Vision', 'Loki', 'Thor'])
+
+    def test_writes_move_ranks(self):
+        """Test that activity writes and leaderboard rebuilds keep the index current."""
+        self.assertEqual(self.rank('Loki')['rank'], 5)
+        self.post_activity(self.users['Loki'], 1000, 5)
+        self.assertEqual(self.rank('Loki')['rank'], 1)
+        self.assertEqual(self.rank('Thor')['rank'], 2)
+        Activity.objects.filter(user_id=str(self.users['Loki'].id)).delete()
+        self.client.post(reverse('leaderboard-rebuild'))
+        tasks.Worker().run(burst=True)
+        self.assertEqual(self.rank('Loki')['rank'], 5)
+
+    def test_stale_entries_are_corrected_without_reloading(self):
+        """Test that entries changed behind the index's back are corrected in place instead of reloading it."""
+        self.assertEqual(self.rank('Vision')['rank'], 3)
+        mongo.collection(Leaderboard).update_one({'user_id': str(self.users['Thor'].id)},
+                                                 {'$set': {'total_calories': 50}})
+        with mock.patch.object(ranking.index, 'load', wraps=ranking.index.load) as load:
+            self.assertEqual(self.rank('Vision', neighbours=0)['rank'], 3)
+            data = self.rank('Vision', neighbours=2)
+            self.assertEqual(data['rank'], 2)
+            self.assertEqual([entry['user_alias'] for entry in data['results']],
+                             ['Hulk', 'Vision', 'Wanda', 'Loki'])
+            self.assertEqual(self.rank('Thor', neighbours=0)['rank'], 5)
+        load.assert_not_called()
+
+    def test_unknown_user_does_not_load_index(self):
+        """Test that a user without an entry is a 404 from the indexed lookup alone."""
+        self.rank('Thor')
+        with mock.patch.object(ranking.index, 'load') as load:
+            response = self.client.get(reverse('leaderboard-rank'), {'user_id': 999})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        load.assert_not_called()
+
+    def test_invalid_parameters(self):
+        """Test that missing users and bad parameters are rejected."""
+        url = reverse('leaderboard-rank')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {'user_id': 999}).status_code, status.HTTP_404_NOT_FOUND)
+        for params in ({'by': 'speed'}, {'neighbours': 100}, {'neighbours': 'x'}):
+            response = self.client.get(url, {'user_id': self.users['Thor'].id, **params})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ordered_keys_match_sorting(self):
+        """Test positions and windows against a sorted list through random inserts and removals."""
+        generator = random.Random(7)
+        ranking.OrderedKeys.load = 4
+        self.addCleanup(setattr, ranking.OrderedKeys, 'load', 256)
+        keys = [(generator.randint(0, 50), str(index)) for index in range(200)]
+        order = ranking.OrderedKeys(keys[:100])
+        expected = sorted(keys[:100])
+        for key in keys[100:]:
+            order.add(key)
+            expected.append(key)
+            removed = expected.pop(generator.randrange(len(expected)))
+            order.remove(removed)
+            expected.sort()
+            probe = expected[generator.randrange(len(expected))]
+            self.assertEqual(order.position(probe), expected.index(probe))
+            start = generator.randrange(len(expected))
+            self.assertEqual(order.between(start - 3, start + 4), expected[max(start - 3, 0):start + 4])
+        self.assertEqual(len(order), len(expected))
+
+
+class WindowedLeaderboardTest(APITestCase):
+    """Test cases for day, week, month and custom range leaderboards."""
+
+    def setUp(self):
+        # Rollups and windows are not model tables, so clear what earlier tests left behind.
+        call_command('rebuild_rollups', stdout=StringIO())
+        Team.objects.create(_id='team_marvel', name='Team Marvel', description='Marvel')
+        self.thor = User.objects.create(name='Thor Odinson', alias='Thor', email='thor@asgard.com',
+                                        team_id='team_marvel', power='Thunder', fitness_level=90)
+        self.hulk = User.objects.create(name='Bruce Banner', alias='Hulk', email='hulk@marvel.com',
+                                        team_id='team_marvel', power='Strength', fitness_level=90)
+        self.post_activity(self.thor, 300, '2024-01-01T09:00:00Z')
+        self.post_activity(self.hulk, 200, '2024-01-03T09:00:00Z')
+        self.post_activity(self.hulk, 500, '2024-01-10T09:00:00Z')
+
+    def post_activity(self, user, calories, date):
+        return self.client.post(reverse('activity-list'), {
+            'user_id': str(user.id), 'workout_id': '1', 'workout_name': 'Training',
+            'duration_minutes': 30, 'calories_burned': calories, 'activity_date': date,
+        }, format='json')
+
+    def window(self, **params):
+        response = self.client.get(reverse('leaderboard-window'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def standings(self, **params):
+        return [(entry['user_alias'], entry['total_calories']) for entry in self.window(**params)['results']]
+
+    def test_windows_sum_their_period(self):
+        """Test that each period only counts the activities inside it."""
+        data = self.window(period='week', date='2024-01-02')
+        self.assertEqual((data['window'], str(data['start']), str(data['end'])), ('2024-W01', '2024-01-01', '2024-01-08'))
+        self.assertEqual(self.standings(period='week', date='2024-01-02'), [('Thor', 300), ('Hulk', 200)])
+        self.assertEqual(self.standings(period='day', date='2024-01-10'), [('Hulk', 500)])
+        self.assertEqual(self.standings(period='month', date='2024-01-31'), [('Hulk', 700), ('Thor', 300)])
+        self.assertEqual(self.standings(period='custom', start='2024-01-02', end='2024-01-10'), [('Hulk', 200)])
+        self.assertEqual(self.standings(period='week', date='2023-12-01'), [])
+
+    def test_writes_update_materialized_windows(self):
+        """Test that activity writes and team moves update stored windows without rebuilding them."""
+        self.standings(period='week', date='2024-01-02')
+        self.standings(period='custom', start='2024-01-01', end='2024-01-05')
+        header = mongo.get_db()[windows.WINDOWS].find_one({'_id': 'week:2024-W01'})
+
+        activity = self.post_activity(self.hulk, 250, '2024-01-04T09:00:00Z').data
+        self.assertEqual(self.standings(period='week', date='2024-01-02'), [('Hulk', 450), ('Thor', 300)])
+        self.assertEqual(self.standings(period='custom', start='2024-01-01', end='2024-01-05'),
+                         [('Hulk', 450), ('Thor', 300)])
+        self.client.patch(reverse('activity-detail', args=[activity['id']]),
+                          {'activity_date': '2024-01-12T09:00:00Z'}, format='json')
+        self.assertEqual(self.standings(period='week', date='2024-01-02'), [('Thor', 300), ('Hulk', 200)])
+        self.client.patch(reverse('user-detail', args=[self.thor.id]), {'team_id': 'team_dc'}, format='json')
+        self.assertEqual(self.window(period='week', date='2024-01-02')['results'][0]['team_id'], 'team_dc')
+        self.assertEqual(mongo.get_db()[windows.WINDOWS].find_one({'_id': 'week:2024-W01'})['built_at'],
+                         header['built_at'])
+
+    def test_expired_windows_are_rebuilt(self):
+        """Test that windows carry an expiry and are materialized again once it passes."""
+        self.standings(period='day', date='2024-01-10')
+        db = mongo.get_db()
+        header = db[windows.WINDOWS].find_one({'_id': 'day:2024-01-10'})
+        self.assertGreater(header['expires_at'], mongo.now())
+        self.assertEqual({entry['expires_at'] for entry in db[windows.ENTRIES].find({'window': header['_id']})},
+                         {header['expires_at']})
+        db[windows.WINDOWS].update_one({'_id': header['_id']}, {'$set': {'expires_at': mongo.now()}})
+        db[windows.ENTRIES].delete_many({'window': header['_id']})
+        self.assertEqual(self.standings(period='day', date='2024-01-10'), [('Hulk', 500)])
+
+    def test_interrupted_build(self):
+        """Test that a window left building by an interrupted build receives writes and is built again on read."""
+        db = mongo.get_db()
+        window_id = 'week:2024-W01'
+        expires_at = mongo.now() + timedelta(days=1)
+        # A build stored the header and upserted only part of its entries before its process died.
+        db[windows.WINDOWS].insert_one({
+            '_id': window_id, 'period': 'week', 'key': '2024-W01', 'start': datetime(2024, 1, 1),
+            'end': datetime(2024, 1, 8), 'built_at': mongo.now(), 'expires_at': expires_at, 'building': True,
+        })
+        db[windows.ENTRIES].insert_one({
+            '_id': f'{window_id}:{self.thor.id}', 'window': window_id, 'user_id': str(self.thor.id),
+            'user_alias': 'Thor', 'total_calories': 300, 'total_workouts': 1, 'expires_at': expires_at,
+        })
+        self.post_activity(self.thor, 100, '2024-01-02T09:00:00Z')
+        self.assertEqual(db[windows.ENTRIES].find_one({'_id': f'{window_id}:{self.thor.id}'})['total_calories'], 400)
+        self.assertEqual(self.standings(period='week', date='2024-01-02'), [('Thor', 400), ('Hulk', 200)])
+        self.assertFalse(db[windows.WINDOWS].find_one({'_id': window_id})['building'])
+        self.assertEqual(self.standings(period='week', date='2024-01-02'), [('Thor', 400), ('Hulk', 200)])
+
+    def test_concurrent_reads_build_once_and_keep_writes(self):
+        """Test that concurrent first reads build a window once and a write landing mid-build is counted once."""
+        building, resume, builds, results = threading.Event(), threading.Event(), [], []
+        users = windows._users
+
+        def paused_users(user_ids):
+            if threading.current_thread() is threading.main_thread():
+                # The write below, not a build.
+                return users(user_ids)
+            builds.append(user_ids)
+            building.set()
+            resume.wait(5)
+            return users(user_ids)
+
+        def read():
+            results.append(self.standings(period='week', date='2024-01-02'))
+
+        with mock.patch.object(windows, '_users', paused_users):
+            readers = [threading.Thread(target=read) for _ in range(2)]
+            readers[0].start()
+            self.assertTrue(building.wait(5))
+            readers[1].start()
+            self.post_activity(self.thor, 100, '2024-01-02T09:00:00Z')
+            resume.set()
+            for reader in readers:
+                reader.join()
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(results, [[('Thor', 400), ('Hulk', 200)]] * 2)
+
+    def test_invalid_parameters(self):
+        """Test that unknown periods, incomplete custom ranges and bad limits are rejected."""
+        url = reverse('leaderboard-window')
+        for params in ({'period': 'year'}, {'period': 'custom', 'start': '2024-01-01'},
+                       {'period': 'custom', 'start': '2024-02-01', 'end': '2024-01-01'},
+                       {'period': 'custom', 'start': '2020-01-01', 'end': '2024-01-01'},
+                       {'limit': 'abc'}, {'limit': 0}, {'limit': -1}, {'limit': 101}):
+            self.assertEqual(self.client.get(url, params).status_code, status.HTTP_400_BAD_REQUEST, params)
+
+
+class ColumnarRebuildTest(TestCase):
+    """Test cases for the vectorized leaderboard and standings recompute."""
+
+    def setUp(self):
+        call_command('populate_db', users=12, teams=3, activities_per_user=3, seed=7, stdout=StringIO())
+
+    def snapshot(self):
+        entries = {
+            entry['user_id']: entry
+            for entry in mongo.collection(Leaderboard).find(
+                {}, {'_id': 0, 'last_updated': 0, 'version': 0, 'updated_at': 0})
+        }
+        teams = {
+            row['team_id']: row
+            for row in mongo.collection(TeamStanding).find({}, {'_id': 0, 'id': 0, 'last_updated': 0})
+        }
+        return entries, teams
+
+    def test_matches_aggregation_rebuilds(self):
+        """Test that totals, ranks and standings equal the aggregation rebuilds, idle users included."""
+        # Created out of user id order: idle users rank last in the order the users collection returns them.
+        for user_id in (3000, 20000, 100000):
+            User.objects.create(id=user_id, name=f'Idle {user_id}', alias=f'Idle {user_id}',
+                                email=f'idle{user_id}@marvel.com', team_id='team_1', power='Rest', fitness_level=1)
+        leaderboard.rebuild()
+        standings.rebuild()
+        expected_entries, expected_teams = self.snapshot()
+        self.assertEqual(columnar.rebuild(), (len(expected_entries), len(expected_teams)))
+        entries, teams = self.snapshot()
+        self.assertEqual(entries, expected_entries)
+        self.assertEqual(teams, expected_teams)
+
+    def test_keeps_ids_and_drops_stale_entries(self):
+        """Test that entries are updated in place and entries of unknown users are removed."""
+        ids = {entry.user_id: entry.id for entry in Leaderboard.objects.all()}
+        Leaderboard.objects.create(user_id='999', user_name='Ghost', total_calories=10 ** 6, rank=1)
+        columnar.rebuild(batch_size=5)
+        self.assertEqual({entry.user_id: entry.id for entry in Leaderboard.objects.all()}, ids)
+
+    def test_ranks_every_metric(self):
+        """Test that each metric is ranked highest first with ties broken by user id."""
+        np = columnar.np
+        columns = columnar.Columns(
+            user_ids=np.array(['3', '1', '2', '10']), user=np.array([0, 0, 1, 2, 1]),
+            calories=np.array([100, 50, 150, 150, 0]), minutes=np.array([10, 10, 30, 5, 0]),
+            distance=np.array([1.0, 2.5, 0.0, 4.0, 0.0]),
+        )
+        result = columnar.compute(columns, ['team_a', 'team_a', 'team_b', ''])
+        self.assertEqual(result.totals['total_calories'].tolist(), [150, 150, 150, 0])
+        self.assertEqual(result.ranks['total_calories'].tolist(), [3, 1, 2, 4])
+        self.assertEqual(result.ranks['total_minutes'].tolist(), [2, 1, 3, 4])
+        self.assertEqual(result.ranks['total_workouts'].tolist(), [2, 1, 3, 4])
+        team = result.team_ids.tolist().index('team_a')
+        self.assertEqual(result.team_totals['total_calories'][team], 300)
+        self.assertEqual(result.team_totals['member_count'][team], 2)
+        self.assertEqual(result.team_totals['active_members'][team], 2)
+
+    def test_benchmark_times_synthetic_columns(self):
+        """Test that the compute benchmark reports every requested size."""
+        results = benchmark.bench_columnar([1000, 5000], users=50, iterations=1)
+        self.assertEqual(sorted(results), ['compute 1000 activities / 50 users', 'compute 5000 activities / 50 users'])
+        self.assertGreater(results['compute 5000 activities / 50 users']['activities_per_s'], 0)
+
+
+class ExportTest(APITestCase):
+    """Test cases for the streaming CSV and NDJSON exports."""
+
+    def setUp(self):
+        self.thor = User.objects.create(name='Thor Odinson', alias='Thor', email='thor@asgard.com',
+                                        team_id='team_marvel', power='Thunder', fitness_level=90)
+        self.diana = User.objects.create(name='Diana Prince', alias='Wonder Woman', email='diana@dc.com',
+                                         team_id='team_dc', power='Strength', fitness_level=95)
+        rows = [(self.thor, 300, '2024-01-01T09:00:00Z'), (self.thor, 200, '2024-02-01T09:00:00Z'),
+                (self.diana, 400, '2024-01-15T09:00:00Z')]
+        for user, calories, date in rows:
+            self.client.post(reverse('activity-list'), {
+                'user_id': str(user.id), 'workout_id': '1', 'workout_name': 'Training, "hard"',
+                'duration_minutes': 30, 'calories_burned': calories, 'activity_date': date,
+            }, format='json')
+
+    def export(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_streams_every_activity(self):
+        """Test that the CSV export has a header and every activity in date order."""
+        response, body = self.export('activity-export')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="activities.csv"')
+        rows = list(csv.DictReader(body.decode().splitlines()))
+        self.assertEqual([row['calories_burned'] for row in rows], ['300', '400', '200'])
+        self.assertEqual(rows[0]['workout_name'], 'Training, "hard"')
+
+    def test_ndjson_filters(self):
+        """Test that date, user and team filters narrow the NDJSON export."""
+        _, body = self.export('activity-export', output='ndjson', start='2024-01-01', end='2024-02-01',
+                              fields='user_id,calories_burned')
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual(rows, [{'user_id': str(self.thor.id), 'calories_burned': 300},
+                                {'user_id': str(self.diana.id), 'calories_burned': 400}])
+        _, body = self.export('activity-export', output='ndjson', team_id='team_dc')
+        self.assertEqual([json.loads(line)['calories_burned'] for line in body.decode().splitlines()], [400])
+        _, body = self.export('activity-export', output='ndjson', team_id='team_dc', user_id=str(self.thor.id))
+        self.assertEqual(body, b'')
+        _, body = self.export('leaderboard-export', output='ndjson', team_id='team_marvel')
+        self.assertEqual([json.loads(line)['total_calories'] for line in body.decode().splitlines()], [500])
+
+    def test_gzip_compresses_on_the_fly(self):
+        """Test that a gzip export decompresses to the plain export."""
+        _, plain = self.export('leaderboard-export')
+        response, body = self.export('leaderboard-export', compression='gzip')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(gzip.decompress(body), plain)
+
+    def test_invalid_parameters(self):
+        """Test that unknown formats and date filters on the leaderboard are rejected."""
+        response = self.client.get(reverse('activity-export'), {'output': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('leaderboard-export'), {'start': '2024-01-01'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_asgi_exports_stream_from_threads(self):
+        """Test that ASGI exports match the WSGI ones and reject bad parameters before streaming."""
+        sent, inbox = [], asyncio.Queue()
+
+        async def send(message):
+            sent.append(message)
+
+        async def request(name, query_string=b''):
+            sent.clear()
+            await inbox.put({'type': 'http.request', 'body': b''})
+            await asgi_request(reverse(name), inbox.get, send, query_string)
+            return sent[0], b''.join(message.get('body', b'') for message in sent[1:])
+
+        for name, params in [('activity-export', {'fields': 'user_id,calories_burned'}),
+                             ('leaderboard-export', {'output': 'ndjson', 'compression': 'gzip'})]:
+            expected = await sync_to_async(self.client.get)(reverse(name), params)
+            start, body = await request(name, urlencode(params).encode())
+            self.assertEqual(start['status'], 200)
+            headers = dict(start['headers'])
+            self.assertEqual(headers[b'Content-Disposition'].decode(), expected['Content-Disposition'])
+            self.assertIn(b'Server-Timing', headers)
+            self.assertEqual(body, b''.join(expected.streaming_content))
+            self.assertFalse(sent[-1].get('more_body'))
+
+        start, body = await request('leaderboard-export', b'start=2024-01-01')
+        self.assertEqual(start['status'], 400)
+        self.assertIn('start', json.loads(body))
+
+    def test_export_data_command(self):
+        """Test that the command streams the same rows in small batches."""
+        out = StringIO()
+        call_command('export_data', 'activities', output='ndjson', user=str(self.thor.id), batch_size=1, stdout=out)
+        self.assertEqual([json.loads(line)['calories_burned'] for line in out.getvalue().splitlines()], [300, 200])
+
+
+class ActivityArchiveTest(APITestCase):
+    """Test cases for moving old activities to the archive collection."""
+
+    def setUp(self):
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.addCleanup(self.drop_archive)
+        self.thor = User.objects.create(name='Thor Odinson', alias='Thor', email='thor@asgard.com',
+                                        team_id='team_marvel', power='Thunder', fitness_level=90)
+        recent = (mongo.now() - timedelta(days=2)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        for calories, date in [(100, '2020-01-01T09:00:00Z'), (200, '2020-06-01T09:00:00Z'), (400, recent)]:
+            self.client.post(reverse('activity-list'), {
+                'user_id': str(self.thor.id), 'workout_id': '1', 'workout_name': 'Training',
+                'duration_minutes': 30, 'calories_burned': calories, 'activity_date': date,
+            }, format='json')
+
+    def drop_archive(self):
+        mongo.get_db().drop_collection(archive.ARCHIVE)
+        mongo.get_db().drop_collection(archive.STATE)
+
+    def history(self, **params):
+        response = self.client.get(reverse('activity-history'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['calories_burned'] for row in response.data]
+
+    def test_archiving_moves_old_activities(self):
+        """Test that only activities past the horizon move and that rerunning is harmless."""
+        duplicate = mongo.collection(Activity).find_one({'calories_burned': 100})
+        archive.ensure_collection()
+        mongo.get_db()[archive.ARCHIVE].insert_one(duplicate)
+        out = StringIO()
+        call_command('archive_activities', days=365, batch_size=1, stdout=out)
+        self.assertIn('Archived 2 activities.', out.getvalue())
+        self.assertEqual(list(Activity.objects.values_list('calories_burned', flat=True)), [400])
+        self.assertEqual(mongo.get_db()[archive.ARCHIVE].count_documents({}), 2)
+        self.assertEqual(archive.archive_activities(), 0)
+
+    def test_rebuilds_count_archived_activities(self):
+        """Test that leaderboard, standings and rollup rebuilds keep archived totals."""
+        archive.archive_activities(batch_size=1)
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.thor.id)).total_calories, 700)
+        leaderboard.rebuild()
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.thor.id)).total_calories, 700)
+        if columnar.available():
+            columnar.rebuild()
+            self.assertEqual(Leaderboard.objects.get(user_id=str(self.thor.id)).total_workouts, 3)
+        rollups.rebuild()
+        response = self.client.get(reverse('user-stats', args=[self.thor.id]), {'period': 'month'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sum(bucket['calories'] for bucket in response.data['buckets']), 700)
+
+    def test_history_falls_through_to_archive(self):
+        """Test that history merges archived and hot activities only for ranges reaching the archive."""
+        self.assertEqual(self.history(), [400, 200, 100])
+        archive.archive_activities()
+        self.assertEqual(self.history(), [400, 200, 100])
+        self.assertEqual(self.history(start='2020-03-01', end='2020-12-31'), [200])
+        self.assertEqual(self.history(limit=2), [400, 200])
+        self.assertEqual(self.history(start=mongo.now().strftime('%Y-%m-01')), [400])
+        response = self.client.get(reverse('activity-export'), {'output': 'ndjson'})
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['calories_burned'] for line in rows], [100, 200, 400])
+        response = self.client.get(reverse('activity-list'))
+        self.assertEqual([row['calories_burned'] for row in response.data['results']], [400])
+        for limit in ('x', '0', '-1'):
+            response = self.client.get(reverse('activity-history'), {'limit': limit})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, limit)
+
+
+@override_settings(OCTOFIT_SYNC_SETTLE_SECONDS=0)
+class DeltaSyncTest(APITestCase):
+    """Test cases for the ?since= delta sync mode of the list endpoints."""
+
+    def setUp(self):
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.addCleanup(mongo.get_db().drop_collection, sync.TOMBSTONES)
+        self.thor = User.objects.create(name='Thor Odinson', alias='Thor', email='thor@asgard.com',
+                                        team_id='team_marvel', power='Thunder', fitness_level=90)
+
+    def sync(self, name, since, **params):
+        response = self.client.get(reverse(f'{name}-list'), {'since': since, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def drain(self, name, since='0'):
+        """Follow ``next`` until no page is left, returning every result, deletion and the last token."""
+        results, deleted = [], []
+        while True:
+            page = self.sync(name, since)
+            results += page['results']
+            deleted += page['deleted']
+            since = page['next']
+            if not page['more']:
+                return results, deleted, since
+
+    def test_changes_since_token(self):
+        """Test that only rows created, updated or deleted after the token are returned."""
+        _, _, token = self.drain('workout')
+        ids = []
+        for name in ('Run', 'Swim', 'Ride'):
+            response = self.client.post(reverse('workout-list'), {
+                'name': name, 'description': name, 'difficulty': 'Easy', 'duration_minutes': 30,
+                'calories_per_session': 300,
+            }, format='json')
+            ids.append(response.data['id'])
+        results, deleted, token = self.drain('workout', token)
+        self.assertEqual([row['name'] for row in results], ['Run', 'Swim', 'Ride'])
+        self.assertEqual(deleted, [])
+
+        self.client.patch(reverse('workout-detail', args=[ids[0]]), {'name': 'Long Run'}, format='json')
+        self.client.delete(reverse('workout-detail', args=[ids[1]]))
+        results, deleted, token = self.drain('workout', token)
+        self.assertEqual([row['name'] for row in results], ['Long Run'])
+        self.assertEqual(deleted, [ids[1]])
+        self.assertEqual(self.drain('workout', token)[:2], ([], []))
+
+    def test_pages_and_sparse_fields(self):
+        """Test that limit pages the changes and that fields keep the primary key."""
+        _, _, token = self.drain('team')
+        for number in range(5):
+            Team.objects.create(_id=f'sync_{number}', name=f'Sync {number}', description='')
+        page = self.sync('team', token, limit=2, fields='name')
+        self.assertEqual(page['results'], [{'_id': 'sync_0', 'name': 'Sync 0'}, {'_id': 'sync_1', 'name': 'Sync 1'}])
+        self.assertTrue(page['more'])
+        results, _, _ = self.drain('team', page['next'])
+        self.assertEqual([row['_id'] for row in results], ['sync_2', 'sync_3', 'sync_4'])
+
+    def test_native_writes_are_tracked(self):
+        """Test that bulk ingest and leaderboard updates show up in the delta."""
+        _, _, activities = self.drain('activity')
+        _, _, board = self.drain('leaderboard')
+        body = '\n'.join(json.dumps({
+            'user_id': str(self.thor.id), 'workout_id': '1', 'workout_name': 'Training', 'duration_minutes': 30,
+            'calories_burned': calories, 'activity_date': '2024-01-01T09:00:00Z',
+        }) for calories in (100, 200))
+        response = self.client.post(reverse('activity-bulk'), body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        results, _, _ = self.drain('activity', activities)
+        self.assertEqual(sorted(row['calories_burned'] for row in results), [100, 200])
+        results, _, board = self.drain('leaderboard', board)
+        self.assertEqual([(row['user_id'], row['total_calories']) for row in results], [(str(self.thor.id), 300)])
+
+        self.client.delete(reverse('user-detail', args=[self.thor.id]))
+        _, deleted, _ = self.drain('leaderboard', board)
+        self.assertEqual(len(deleted), 1)
+
+    def test_backfill_stamps_untracked_documents(self):
+        """Test that stamp_versions versions documents written without one."""
+        _, _, token = self.drain('user')
+        mongo.collection(User).update_one({'id': self.thor.id}, {'$unset': {'version': '', 'updated_at': ''}})
+        self.assertEqual(self.drain('user', token)[0], [])
+        out = StringIO()
+        call_command('stamp_versions', stdout=out)
+        self.assertIn('users: stamped 1 documents', out.getvalue())
+        self.assertEqual([row['id'] for row in self.drain('user', token)[0]], [self.thor.id])
+
+    def test_settle_window_and_invalid_tokens(self):
+        """Test that fresh writes wait for the settle window and that bad tokens are rejected."""
+        _, _, token = self.drain('user')
+        User.objects.create(name='Loki', alias='Loki', email='loki@asgard.com', team_id='team_marvel',
+                            power='Magic', fitness_level=80)
+        with override_settings(OCTOFIT_SYNC_SETTLE_SECONDS=60):
+            self.assertEqual(self.sync('user', token)['results'], [])
+        self.assertEqual([row['alias'] for row in self.sync('user', token)['results']], ['Loki'])
+        for since, limit in (('abc', 1), ('-1', 1), ('1.x', 1), ('0', 0)):
+            response = self.client.get(reverse('user-list'), {'since': since, 'limit': limit})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SearchTest(APITestCase):
+    """Test cases for the prefix search index, its endpoints and the admin search."""
+
+    def setUp(self):
+        call_command('rebuild_rollups', stdout=StringIO())
+        mongo.get_db().drop_collection(search.INDEX)
+        self.addCleanup(mongo.get_db().drop_collection, search.INDEX)
+        for name, alias, email in [('Thor Odinson', 'Thor', 'thor@asgard.com'), ('Zoë Castillo', 'Zoe', 'zoe@x.com'),
+                                   ('Loki Laufeyson', 'Loki', 'loki@asgard.com')]:
+            self.client.post(reverse('user-list'), {'name': name, 'alias': alias, 'email': email,
+                                                    'team_id': 'team_marvel', 'power': 'Magic',
+                                                    'fitness_level': 80}, format='json')
+        self.thor = User.objects.get(alias='Thor')
+        response = self.client.post(reverse('workout-list'), {
+            'name': 'Hammer Swings', 'description': 'Swings', 'difficulty': 'Hard', 'duration_minutes': 30,
+            'calories_per_session': 400,
+        }, format='json')
+        self.workout_id = response.data['id']
+        for notes in ('Morning hammer practice', 'Evening run by the fjord', 'Hammer throws, then stretching'):
+            self.client.post(reverse('activity-list'), {
+                'user_id': str(self.thor.id), 'workout_id': str(self.workout_id), 'workout_name': 'Hammer Swings',
+                'duration_minutes': 30, 'calories_burned': 400, 'activity_date': '2024-01-01T09:00:00Z',
+                'notes': notes,
+            }, format='json')
+
+    def search(self, name, q, **params):
+        response = self.client.get(reverse(f'{name}-search'), {'q': q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_words_and_prefixes(self):
+        """Test that words are lowercased, stripped of accents and indexed by prefix."""
+        self.assertEqual(search.words('Zoë  Castillo-Smith'), ['zoe', 'castillo', 'smith'])
+        self.assertEqual(search.terms(['Thor O']), ['th', 'tho', 'thor'])
+        self.assertEqual(search.query_terms('Thor o Thor'), ['thor'])
+
+    def test_typeahead_endpoints(self):
+        """Test that every query word must prefix a word of the document."""
+        self.assertEqual([row['alias'] for row in self.search('user', 'thor')], ['Thor'])
+        self.assertEqual([row['alias'] for row in self.search('user', 'AS')], ['Thor', 'Loki'])
+        self.assertEqual([row['alias'] for row in self.search('user', 'zoë cas')], ['Zoe'])
+        self.assertEqual(self.search('user', 'odinson loki'), [])
+        self.assertEqual(self.search('user', 'a'), [])
+        self.assertEqual(self.search('user', 'asgard', limit=1, fields='alias'), [{'alias': 'Thor'}])
+        self.assertEqual([row['name'] for row in self.search('workout', 'ham sw')], ['Hammer Swings'])
+        self.assertEqual([row['notes'] for row in self.search('activity', 'hammer')],
+                         ['Hammer throws, then stretching', 'Morning hammer practice'])
+        for params in ({}, {'q': ' '}, {'q': 'thor', 'limit': 0}, {'q': 'thor', 'limit': 'x'}):
+            response = self.client.get(reverse('user-search'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_index_follows_writes(self):
+        """Test that updates, deletes, bulk ingest and archiving keep the index current."""
+        self.client.patch(reverse('user-detail', args=[self.thor.id]), {'alias': 'Donar'}, format='json')
+        self.assertEqual([row['alias'] for row in self.search('user', 'donar')], ['Donar'])
+        self.assertEqual(self.search('user', 'thor odin')[0]['alias'], 'Donar')
+        self.client.delete(reverse('workout-detail', args=[self.workout_id]))
+        self.assertEqual(self.search('workout', 'hammer'), [])
+
+        morning = Activity.objects.get(notes='Morning hammer practice')
+        self.client.patch(reverse('activity-detail', args=[morning.id]), {'notes': 'Morning swim'}, format='json')
+        self.client.delete(reverse('activity-detail', args=[Activity.objects.get(notes__startswith='Evening').id]))
+        body = json.dumps({'user_id': str(self.thor.id), 'workout_id': '1', 'workout_name': 'Swim',
+                           'duration_minutes': 30, 'calories_burned': 300,
+                           'activity_date': '2024-01-02T09:00:00Z', 'notes': 'Afternoon swim'})
+        self.client.post(reverse('activity-bulk'), body, content_type='application/x-ndjson')
+        self.assertEqual([row['notes'] for row in self.search('activity', 'swim')], ['Afternoon swim', 'Morning swim'])
+        self.assertEqual(self.search('activity', 'fjord'), [])
+
+        self.addCleanup(mongo.get_db().drop_collection, archive.ARCHIVE)
+        self.addCleanup(mongo.get_db().drop_collection, archive.STATE)
+        archive.archive_activities(before=datetime(2025, 1, 1))
+        self.assertEqual(mongo.get_db()[search.INDEX].count_documents({'kind': 'activity'}), 0)
+
+    def test_rows_without_text_are_not_written(self):
+        """Test that new rows without searchable text cost no index write, while clearing text drops the entry."""
+        body = '\n'.join(json.dumps({'user_id': str(self.thor.id), 'workout_id': '1', 'workout_name': 'Swim',
+                                     'duration_minutes': 30, 'calories_burned': 300,
+                                     'activity_date': '2024-01-02T09:00:00Z'}) for _ in range(3))
+        with mock.patch.object(search, 'DeleteOne') as delete:
+            self.client.post(reverse('activity-bulk'), body, content_type='application/x-ndjson')
+        delete.assert_not_called()
+        self.assertEqual(mongo.get_db()[search.INDEX].count_documents({'kind': 'activity'}), 3)
+
+        morning = Activity.objects.get(notes='Morning hammer practice')
+        self.client.patch(reverse('activity-detail', args=[morning.id]), {'notes': ''}, format='json')
+        self.assertEqual(mongo.get_db()[search.INDEX].count_documents({'kind': 'activity'}), 2)
+
+    def test_rebuild_and_admin_search(self):
+        """Test that a rebuild recreates the same entries and that the admin searches through them."""
+        entries = list(mongo.get_db()[search.INDEX].find({}, sort=[('_id', 1)]))
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 3 user entries, 1 workout entries, 3 activity entries.', out.getvalue())
+        self.assertEqual(list(mongo.get_db()[search.INDEX].find({}, sort=[('_id', 1)])), entries)
+
+        users, _ = UserAdmin(User, admin.site).get_search_results(None, User.objects.all(), 'asgard')
+        self.assertEqual(sorted(user.alias for user in users), ['Loki', 'Thor'])
+        activities = ActivityAdmin(Activity, admin.site)
+        self.assertEqual(activities.get_search_results(None, Activity.objects.all(), 'swings')[0].count(), 3)
+        self.assertEqual(activities.get_search_results(None, Activity.objects.all(), 'fjord')[0].count(), 1)
+        self.assertEqual(activities.get_search_results(None, Activity.objects.all(), str(self.thor.id))[0].count(), 3)
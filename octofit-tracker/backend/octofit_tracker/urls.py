@@ -10,7 +10,8 @@ API Endpoints are available at:
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
-from .views import TeamViewSet, UserViewSet, WorkoutViewSet, ActivityViewSet, LeaderboardViewSet
+from .instrumentation import metrics_view
+from .views import TeamViewSet, UserViewSet, WorkoutViewSet, ActivityViewSet, LeaderboardViewSet, JobViewSet
 
 # Create a router and register our viewsets
 router = routers.DefaultRouter()
@@ -19,9 +20,11 @@ router.register(r'users', UserViewSet)
 router.register(r'workouts', WorkoutViewSet)
 router.register(r'activities', ActivityViewSet)
 router.register(r'leaderboard', LeaderboardViewSet)
+router.register(r'jobs', JobViewSet)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(router.urls)),
+    path('metrics', metrics_view, name='metrics'),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
 ]
@@ -0,0 +1,18 @@
+"""octofit_tracker URL Configuration for ASGI
+
+Used for requests served over ASGI (see ``OCTOFIT_ASGI_URLCONF``).  The
+hot read endpoints resolve to the async views in ``async_views`` and the
+live update stream to ``live.updates``; every other URL falls through to
+the regular ``urls`` module.
+"""
+from django.urls import path
+
+from . import async_views, live
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('api/leaderboard/top/', async_views.leaderboard_top, name='async-leaderboard-top'),
+    path('api/activities/recent/', async_views.activities_recent, name='async-activity-recent'),
+    path('api/teams/<str:pk>/members/', async_views.team_members, name='async-team-members'),
+    path('api/live/', live.updates, name='live'),
+] + sync_urlpatterns
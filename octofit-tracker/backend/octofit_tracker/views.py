@@ -1,77 +1,237 @@
-from rest_framework import viewsets
+import copy
+from itertools import islice
+
+from django.conf import settings
+from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
-from .models import Team, User, Workout, Activity, Leaderboard
-from .serializers import TeamSerializer, UserSerializer, WorkoutSerializer, ActivitySerializer, LeaderboardSerializer
+from rest_framework.reverse import reverse
+from . import archive
+from . import events
+from . import exports
+from . import maintenance
+from . import ranking
+from . import repositories
+from . import search
+from . import standings
+from . import stats
+from . import tasks
+from . import windows
+from .caching import CacheInvalidationMixin, cached_response
+from .delta import DeltaSyncMixin
+from .fieldsets import SparseFieldsetMixin
+from .ingest import ingest_activities
+from .models import Team, User, Workout, Activity, Leaderboard, Job
+from .pagination import TeamCursorPagination, ActivityCursorPagination, LeaderboardCursorPagination, JobCursorPagination
+from .serializers import (TeamSerializer, TeamStandingSerializer, UserSerializer, WorkoutSerializer, ActivitySerializer,
+                          LeaderboardSerializer, JobSerializer, activity_reader, leaderboard_reader, team_reader,
+                          user_reader, workout_reader)
+
 
+def job_accepted(request, job):
+    """Return a 202 response describing a queued job, pointing at its status endpoint."""
+    instance = Job.objects.get(id=job['id'])
+    url = reverse('job-detail', args=[instance.id], request=request)
+    return Response(JobSerializer(instance).data, status=status.HTTP_202_ACCEPTED, headers={'Location': url})
 
-class TeamViewSet(viewsets.ModelViewSet):
+
+class TeamViewSet(DeltaSyncMixin, SparseFieldsetMixin, CacheInvalidationMixin, viewsets.ModelViewSet):
     """
     API endpoint for teams.
     """
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
+    sync_reader = team_reader
+    pagination_class = TeamCursorPagination
+    cache_scopes = ('teams',)
+    sparse_serializer_classes = {'members': UserSerializer}
 
     @action(detail=True, methods=['get'])
+    @cached_response('teams')
     def members(self, request, pk=None):
         """Get all members of a team."""
         team = self.get_object()
+        fields = self.sparse_fields()
         users = User.objects.filter(team_id=pk)
-        serializer = UserSerializer(users, many=True)
+        if fields:
+            users = users.only(*fields)
+        serializer = UserSerializer(users, many=True, fields=fields)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    @cached_response('teams', 'leaderboard')
+    def standings(self, request):
+        """Get every team ranked by total calories."""
+        rows = standings.ranked()
+        data = TeamStandingSerializer(rows, many=True).data
+        return Response([{'rank': row['rank'], 'name': row['name'], **item} for row, item in zip(rows, data)])
+
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """Get the team's activity totals per day, week or month."""
+        period = stats.parse_period(request.query_params.get('period'))
+        start = stats.parse_bound(request.query_params.get('start'), 'start')
+        end = stats.parse_bound(request.query_params.get('end'), 'end')
+        buckets = stats.team_totals(pk, period, start, end)
+        return Response({'team_id': pk, 'period': period, 'buckets': buckets})
+
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(DeltaSyncMixin, SparseFieldsetMixin, CacheInvalidationMixin, viewsets.ModelViewSet):
     """
     API endpoint for users.
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    sync_reader = user_reader
+    cache_scopes = ('teams', 'leaderboard')
+    sparse_serializer_classes = {'activities': ActivitySerializer}
+
+    def perform_create(self, serializer):
+        with events.writing():
+            user = serializer.save()
+            events.user_created(user)
+        self.invalidate_cache()
+
+    def perform_update(self, serializer):
+        previous = copy.copy(serializer.instance)
+        with events.writing():
+            user = serializer.save()
+            events.user_updated(previous, user)
+        self.invalidate_cache()
+
+    def perform_destroy(self, instance):
+        user_id, team_id = instance.pk, instance.team_id
+        with events.writing():
+            instance.delete()
+            events.user_deleted(user_id, team_id)
+        self.invalidate_cache()
 
     @action(detail=True, methods=['get'])
     def activities(self, request, pk=None):
         """Get all activities for a user."""
-        activities = Activity.objects.filter(user_id=str(pk))
-        serializer = ActivitySerializer(activities, many=True)
-        return Response(serializer.data)
+        paginator = ActivityCursorPagination()
+        fields = self.fetch_fields(ordering=paginator.ordering)
+        activities = Activity.objects.filter(user_id=str(pk)).values(*fields)
+        page = paginator.paginate_queryset(activities, request, view=self)
+        return paginator.get_paginated_response(activity_reader.many(page, self.sparse_fields()))
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Get users whose name, alias or email has words starting with the words of ?q=."""
+        return Response(search.results('user', request.query_params, self.sparse_fields()))
 
     @action(detail=False, methods=['get'])
     def by_team(self, request):
         """Get users filtered by team."""
         team_id = request.query_params.get('team_id', None)
         if team_id:
-            users = User.objects.filter(team_id=team_id)
+            users = self.get_queryset().filter(team_id=team_id)
         else:
-            users = User.objects.all()
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data)
+            users = self.get_queryset()
+        page = self.paginate_queryset(users)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """Get the user's activity totals per day, week or month."""
+        period = stats.parse_period(request.query_params.get('period'))
+        start = stats.parse_bound(request.query_params.get('start'), 'start')
+        end = stats.parse_bound(request.query_params.get('end'), 'end')
+        buckets = stats.user_totals(pk, period, start, end)
+        return Response({'user_id': pk, 'period': period, 'buckets': buckets})
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class WorkoutViewSet(DeltaSyncMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     API endpoint for workouts.
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
+    sync_reader = workout_reader
+
+    def perform_create(self, serializer):
+        workout = serializer.save()
+        events.workout_created(workout)
+
+    def perform_update(self, serializer):
+        previous = copy.copy(serializer.instance)
+        workout = serializer.save()
+        events.workout_updated(previous, workout)
+
+    def perform_destroy(self, instance):
+        workout_id = instance.pk
+        instance.delete()
+        events.workout_deleted(workout_id)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Get workouts whose name has words starting with the words of ?q=."""
+        return Response(search.results('workout', request.query_params, self.sparse_fields()))
 
     @action(detail=False, methods=['get'])
     def by_difficulty(self, request):
         """Get workouts filtered by difficulty."""
         difficulty = request.query_params.get('difficulty', None)
         if difficulty:
-            workouts = Workout.objects.filter(difficulty=difficulty)
+            workouts = self.get_queryset().filter(difficulty=difficulty)
         else:
-            workouts = Workout.objects.all()
-        serializer = WorkoutSerializer(workouts, many=True)
-        return Response(serializer.data)
+            workouts = self.get_queryset()
+        page = self.paginate_queryset(workouts)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def calorie_distribution(self, request):
+        """Get calorie statistics and a histogram for each workout."""
+        start = stats.parse_bound(request.query_params.get('start'), 'start')
+        end = stats.parse_bound(request.query_params.get('end'), 'end')
+        workout_id = request.query_params.get('workout_id', None)
+        return Response(stats.calorie_distribution(workout_id, start, end))
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(DeltaSyncMixin, SparseFieldsetMixin, CacheInvalidationMixin, viewsets.ModelViewSet):
     """
     API endpoint for activities.
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    sync_reader = activity_reader
+    pagination_class = ActivityCursorPagination
+    cache_scopes = ('leaderboard',)
+
+    def list(self, request, *args, **kwargs):
+        if self.delta_requested():
+            return self.delta_response()
+        activities = self.filter_queryset(self.get_queryset()).values(*self.fetch_fields())
+        page = self.paginate_queryset(activities)
+        return self.get_paginated_response(activity_reader.many(page, self.sparse_fields()))
+
+    def perform_create(self, serializer):
+        with events.writing():
+            activity = serializer.save()
+            events.activity_created(activity)
+        self.invalidate_cache()
+
+    def perform_update(self, serializer):
+        previous = copy.copy(serializer.instance)
+        with events.writing():
+            activity = serializer.save()
+            events.activity_updated(previous, activity)
+        self.invalidate_cache()
+
+    def perform_destroy(self, instance):
+        activity_id = instance.pk
+        with events.writing():
+            instance.delete()
+            events.activity_deleted(activity_id, instance)
+        self.invalidate_cache()
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Get the newest activities whose notes have words starting with the words of ?q=."""
+        return Response(search.results('activity', request.query_params, self.sparse_fields()))
 
     @action(detail=False, methods=['get'])
     def by_user(self, request):
@@ -81,34 +241,122 @@ class ActivityViewSet(viewsets.ModelViewSet):
             activities = Activity.objects.filter(user_id=user_id)
         else:
             activities = Activity.objects.all()
-        serializer = ActivitySerializer(activities, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(activities.values(*self.fetch_fields()))
+        return self.get_paginated_response(activity_reader.many(page, self.sparse_fields()))
+
+    @action(detail=False, methods=['get'])
+    def history(self, request):
+        """Get activities in a date range, newest first, including archived ones."""
+        try:
+            limit = int(request.query_params.get('limit', 100))
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer.'})
+        if limit < 1:
+            raise ValidationError({'limit': 'Must be at least 1.'})
+        limit = min(limit, settings.OCTOFIT_HISTORY_MAX_LIMIT)
+        query = exports.build_query('activities', request.query_params)
+        fields = self.sparse_fields()
+        activities = archive.find(query, repositories.projection(ActivitySerializer, fields), descending=True)
+        return Response(activity_reader.many(islice(activities, limit), fields))
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream activities as CSV or NDJSON, filtered by date range, user or team."""
+        return exports.response(request, 'activities')
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Create activities from an NDJSON request body, one activity per line."""
+        stream = request.stream
+        lines = iter(stream.readline, b'') if stream is not None else []
+        summary = ingest_activities(lines)
+        if not summary['received']:
+            raise ValidationError({'non_field_errors': ['The request body has no NDJSON rows.']})
+        if summary['created']:
+            self.invalidate_cache()
+        if not summary['errors']:
+            code = status.HTTP_201_CREATED
+        elif summary['created']:
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_400_BAD_REQUEST
+        return Response(summary, status=code)
 
     @action(detail=False, methods=['get'])
     def recent(self, request):
         """Get most recent activities."""
         limit = int(request.query_params.get('limit', 10))
-        activities = Activity.objects.all()[:limit]
-        serializer = ActivitySerializer(activities, many=True)
-        return Response(serializer.data)
+        fields = self.sparse_fields()
+        if repositories.uses_native_reads(self):
+            activities = repositories.recent_activities(limit, fields)
+        else:
+            activities = Activity.objects.values(*self.fetch_fields(ordering=()))[:limit]
+        return Response(activity_reader.many(activities, fields))
 
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+class LeaderboardViewSet(DeltaSyncMixin, SparseFieldsetMixin, CacheInvalidationMixin, viewsets.ModelViewSet):
     """
     API endpoint for leaderboard.
     """
     queryset = Leaderboard.objects.all()
     serializer_class = LeaderboardSerializer
+    sync_reader = leaderboard_reader
+    pagination_class = LeaderboardCursorPagination
+    cache_scopes = ('leaderboard',)
+
+    def list(self, request, *args, **kwargs):
+        if self.delta_requested():
+            return self.delta_response()
+        leaderboard = self.filter_queryset(self.get_queryset()).values(*self.fetch_fields())
+        page = self.paginate_queryset(leaderboard)
+        return self.get_paginated_response(leaderboard_reader.many(page, self.sparse_fields()))
 
     @action(detail=False, methods=['get'])
+    @cached_response('leaderboard')
     def top(self, request):
         """Get top n entries from leaderboard."""
         limit = int(request.query_params.get('limit', 10))
-        leaderboard = Leaderboard.objects.all()[:limit]
-        serializer = LeaderboardSerializer(leaderboard, many=True)
-        return Response(serializer.data)
+        fields = self.sparse_fields()
+        if repositories.uses_native_reads(self):
+            leaderboard = repositories.top_leaderboard(limit, fields)
+        else:
+            leaderboard = Leaderboard.objects.values(*self.fetch_fields(ordering=()))[:limit]
+        return Response(leaderboard_reader.many(leaderboard, fields))
 
     @action(detail=False, methods=['get'])
+    def rank(self, request):
+        """Get a user's rank by calories, minutes, workouts or distance and the entries around it."""
+        user_id = request.query_params.get('user_id')
+        if not user_id:
+            raise ValidationError({'user_id': 'This query parameter is required.'})
+        field = ranking.parse_metric(request.query_params.get('by'))
+        neighbours = ranking.parse_neighbours(request.query_params.get('neighbours'))
+        result = ranking.neighbourhood(user_id, field, neighbours)
+        if result is None:
+            raise NotFound(f'User {user_id} is not on the leaderboard.')
+        return Response(result)
+
+    @action(detail=False, methods=['get'])
+    def window(self, request):
+        """Get the top n users of a day, week, month or custom date range."""
+        limit = windows.parse_limit(request.query_params.get('limit'))
+        period, key, start, end = windows.parse_window(request.query_params)
+        header = windows.get_window(period, key, start, end)
+        return Response({'period': period, 'window': key, 'start': start.date(), 'end': end.date(),
+                         'results': windows.ranked(header, limit)})
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream the leaderboard as CSV or NDJSON, filtered by user or team."""
+        return exports.response(request, 'leaderboard')
+
+    @action(detail=False, methods=['post'])
+    def rebuild(self, request):
+        """Queue a full recomputation of the leaderboard and team standings."""
+        return job_accepted(request, tasks.enqueue(maintenance.rebuild_leaderboard.task_name))
+
+    @action(detail=False, methods=['get'])
+    @cached_response('leaderboard')
     def by_team(self, request):
         """Get leaderboard filtered by team."""
         team_id = request.query_params.get('team_id', None)
@@ -116,5 +364,33 @@ class LeaderboardViewSet(viewsets.ModelViewSet):
             leaderboard = Leaderboard.objects.filter(team_id=team_id)
         else:
             leaderboard = Leaderboard.objects.all()
-        serializer = LeaderboardSerializer(leaderboard, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(leaderboard.values(*self.fetch_fields()))
+        return self.get_paginated_response(leaderboard_reader.many(page, self.sparse_fields()))
+
+
+class JobViewSet(SparseFieldsetMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, mixins.CreateModelMixin,
+                 viewsets.GenericViewSet):
+    """
+    API endpoint for background jobs.
+    """
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    pagination_class = JobCursorPagination
+
+    def get_queryset(self):
+        jobs = super().get_queryset()
+        for field in ('status', 'name'):
+            value = self.request.query_params.get(field)
+            if value:
+                jobs = jobs.filter(**{field: value})
+        return jobs
+
+    def create(self, request, *args, **kwargs):
+        """Queue one of the maintenance tasks by name."""
+        if not isinstance(request.data, dict):
+            raise ValidationError({'non_field_errors': ['Expected an object with a task name.']})
+        name = request.data.get('name')
+        if name not in maintenance.MAINTENANCE_TASKS:
+            return Response({'name': [f'Must be one of: {", ".join(maintenance.MAINTENANCE_TASKS)}.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return job_accepted(request, tasks.enqueue(name))
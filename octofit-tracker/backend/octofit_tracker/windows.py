@@ -0,0 +1,252 @@
+"""
+Time-windowed leaderboards.
+
+A window is a day, an ISO week, a calendar month or a custom range of
+days.  The first read of a window materializes its result set in
+``leaderboard_window_entries``, one document per user with totals summed
+from the daily user rollups, so no activity history is scanned.  From then
+on every activity write applies its delta to each materialized window that
+contains it, and reads are a single indexed query.
+
+Each window has a header in ``leaderboard_windows``.  Headers and entries
+carry an ``expires_at`` date under a TTL index, so Mongo drops them on its
+own: day, week and month windows ``OCTOFIT_WINDOW_RETENTION_DAYS`` after
+they close and custom ranges ``OCTOFIT_WINDOW_CUSTOM_TTL`` seconds after
+they are built.  A window read after it expired is materialized again.
+
+Only one caller builds a window at a time, under a per-window
+``mongo.lock``; concurrent first reads wait for it and return the header
+it stored.  The build reads the rollups under ``events.rebuilding``, so no
+write is halfway between its rollup and window updates, and stores the
+header, marked ``building``, before letting writes in again.  Writes
+from then on apply their deltas to the window while the build adds the
+totals it read, both with ``$inc``, so none is lost or counted twice.
+Reads never serve a window still marked ``building``.  ``reset``, called
+by the leaderboard and rollup rebuilds, drops every window so they are
+rebuilt from the rollups.
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from pymongo import UpdateOne
+from rest_framework.exceptions import ValidationError
+
+from . import events, leaderboard, mongo
+from .models import User
+from .rollups import DAILY, day_bucket, week_bucket
+from .stats import parse_bound
+
+WINDOWS = 'leaderboard_windows'
+ENTRIES = 'leaderboard_window_entries'
+
+PERIODS = ('day', 'week', 'month', 'custom')
+
+
+def month_bucket(moment):
+    """Return the key and start of the calendar month containing ``moment``."""
+    start = datetime(moment.year, moment.month, 1)
+    return start.strftime('%Y-%m'), start
+
+
+def bounds(period, moment):
+    """Return ``(key, start, end)`` of the day, week or month window containing ``moment``."""
+    if period == 'day':
+        key, start = day_bucket(moment)
+        return key, start, start + timedelta(days=1)
+    if period == 'week':
+        key, start = week_bucket(moment)
+        return key, start, start + timedelta(days=7)
+    key, start = month_bucket(moment)
+    return key, start, month_bucket(start + timedelta(days=31))[1]
+
+
+def custom_bounds(start, end):
+    """Return ``(key, start, end)`` of a custom window widened to whole days, ``end`` exclusive."""
+    start = day_bucket(start)[1]
+    end_day = day_bucket(end)[1]
+    end = end_day if end == end_day else end_day + timedelta(days=1)
+    return f'{start:%Y-%m-%d}..{end:%Y-%m-%d}', start, end
+
+
+def parse_window(params):
+    """Validate the ``period``, ``date``, ``start`` and ``end`` query parameters."""
+    period = params.get('period') or 'week'
+    if period not in PERIODS:
+        raise ValidationError({'period': f'Must be one of: {", ".join(PERIODS)}.'})
+    if period != 'custom':
+        return (period, *bounds(period, parse_bound(params.get('date'), 'date') or mongo.now()))
+    start, end = parse_bound(params.get('start'), 'start'), parse_bound(params.get('end'), 'end')
+    if not start or not end:
+        raise ValidationError({'start': 'A custom window needs both start and end.'})
+    if end <= start:
+        raise ValidationError({'end': 'Must be after start.'})
+    if end - start > timedelta(days=settings.OCTOFIT_WINDOW_MAX_DAYS):
+        raise ValidationError({'end': f'Custom windows span at most {settings.OCTOFIT_WINDOW_MAX_DAYS} days.'})
+    return ('custom', *custom_bounds(start, end))
+
+
+def parse_limit(value):
+    """Validate a ``limit`` query parameter, defaulting to 10."""
+    if value in (None, ''):
+        return 10
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= settings.OCTOFIT_WINDOW_MAX_LIMIT:
+        raise ValidationError({'limit': f'Must be an integer between 1 and {settings.OCTOFIT_WINDOW_MAX_LIMIT}.'})
+    return limit
+
+
+def _expiry(period, end):
+    soon = mongo.now() + timedelta(seconds=settings.OCTOFIT_WINDOW_CUSTOM_TTL)
+    if period == 'custom':
+        return soon
+    # Windows read long after they closed are kept briefly rather than expiring on arrival.
+    return max(end + timedelta(days=settings.OCTOFIT_WINDOW_RETENTION_DAYS[period]), soon)
+
+
+def _users(user_ids):
+    ids = [int(user_id) for user_id in user_ids if str(user_id).isdigit()]
+    users = mongo.collection(User).find({'id': {'$in': ids}}, {'id': 1, 'name': 1, 'alias': 1, 'team_id': 1, '_id': 0})
+    return {
+        str(user['id']): {'user_name': user.get('name', ''), 'user_alias': user.get('alias', ''),
+                          'team_id': user.get('team_id', '')}
+        for user in users
+    }
+
+
+def _built(window_id):
+    return mongo.get_db()[WINDOWS].find_one(
+        {'_id': window_id, 'building': {'$ne': True}, 'expires_at': {'$gt': mongo.now()}})
+
+
+def materialize(period, key, start, end):
+    """Compute a window's entries from the daily user rollups and return its header."""
+    db = mongo.get_db()
+    window_id = f'{period}:{key}'
+    with mongo.lock(f'window:{window_id}'):
+        built = _built(window_id)
+        if built:
+            # Built by the caller this one waited for.
+            return built
+        expires_at = _expiry(period, end)
+        header = {'period': period, 'key': key, 'start': start, 'end': end, 'built_at': mongo.now(),
+                  'expires_at': expires_at}
+        with events.rebuilding():
+            # Entries of an earlier or interrupted build are replaced, not added to.
+            db[ENTRIES].delete_many({'window': window_id})
+            db[WINDOWS].update_one({'_id': window_id}, {'$set': {**header, 'building': True}}, upsert=True)
+            rows = list(db[DAILY].aggregate([
+                {'$match': {'scope': 'user', 'start': {'$gte': start, '$lt': end}}},
+                {'$group': {
+                    '_id': '$key',
+                    'total_calories': {'$sum': '$calories'},
+                    'total_workouts': {'$sum': '$workouts'},
+                    'total_minutes': {'$sum': '$minutes'},
+                    'total_distance_km': {'$sum': '$distance_km'},
+                }},
+                {'$match': {'total_workouts': {'$gt': 0}}},
+            ], allowDiskUse=True))
+        users = _users(row['_id'] for row in rows)
+        operations = []
+        for row in rows:
+            user_id = str(row.pop('_id'))
+            operations.append(UpdateOne({'_id': f'{window_id}:{user_id}'}, {
+                '$inc': {**row, 'total_distance_km': round(row['total_distance_km'], 2)},
+                '$set': {'window': window_id, 'user_id': user_id, 'expires_at': expires_at,
+                         **users.get(user_id, {'user_name': '', 'user_alias': '', 'team_id': ''})},
+            }, upsert=True))
+        size = settings.OCTOFIT_BULK_BATCH_SIZE
+        for offset in range(0, len(operations), size):
+            db[ENTRIES].bulk_write(operations[offset:offset + size], ordered=False)
+        db[WINDOWS].update_one({'_id': window_id}, {'$set': {'building': False}})
+    return {'_id': window_id, **header, 'building': False}
+
+
+def get_window(period, key, start, end):
+    """Return a window's header, materializing the window if it is not stored, still building or has expired."""
+    return _built(f'{period}:{key}') or materialize(period, key, start, end)
+
+
+def ranked(header, limit):
+    """Return the ``limit`` best entries of a window by calories, ranked from 1."""
+    entries = mongo.get_db()[ENTRIES].find(
+        {'window': header['_id'], 'total_workouts': {'$gt': 0}},
+        {'_id': 0, 'user_id': 1, 'user_name': 1, 'user_alias': 1, 'team_id': 1,
+         **dict.fromkeys(leaderboard.TOTAL_FIELDS, 1)},
+    ).sort([('total_calories', -1), ('user_id', 1)]).limit(limit)
+    return [{'rank': rank, **entry} for rank, entry in enumerate(entries, 1)]
+
+
+def _apply(changes):
+    """Apply ``(activity, sign)`` pairs to every materialized window containing them."""
+    if not changes:
+        return
+    db = mongo.get_db()
+    moments = [mongo.naive_utc(activity.activity_date) for activity, _ in changes]
+    fixed = {f'{period}:{bounds(period, moment)[0]}' for moment in moments for period in PERIODS[:-1]}
+    headers = list(db[WINDOWS].find({
+        '$or': [
+            {'_id': {'$in': sorted(fixed)}},
+            {'period': 'custom', 'start': {'$lte': max(moments)}, 'end': {'$gt': min(moments)}},
+        ],
+        'expires_at': {'$gt': mongo.now()},
+    }))
+    if not headers:
+        return
+    users = _users({activity.user_id for activity, _ in changes})
+    updates = {}
+    for (activity, sign), moment in zip(changes, moments):
+        user_id = str(activity.user_id)
+        for header in headers:
+            if not header['start'] <= moment < header['end']:
+                continue
+            update = updates.setdefault((header['_id'], user_id), {
+                '$inc': dict.fromkeys(leaderboard.TOTAL_FIELDS, 0),
+                '$setOnInsert': {
+                    'window': header['_id'], 'user_id': user_id, 'expires_at': header['expires_at'],
+                    **users.get(user_id, {'user_name': '', 'user_alias': '', 'team_id': ''}),
+                },
+            })
+            inc = update['$inc']
+            inc['total_calories'] += sign * activity.calories_burned
+            inc['total_workouts'] += sign
+            inc['total_minutes'] += sign * activity.duration_minutes
+            inc['total_distance_km'] += sign * (activity.distance_km or 0.0)
+    operations = [UpdateOne({'_id': f'{window_id}:{user_id}'}, update, upsert=True)
+                  for (window_id, user_id), update in updates.items()]
+    if operations:
+        db[ENTRIES].bulk_write(operations, ordered=False)
+
+
+def record_activities(activities):
+    """Add new activities to the windows containing them."""
+    _apply([(activity, 1) for activity in activities])
+
+
+def discard_activity(activity):
+    """Remove a deleted activity from the windows containing it."""
+    _apply([(activity, -1)])
+
+
+def replace_activity(previous, activity):
+    """Move an updated activity's contribution from its old values to its new ones."""
+    _apply([(previous, -1), (activity, 1)])
+
+
+def change_team(user_id, team_id):
+    """Move a user's window entries to another team."""
+    mongo.get_db()[ENTRIES].update_many({'user_id': str(user_id)}, {'$set': {'team_id': team_id}})
+
+
+def remove_user(user_id):
+    """Drop a deleted user's window entries."""
+    mongo.get_db()[ENTRIES].delete_many({'user_id': str(user_id)})
+
+
+def reset():
+    """Drop every materialized window so each is rebuilt from the rollups on its next read."""
+    db = mongo.get_db()
+    db[WINDOWS].delete_many({})
+    db[ENTRIES].delete_many({})
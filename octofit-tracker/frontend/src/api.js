@@ -0,0 +1,85 @@
+import { useState, useEffect, useCallback, useRef } from 'react';
+
+// Fetch one page of a list endpoint; returns its rows and the cursor link to the next page, if any.
+export async function fetchPage(url) {
+  const response = await fetch(url);
+  if (!response.ok) {
+    throw new Error(`HTTP error! status: ${response.status}`);
+  }
+  const data = await response.json();
+  // Handle both paginated (.results) and plain array responses
+  if (!Array.isArray(data.results)) {
+    return { results: Array.isArray(data) ? data : [], next: null };
+  }
+  return { results: data.results, next: data.next };
+}
+
+// Follow `next` to the last page. Only for small reference lists such as the teams used to label rows.
+export async function fetchAllPages(url, pageSize = 500) {
+  const results = [];
+  let next = `${url}${url.includes('?') ? '&' : '?'}page_size=${pageSize}`;
+  while (next) {
+    const page = await fetchPage(next);
+    results.push(...page.results);
+    next = page.next;
+  }
+  return results;
+}
+
+// Load the first page of a cursor paginated list, and the following pages on demand through `loadMore`.
+// `reload` fetches the rows loaded so far again, for lists whose order shifts under the client.
+export function useCursorList(url) {
+  const [items, setItems] = useState([]);
+  const [next, setNext] = useState(null);
+  const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [error, setError] = useState(null);
+  const loaded = useRef(0);
+  loaded.current = items.length;
+
+  useEffect(() => {
+    console.log('Fetching from:', url);
+    fetchPage(url)
+      .then(page => {
+        setItems(page.results);
+        setNext(page.next);
+      })
+      .catch(error => {
+        console.error('Error fetching from:', url, error);
+        setError(error.message);
+      })
+      .finally(() => setLoading(false));
+  }, [url]);
+
+  const loadMore = useCallback(() => {
+    if (!next || loadingMore) return;
+    setLoadingMore(true);
+    fetchPage(next)
+      .then(page => {
+        setItems(current => [...current, ...page.results]);
+        setNext(page.next);
+      })
+      .catch(error => {
+        console.error('Error fetching from:', next, error);
+        setError(error.message);
+      })
+      .finally(() => setLoadingMore(false));
+  }, [next, loadingMore]);
+
+  const reload = useCallback(() => {
+    const wanted = Math.max(loaded.current, 1);
+    const rows = [];
+    const follow = pageUrl => fetchPage(pageUrl).then(page => {
+      rows.push(...page.results);
+      return page.next && rows.length < wanted ? follow(page.next) : page.next;
+    });
+    follow(url)
+      .then(following => {
+        setItems(rows);
+        setNext(following);
+      })
+      .catch(error => console.error('Error reloading from:', url, error));
+  }, [url]);
+
+  return { items, setItems, loading, loadingMore, error, hasMore: Boolean(next), loadMore, reload };
+}
@@ -1,37 +1,23 @@
-import React, { useState, useEffect } from 'react';
+import React, { useEffect } from 'react';
+import { useCursorList } from '../api';
+import LoadMore from './LoadMore';
 
 function Activities() {
-  const [activities, setActivities] = useState([]);
-  const [loading, setLoading] = useState(true);
-  const [error, setError] = useState(null);
-
   const API_URL = `https://${process.env.REACT_APP_CODESPACE_NAME || 'expert-space-chainsaw-7v76jvq44wvv2x46w'}-8000.app.github.dev/api/activities/`;
 
+  const { items: activities, setItems: setActivities, loading, loadingMore, error, hasMore, loadMore } = useCursorList(API_URL);
+
   useEffect(() => {
-    console.log('Fetching activities from:', API_URL);
-    
-    fetch(API_URL)
-      .then(response => {
-        console.log('Activities API response status:', response.status);
-        if (!response.ok) {
-          throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        return response.json();
-      })
-      .then(data => {
-        console.log('Activities API raw data:', data);
-        // Handle both paginated (.results) and plain array responses
-        const activitiesData = data.results || data;
-        console.log('Activities data processed:', activitiesData);
-        setActivities(Array.isArray(activitiesData) ? activitiesData : []);
-        setLoading(false);
-      })
-      .catch(error => {
-        console.error('Error fetching activities:', error);
-        setError(error.message);
-        setLoading(false);
-      });
-  }, [API_URL]);
+    // New activities are pushed over Server-Sent Events when the backend runs on ASGI.
+    if (!window.EventSource) return undefined;
+    const source = new EventSource(API_URL.replace('/activities/', '/live/') + '?channels=activities');
+    source.addEventListener('update', event => {
+      const { activities: created } = JSON.parse(event.data);
+      if (!created) return;
+      setActivities(current => [...created.reverse(), ...current]);
+    });
+    return () => source.close();
+  }, [API_URL, setActivities]);
 
   if (loading) return <div className="alert alert-info">Loading activities...</div>;
   if (error) return <div className="alert alert-danger">Error: {error}</div>;
@@ -75,6 +61,7 @@ function Activities() {
           </tbody>
         </table>
       </div>
+      <LoadMore hasMore={hasMore} loading={loadingMore} onClick={loadMore} />
     </div>
   );
 }
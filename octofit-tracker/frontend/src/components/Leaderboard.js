@@ -1,53 +1,54 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
+import { fetchAllPages, useCursorList } from '../api';
+import LoadMore from './LoadMore';
 
 function Leaderboard() {
-  const [leaderboard, setLeaderboard] = useState([]);
   const [teams, setTeams] = useState({});
-  const [loading, setLoading] = useState(true);
-  const [error, setError] = useState(null);
 
   const API_URL = `https://${process.env.REACT_APP_CODESPACE_NAME || 'expert-space-chainsaw-7v76jvq44wvv2x46w'}-8000.app.github.dev/api/leaderboard/`;
 
+  const { items: leaderboard, setItems: setLeaderboard, loading, loadingMore, error, hasMore, loadMore, reload } = useCursorList(API_URL);
+  const shown = useRef([]);
+  shown.current = leaderboard;
+
   useEffect(() => {
-    console.log('Fetching leaderboard from:', API_URL);
     const teamsURL = API_URL.replace('/leaderboard/', '/teams/');
-    
-    // Fetch teams first to map team_id to team name
-    Promise.all([
-      fetch(API_URL),
-      fetch(teamsURL)
-    ])
-      .then(([leaderboardRes, teamsRes]) => {
-        if (!leaderboardRes.ok || !teamsRes.ok) {
-          throw new Error('Failed to fetch data');
-        }
-        return Promise.all([leaderboardRes.json(), teamsRes.json()]);
-      })
-      .then(([leaderboardData, teamsData]) => {
-        console.log('Leaderboard API raw data:', leaderboardData);
-        console.log('Teams API raw data:', teamsData);
-        
-        // Create teams lookup map
-        const teamsArray = teamsData.results || teamsData;
+    console.log('Fetching teams from:', teamsURL);
+
+    // Map team_id to team name
+    fetchAllPages(teamsURL)
+      .then(teamsArray => {
         const teamsMap = {};
         teamsArray.forEach(team => {
           teamsMap[team._id || team.id] = team.name;
         });
-        
-        const leaderboardArray = leaderboardData.results || leaderboardData;
-        console.log('Leaderboard data processed:', leaderboardArray);
-        
         setTeams(teamsMap);
-        setLeaderboard(Array.isArray(leaderboardArray) ? leaderboardArray : []);
-        setLoading(false);
       })
-      .catch(error => {
-        console.error('Error fetching leaderboard:', error);
-        setError(error.message);
-        setLoading(false);
-      });
+      .catch(error => console.error('Error fetching teams:', error));
   }, [API_URL]);
 
+  useEffect(() => {
+    // Rank changes are pushed over Server-Sent Events when the backend runs on ASGI.
+    if (!window.EventSource) return undefined;
+    const source = new EventSource(API_URL.replace('/leaderboard/', '/live/') + '?channels=leaderboard');
+    source.addEventListener('update', event => {
+      const { leaderboard: changes } = JSON.parse(event.data);
+      if (!changes) return;
+      // Only the top entries are pushed. When a user joins, leaves or is deleted from them,
+      // every rank below shifts, so the rows shown are fetched again instead.
+      const userIds = new Set(shown.current.map(entry => entry.user_id));
+      if (changes.dropped.length || changes.deleted.length || changes.changed.some(entry => !userIds.has(entry.user_id))) {
+        reload();
+        return;
+      }
+      const changed = new Map(changes.changed.map(entry => [entry.user_id, entry]));
+      setLeaderboard(current => current
+        .map(entry => changed.get(entry.user_id) || entry)
+        .sort((a, b) => a.rank - b.rank || a.id - b.id));
+    });
+    return () => source.close();
+  }, [API_URL, setLeaderboard, reload]);
+
   if (loading) return <div className="alert alert-info">Loading leaderboard...</div>;
   if (error) return <div className="alert alert-danger">Error: {error}</div>;
 
@@ -98,6 +99,7 @@ function Leaderboard() {
           </tbody>
         </table>
       </div>
+      <LoadMore hasMore={hasMore} loading={loadingMore} onClick={loadMore} />
     </div>
   );
 }
@@ -0,0 +1,15 @@
+import React from 'react';
+
+function LoadMore({ hasMore, loading, onClick }) {
+  if (!hasMore) return null;
+
+  return (
+    <div className="card-footer text-center">
+      <button className="btn btn-outline-primary" onClick={onClick} disabled={loading}>
+        {loading ? 'Loading...' : 'Load more'}
+      </button>
+    </div>
+  );
+}
+
+export default LoadMore;
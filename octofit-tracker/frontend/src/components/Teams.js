@@ -1,37 +1,11 @@
-import React, { useState, useEffect } from 'react';
+import React from 'react';
+import { useCursorList } from '../api';
+import LoadMore from './LoadMore';
 
 function Teams() {
-  const [teams, setTeams] = useState([]);
-  const [loading, setLoading] = useState(true);
-  const [error, setError] = useState(null);
-
   const API_URL = `https://${process.env.REACT_APP_CODESPACE_NAME || 'expert-space-chainsaw-7v76jvq44wvv2x46w'}-8000.app.github.dev/api/teams/`;
 
-  useEffect(() => {
-    console.log('Fetching teams from:', API_URL);
-    
-    fetch(API_URL)
-      .then(response => {
-        console.log('Teams API response status:', response.status);
-        if (!response.ok) {
-          throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        return response.json();
-      })
-      .then(data => {
-        console.log('Teams API raw data:', data);
-        // Handle both paginated (.results) and plain array responses
-        const teamsData = data.results || data;
-        console.log('Teams data processed:', teamsData);
-        setTeams(Array.isArray(teamsData) ? teamsData : []);
-        setLoading(false);
-      })
-      .catch(error => {
-        console.error('Error fetching teams:', error);
-        setError(error.message);
-        setLoading(false);
-      });
-  }, [API_URL]);
+  const { items: teams, loading, loadingMore, error, hasMore, loadMore } = useCursorList(API_URL);
 
   if (loading) return <div className="alert alert-info">Loading teams...</div>;
   if (error) return <div className="alert alert-danger">Error: {error}</div>;
@@ -73,6 +47,7 @@ function Teams() {
           </tbody>
         </table>
       </div>
+      <LoadMore hasMore={hasMore} loading={loadingMore} onClick={loadMore} />
     </div>
   );
 }
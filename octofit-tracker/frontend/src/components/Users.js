@@ -1,10 +1,9 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect } from 'react';
+import { fetchAllPages, useCursorList } from '../api';
+import LoadMore from './LoadMore';
 
 function Users() {
-  const [users, setUsers] = useState([]);
   const [teams, setTeams] = useState([]);
-  const [loading, setLoading] = useState(true);
-  const [error, setError] = useState(null);
   const [showModal, setShowModal] = useState(false);
   const [editingUser, setEditingUser] = useState(null);
   const [formData, setFormData] = useState({
@@ -19,41 +18,15 @@ function Users() {
   const API_URL = `https://${process.env.REACT_APP_CODESPACE_NAME || 'expert-space-chainsaw-7v76jvq44wvv2x46w'}-8000.app.github.dev/api/users/`;
   const TEAMS_URL = API_URL.replace('/users/', '/teams/');
 
-  const fetchData = useCallback(() => {
-    console.log('Fetching users from:', API_URL);
-    console.log('Fetching teams from:', TEAMS_URL);
-    
-    Promise.all([
-      fetch(API_URL),
-      fetch(TEAMS_URL)
-    ])
-      .then(([usersRes, teamsRes]) => {
-        if (!usersRes.ok || !teamsRes.ok) {
-          throw new Error('Failed to fetch data');
-        }
-        return Promise.all([usersRes.json(), teamsRes.json()]);
-      })
-      .then(([usersData, teamsData]) => {
-        console.log('Users API raw data:', usersData);
-        console.log('Teams API raw data:', teamsData);
-        
-        const usersArray = usersData.results || usersData;
-        const teamsArray = teamsData.results || teamsData;
-        
-        setUsers(Array.isArray(usersArray) ? usersArray : []);
-        setTeams(Array.isArray(teamsArray) ? teamsArray : []);
-        setLoading(false);
-      })
-      .catch(error => {
-        console.error('Error fetching data:', error);
-        setError(error.message);
-        setLoading(false);
-      });
-  }, [API_URL, TEAMS_URL]);
+  const { items: users, setItems: setUsers, loading, loadingMore, error, hasMore, loadMore } = useCursorList(API_URL);
 
   useEffect(() => {
-    fetchData();
-  }, [fetchData]);
+    // Teams label the rows and fill the team picker, so the whole (short) list is loaded.
+    console.log('Fetching teams from:', TEAMS_URL);
+    fetchAllPages(TEAMS_URL)
+      .then(setTeams)
+      .catch(error => console.error('Error fetching teams:', error));
+  }, [TEAMS_URL]);
 
   const handleEdit = (user) => {
     setEditingUser(user);
@@ -104,8 +77,9 @@ function Users() {
         throw new Error('Failed to update user');
       }
 
-      // Refresh data
-      fetchData();
+      // Replace the edited row in place so the pages already loaded stay put
+      const updated = await response.json();
+      setUsers(current => current.map(user => (user.id === updated.id ? updated : user)));
       handleClose();
     } catch (error) {
       console.error('Error updating user:', error);
@@ -172,6 +146,7 @@ function Users() {
             </tbody>
           </table>
         </div>
+        <LoadMore hasMore={hasMore} loading={loadingMore} onClick={loadMore} />
       </div>
 
       {/* Edit User Modal */}
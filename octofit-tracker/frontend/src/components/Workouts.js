@@ -1,37 +1,11 @@
-import React, { useState, useEffect } from 'react';
+import React from 'react';
+import { useCursorList } from '../api';
+import LoadMore from './LoadMore';
 
 function Workouts() {
-  const [workouts, setWorkouts] = useState([]);
-  const [loading, setLoading] = useState(true);
-  const [error, setError] = useState(null);
-
   const API_URL = `https://${process.env.REACT_APP_CODESPACE_NAME || 'expert-space-chainsaw-7v76jvq44wvv2x46w'}-8000.app.github.dev/api/workouts/`;
 
-  useEffect(() => {
-    console.log('Fetching workouts from:', API_URL);
-    
-    fetch(API_URL)
-      .then(response => {
-        console.log('Workouts API response status:', response.status);
-        if (!response.ok) {
-          throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        return response.json();
-      })
-      .then(data => {
-        console.log('Workouts API raw data:', data);
-        // Handle both paginated (.results) and plain array responses
-        const workoutsData = data.results || data;
-        console.log('Workouts data processed:', workoutsData);
-        setWorkouts(Array.isArray(workoutsData) ? workoutsData : []);
-        setLoading(false);
-      })
-      .catch(error => {
-        console.error('Error fetching workouts:', error);
-        setError(error.message);
-        setLoading(false);
-      });
-  }, [API_URL]);
+  const { items: workouts, loading, loadingMore, error, hasMore, loadMore } = useCursorList(API_URL);
 
   if (loading) return <div className="alert alert-info">Loading workouts...</div>;
   if (error) return <div className="alert alert-danger">Error: {error}</div>;
@@ -80,6 +54,7 @@ function Workouts() {
           </tbody>
         </table>
       </div>
+      <LoadMore hasMore={hasMore} loading={loadingMore} onClick={loadMore} />
     </div>
   );
 }